@@ -9,9 +9,11 @@
 
 #include <vector>
 #include <list>
+#include <deque>
 #include <map>
 #include <set>
 #include <algorithm>
+#include <iterator>
 
 #include "MMap.h"
 
@@ -31,8 +33,18 @@ enum
 	FT_TAIL       = 1,
 	FT_PATH       = 2,
 	FT_QUICKBUILD = 4,
+	FT_ALPHABET   = 8,
 };
 
+/** @brief thrown as an int by building when sizes exceed SizeT, e.g. 2^31
+ *  nodes or values of a Trie, or 2^32 items of Vectors of a uint32_t SizeT,
+ *  to build again with a uint64_t SizeT */
+enum { FT_OVERFLOW = -2 };
+
+/** @brief thrown as an int by building a HashMap by PerfectHash when keys
+ *  have the same hash, which no seed displaces into distinct slots */
+enum { FT_COLLISION = -3 };
+
 template <class T>
 struct Range /// range of objects
 {
@@ -77,6 +89,11 @@ inline Range<char> range(char *key)
 	return Range<char>(key, key + strlen(key));
 }
 template <class T>
+inline Range<T> range(const Range<T> &key)
+{
+	return key;
+}
+template <class T>
 inline Range<T> range(T *key)
 {
 	T *end = key;
@@ -118,6 +135,249 @@ private:
 	}
 };
 
+/** @brief hash various types into uint64_t, and lay HashMap out by a static
+ *         perfect hash
+ *
+ * As HashT of a HashMap, e.g. HashMap<Vector<char>, int, PerfectHash>, keys
+ * are hashed into buckets of about FT_BUCKET keys, and each bucket gets a
+ * seed that displaces its keys into distinct slots, exactly one key a slot
+ * (CHD, "compress, hash and displace"). A lookup is one hash, one seed and
+ * one key compare, instead of walking a chain, at the cost of a SizeT seed
+ * per bucket and a slower build.
+ */
+class PerfectHash
+{
+public:
+	template <class T>
+	uint64_t operator ()(const T &key) const { return hash(range(key)); }
+
+	/// average number of keys in a bucket
+	enum { FT_BUCKET = 4 };
+
+	/// bucket of a hash in n buckets
+	static size_t bucket(uint64_t hash, size_t n) { return reduce(hash, n); }
+
+	/// slot of a hash displaced by a seed in n slots
+	static size_t displace(uint64_t hash, uint64_t seed, size_t n)
+	{
+		return reduce(mix(hash + seed * 0x9E3779B97F4A7C15ULL), n);
+	}
+
+	/// flag of a seed of a bucket of one key, whose other bits are the slot
+	template <class SizeT>
+	static SizeT direct() { return (SizeT)1 << (sizeof(SizeT) * 8 - 1); }
+
+private:
+	/* MurmurHash64A */
+	template <class T>
+	uint64_t hash(Range<T> r) const
+	{
+		static const uint64_t m = 0xC6A4A7935BD1E995ULL;
+
+		size_t length = (const uint8_t *)r.end - (const uint8_t *)r.begin;
+		const uint8_t *p = (const uint8_t *)r.begin;
+		const uint8_t *end = p + (length & ~(size_t)7);
+		uint64_t h = length * m;
+
+		for (; p != end; p += 8)
+		{
+			uint64_t k;
+			memcpy(&k, p, 8);
+			k *= m; k ^= k >> 47; k *= m;
+			h ^= k; h *= m;
+		}
+
+		switch (length & 7)
+		{
+		case 7: h ^= (uint64_t)p[6] << 48;
+		case 6: h ^= (uint64_t)p[5] << 40;
+		case 5: h ^= (uint64_t)p[4] << 32;
+		case 4: h ^= (uint64_t)p[3] << 24;
+		case 3: h ^= (uint64_t)p[2] << 16;
+		case 2: h ^= (uint64_t)p[1] << 8;
+		case 1: h ^= (uint64_t)p[0]; h *= m;
+		}
+
+		return mix(h);
+	}
+
+	/* scale a hash into [0, n) by multiplying, cheaper than a modulo */
+	static size_t reduce(uint64_t hash, size_t n)
+	{
+		return (size_t)(((unsigned __int128)hash * n) >> 64);
+	}
+
+	/* finalizer of MurmurHash3, every bit of h affects every bit of result */
+	static uint64_t mix(uint64_t h)
+	{
+		h ^= h >> 33; h *= 0xFF51AFD7ED558CCDULL;
+		h ^= h >> 33; h *= 0xC4CEB9FE1A85EC53ULL;
+		h ^= h >> 33;
+		return h;
+	}
+};
+
+/* whether HashT lays HashMap out by a static perfect hash */
+template <class HashT> struct IsPerfectHash              { enum { value = false }; };
+template <>            struct IsPerfectHash<PerfectHash> { enum { value = true  }; };
+
+/** @brief receiver of phases and statistics of building containers
+ *
+ * Set buildObserver() to an instance of a subclass, then each Trie and
+ * HashMap being built calls begin(), enters its phases one after another,
+ * counts its structure, and calls end(). Containers nested in values are
+ * built within a phase of their outer containers, "values" of a Trie.
+ */
+class BuildObserver
+{
+public:
+	virtual ~BuildObserver() {}
+
+	/// a container of some kind, e.g. "Trie", begins building
+	virtual void begin(const char *kind) {}
+	/// the container enters a phase, e.g. "placement"
+	virtual void phase(const char *name) {}
+	/// a statistic of the container, e.g. "nodes"
+	virtual void count(const char *name, double value) {}
+	/// the container ends building
+	virtual void end() {}
+};
+
+/** @brief the observer of building, none by default */
+inline BuildObserver *&buildObserver()
+{
+	static BuildObserver *observer = 0;
+	return observer;
+}
+
+/** @brief sorted and uniqued key-value list for building a Trie
+ *
+ * A compact substitute for std::map when the input is already sorted: keys
+ * are appended to one character arena with an offset each, instead of a tree
+ * node and a heap allocated std::vector per key.
+ *
+ * @tparam CharT  character type of keys
+ * @tparam ValueT value type
+ */
+template <class CharT, class ValueT>
+class SortedMap
+{
+public:
+	class Key /// key in the arena, looks like a const std::vector<CharT>
+	{
+	public:
+		Key(const CharT *b, const CharT *e) : m_begin(b), m_end(e) {}
+
+		const CharT *begin() const { return m_begin; }
+		const CharT *end()   const { return m_end; }
+		size_t size() const { return m_end - m_begin; }
+		const CharT &operator [](size_t i) const { return m_begin[i]; }
+
+	private:
+		const CharT *m_begin;
+		const CharT *m_end;
+	};
+
+	struct Entry /// looks like a std::pair<const Key, ValueT>
+	{
+		typedef Key    first_type;
+		typedef ValueT second_type;
+
+		Entry(const Key &k, const ValueT &v) : first(k), second(v) {}
+
+		const Key     first;
+		const ValueT &second;
+	};
+
+	class const_iterator
+	{
+	public:
+		typedef std::forward_iterator_tag iterator_category;
+		typedef Entry                     value_type;
+		typedef ptrdiff_t                 difference_type;
+		typedef const Entry *             pointer;
+		typedef const Entry &             reference;
+
+		struct Proxy /// holds the Entry returned by operator ->
+		{
+			Proxy(const Entry &e) : entry(e) {}
+			const Entry *operator ->() const { return &entry; }
+
+			Entry entry;
+		};
+
+		const_iterator() : m_map(0), m_i(0) {}
+		const_iterator(const SortedMap *m, size_t i) : m_map(m), m_i(i) {}
+
+		Entry operator *() const
+		{
+			return Entry(Key(m_map->keys() + m_map->m_offsets[m_i],
+					m_map->keys() + m_map->m_offsets[m_i + 1]), m_map->m_values[m_i]);
+		}
+		Proxy operator ->() const { return Proxy(**this); }
+
+		const_iterator &operator ++()    { ++ m_i; return *this; }
+		const_iterator  operator ++(int) { return const_iterator(m_map, m_i ++); }
+
+		bool operator ==(const const_iterator &x) const { return m_i == x.m_i; }
+		bool operator !=(const const_iterator &x) const { return m_i != x.m_i; }
+
+	private:
+		const SortedMap *m_map;
+		size_t           m_i;
+	};
+
+	typedef const_iterator iterator;
+
+	SortedMap() : m_offsets(1, 0) {}
+
+	const_iterator begin() const { return const_iterator(this, 0); }
+	const_iterator end()   const { return const_iterator(this, size()); }
+
+	size_t size()  const { return m_values.size(); }
+	bool   empty() const { return m_values.empty(); }
+
+	/** @brief append a key and return its value
+	 *
+	 * @param[in]  key      key to be appended, which must be greater than the
+	 *                      last key appended
+	 * @return     reference to the value of key, default constructed
+	 * @throw      int      key is not greater than the last key
+	 */
+	ValueT &operator [](const std::vector<CharT> &key)
+	{
+		if (!empty() && !std::lexicographical_compare(
+				keys() + m_offsets[size() - 1], keys() + m_offsets[size()],
+				key.begin(), key.end()))
+			throw int(-1);
+
+		m_keys.insert(m_keys.end(), key.begin(), key.end());
+		m_offsets.push_back(m_keys.size());
+		m_values.push_back(ValueT());
+
+		return m_values.back();
+	}
+
+	/** @brief do nothing, keys and values are released by clear() only */
+	void erase(const_iterator) {}
+	/** @brief release all keys and values */
+	void clear()
+	{
+		std::vector<CharT>().swap(m_keys);
+		std::vector<size_t>(1, 0).swap(m_offsets);
+		std::deque<ValueT>().swap(m_values);
+	}
+
+private:
+	const CharT *keys() const { return m_keys.empty() ? 0 : &m_keys[0]; }
+
+	std::vector<CharT>  m_keys;
+	std::vector<size_t> m_offsets;
+	std::deque<ValueT>  m_values;
+
+	friend class const_iterator;
+};
+
 /** @brief container which actually hold data
  *
  * Use this class for loading or building FastTrie.
@@ -162,9 +422,14 @@ public:
 	 * @param[in]  prot     see mmap(2), e.g.: use PROT_WRITE for a force writing.
 	 * @param[in]  flags    see mmap(2), e.g.: use MAP_SHARED | MAP_POPULATE for
 	 *                      a reading-ahead on the file.
-	 * @throw      int      failed (file not exists, unreadable, etc.)
+	 * @param[in]  advice   residency policies of the file, or-ed, e.g.:
+	 *                      FT_MLOCK | FT_WARMUP to have it in memory before
+	 *                      the first lookup, see FT_RANDOM, etc.
+	 * @throw      int      failed (file not exists, unreadable, mlock failed,
+	 *                      etc.)
 	 */
-	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED);
+	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	/** @brief load Container from memory address
 	 *
 	 * @param[in]  begin    memory address to be loaded \n
@@ -197,7 +462,8 @@ public:
 	 *                        ValueT, point to ValueT
 	 *                      - for Vector as ValueT, point to std::vector
 	 *                      - for Trie or HashMap as ValueT, point to std::map or
-	 *                        sorted uniqued std::list<std::pair<key, value> >
+	 *                        sorted uniqued std::list<std::pair<key, value> >,
+	 *                        or SortedMap for Trie
 	 *                      - for Pair as ValueT, point to std::pair
 	 *
 	 * @param[out] out      output iterator where data will be written to \n
@@ -227,6 +493,25 @@ public:
 private:
 	const uint8_t * initPointers(const uint8_t *begin, const uint8_t *end = 0);
 
+	/* write the header of a block of numValues values, which follow it */
+	template <class OutIteratorT>
+	static OutIteratorT buildHeader(OutIteratorT out, size_t numValues)
+	{
+		char zeros[16] = { 0 };
+
+		out = std::copy((char *)&numValues, (char *)(&numValues + 1), out);
+		return std::copy(zeros, zeros + sizeof(zeros) - sizeof(numValues), out);
+	}
+	/* write the padding of a block of numValues values to 16 bytes */
+	template <class OutIteratorT>
+	static OutIteratorT buildPadding(OutIteratorT out, size_t numValues)
+	{
+		char zeros[16] = { 0 };
+
+		return std::copy(zeros, zeros + (sizeof(zeros) - sizeof(ValueT) * numValues
+				% sizeof(zeros)) % sizeof(zeros), out);
+	}
+
 	size_t m_numValues;
 	const ValueT *m_values;
 
@@ -251,7 +536,8 @@ public:
 	typedef ReverseIterator<Vector<ValueT, SizeT> > const_reverse_iterator;
 
 	Container();
-	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED);
+	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	Container(const void *begin, const void *end = 0);
 
 	const_iterator begin() const { return const_iterator(this, 0); }
@@ -288,6 +574,9 @@ class Container<Trie<ValueT, option, CharT, SizeT> >
 public:
 	typedef std::map<std::vector<CharT>,
 			typename Container<ValueT>::std_value_type> std_value_type;
+	/// compact std_value_type for building from sorted keys
+	typedef SortedMap<CharT,
+			typename Container<ValueT>::std_value_type> sorted_value_type;
 
 	typedef                 Trie<ValueT, option, CharT, SizeT>   value_type;
 	typedef                 Trie<ValueT, option, CharT, SizeT>   const_reference;
@@ -295,7 +584,8 @@ public:
 	typedef ReverseIterator<Trie<ValueT, option, CharT, SizeT> > const_reverse_iterator;
 
 	Container();
-	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED);
+	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	Container(const void *begin, const void *end = 0);
 
 	const_iterator begin() const { return const_iterator(this, 0); }
@@ -310,6 +600,29 @@ public:
 	static OutIteratorT build(OutIteratorT out, IteratorT begin, IteratorT end,
 			void *skipLast = 0);
 
+	/** @brief build a container of one trie by stitching tries together
+	 *
+	 * Keys of the tries must be in consecutive ranges, e.g. the tries are
+	 * built one by one or in parallel from shards of a sorted key set, cut
+	 * between any keys. The stitched trie finds the same values as the trie
+	 * built from all keys at once. Nodes of prefixes shared by keys of more
+	 * than one trie are placed in memory, and the others are written trie by
+	 * trie as they are read. Only available for ValueT of C primitive types
+	 * or their compositions.
+	 *
+	 * @param[out] out      output iterator where data will be written to
+	 * @param[in]  begin    begin of containers, each holds one trie \n
+	 *                      Values are not read when skipLast is (void *)(-1).
+	 * @param[in]  end      end of containers
+	 * @param[in]  skipLast skip the last block of container (internal use)
+	 * @throw      int      a container does not hold one trie, character
+	 *                      ranges of the tries overlap, or FT_ALPHABET is
+	 *                      specified in option
+	 */
+	template <class OutIteratorT>
+	static OutIteratorT stitch(OutIteratorT out,
+			const Container *begin, const Container *end, void *skipLast = 0);
+
 private:
 	struct Node
 	{
@@ -326,20 +639,126 @@ private:
 		IteratorT begin;
 		IteratorT end;
 		uint32_t  level;
-		uint32_t  count;
+		size_t    count;
 		int32_t   character;
 		SizeT     entry;
 	};
 
+	/* bitmap of free nodes on building, bit i is set if node i is free, and
+	 * the first word of it with a free node, below which no search begins */
+	class FreeNodes
+	{
+	public:
+		FreeNodes() : m_first(0) {}
+
+		/* nodes from the current size up to size are free */
+		void resize(size_t size) { m_bits.resize(size / 64 + 2, ~(uint64_t)0); }
+		/* node i is no longer free */
+		void take(size_t i)
+		{
+			m_bits[i / 64] &= ~((uint64_t)1 << i % 64);
+			while (m_first + 1 < m_bits.size() && !m_bits[m_first]) m_first ++;
+		}
+
+		/* find the first node i >= start, that node i + offset is free for
+		 * every offset in offsets, one of which is 0, 64 candidates at a
+		 * time from the first word with a free node */
+		size_t find(size_t start, const std::vector<size_t> &offsets) const
+		{
+			start = std::max(start, m_first * 64);
+
+			for (size_t i = start / 64 * 64; ; i += 64)
+			{
+				uint64_t candidates = ~(uint64_t)0 << (i < start ? start - i : 0);
+
+				for (size_t j = 0; candidates && j != offsets.size(); j ++)
+					candidates &= window(i + offsets[j]);
+
+				if (candidates) return i + __builtin_ctzll(candidates);
+			}
+		}
+
+	private:
+		/* bits of node i to node i + 63 */
+		uint64_t window(size_t i) const
+		{
+			return i % 64 ? m_bits[i / 64] >> i % 64 | m_bits[i / 64 + 1] << (64 - i % 64)
+					: m_bits[i / 64];
+		}
+
+		std::vector<uint64_t> m_bits;
+		size_t m_first;
+	};
+
 	enum { FT_MARGIN = (1 << sizeof(CharT) * 8) + 1 };
 	enum { FT_MASK = (SizeT)(1) << (sizeof(SizeT) * 8 - 1) };
 	enum { CHAR_TERMINATOR = -1 };
 
 	const uint8_t * initPointers(const uint8_t *begin, const uint8_t *end = 0);
 
+	/* a node of a prefix shared by keys of more than one trie on stitching,
+	 * placed apart with its children */
+	struct SharedNode
+	{
+		SharedNode(size_t parent) : parent(parent), base(0), index(0) {}
+
+		size_t                    parent;     ///< shared node one character up
+		std::map<int32_t, size_t> children;   ///< shared nodes by character
+		std::set<int32_t>         characters; ///< characters of all children
+		SizeT                     base;       ///< where its children go
+		SizeT                     index;      ///< where it goes
+	};
+
+	/* nodes of a trie on stitching, which go with shared nodes, and where
+	 * the others go */
+	struct ShardNodes
+	{
+		std::map<SizeT, size_t> shared; ///< nodes of shared nodes
+		/* tail leaves of shared nodes, moved to the character of a shared
+		 * node, or to its CHAR_TERMINATOR for no tail left */
+		std::map<SizeT, std::pair<size_t, int32_t> > tails;
+		std::map<SizeT, size_t> drops;  ///< characters dropped of moved tails
+		SizeT  shift;                   ///< of nodes not going with shared ones
+		size_t value;                   ///< the first value in the stitched trie
+		size_t last;                    ///< nodes up to last go shifted
+	};
+
+	/* the first or the last key of a trie on stitching */
+	static void edge(const Container &trie, bool last, std::vector<CharT> &key);
+	/* the shared node of character c after shared node s, added if none */
+	static size_t share(std::vector<SharedNode> &shared, size_t s, int32_t c);
+	/* collect the nodes of a trie under node of shared node s, which go with
+	 * shared nodes, and add their other children to the characters of them */
+	static void share(const Container &trie, SizeT node, size_t s,
+			std::vector<SharedNode> &shared, ShardNodes &nodes);
+	/* whether node i of a trie goes shifted (0), with a shared node as its
+	 * child (1), or otherwise apart or nowhere for a free node (2) */
+	static int moved(const Container &trie, const ShardNodes &nodes, SizeT i)
+	{
+		SizeT parent = trie.m_nodes[i].parent;
+
+		if (!parent || nodes.shared.count(i) || nodes.tails.count(i)) return 2;
+		return nodes.shared.count(parent) ? 1 : 0;
+	}
+	/* where node i of a trie goes on stitching */
+	static SizeT place(const Container &trie, const ShardNodes &nodes,
+			const std::vector<SharedNode> &shared, SizeT i);
+	/* children of node i of a trie on stitching, not a tail moved */
+	static SizeT children(const Container &trie, const ShardNodes &nodes, SizeT i);
+
+	/* count the characters of the keys of tries, and code them by FT_ALPHABET:
+	 * codes of characters, one past the alphabet for those not in use,
+	 * characters of codes, and codes in the order of their characters */
+	template <class IteratorT>
+	static void alphabet(IteratorT begin, IteratorT end, std::vector<CharT> &codes,
+			std::vector<CharT> &chars, std::vector<CharT> &order);
+
 	Container<Node>                  m_nodes;
 	Container<SizeT>                 m_paths;
 	Container<Vector<CharT, SizeT> > m_tails;
+	Container<CharT>                 m_codes; ///< only with FT_ALPHABET
+	Container<CharT>                 m_chars; ///< only with FT_ALPHABET
+	Container<CharT>                 m_order; ///< only with FT_ALPHABET
 	Container<ValueT>                m_values;
 
 	static const Node m_defaultNodes[1];
@@ -370,7 +789,8 @@ public:
 	typedef ReverseIterator<HashMap<KeyT, ValueT, HashT, SizeT> > const_reverse_iterator;
 
 	Container() {}
-	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED);
+	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	Container(const void *begin, const void *end = 0);
 
 	const_iterator begin() const { return const_iterator(this, 0); }
@@ -391,6 +811,15 @@ private:
 
 	const uint8_t * initPointers(const uint8_t *begin, const uint8_t *end = 0);
 
+	/* lay a map out in slots of one item each by PerfectHash, and get seeds
+	 * of its buckets */
+	template <class SubIteratorT, class ItemT>
+	static void displace(SubIteratorT begin, SubIteratorT end,
+			std::vector<std::vector<ItemT> > &slots, std::vector<SizeT> &seeds);
+
+	/* For a PerfectHash, seeds of buckets of each map, whose slots are
+	 * buckets of one Pair each in m_maps. Otherwise, empty and not stored. */
+	Container<Vector<SizeT, SizeT> > m_seeds;
 	Container<Vector<Vector<Pair<KeyT, ValueT>, SizeT>, SizeT> > m_maps;
 
 	template <class V>                            friend class Container;
@@ -415,7 +844,8 @@ public:
 	typedef ReverseIterator<Pair<ValueT1, ValueT2> > const_reverse_iterator;
 
 	Container() {}
-	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED);
+	Container(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	Container(const void *begin, const void *end = 0);
 
 	const_iterator begin() const { return const_iterator(this, 0); }
@@ -636,6 +1066,13 @@ private:
  *                - FT_PATH: saves or loads trie paths, for extracting the key
  *                  from an iterator, cost more time on loading or more space
  *                - FT_QUICKBUILD: quick build at the cost of a larger output
+ *                - FT_ALPHABET: places children by dense codes of the
+ *                  characters in use, the most frequent first, instead of by
+ *                  the characters, and saves the codes, yields much fewer
+ *                  nodes and a smaller file on a 65536-branches trie of a
+ *                  small alphabet, e.g. CJK words, at the cost of a table
+ *                  lookup per character; must be specified alike
+ *                  on building and querying, and tries of it can't be stitched
  * @tparam CharT  character type, may be uint8_t or uint16_t, corresponding to
  *                256-branches or 65536-branches trie
  * @tparam SizeT  size type, may be uint32_t or uint64_t, corresponding to
@@ -803,6 +1240,49 @@ public:
 		return operator ()((CharT *)range(key).begin, (CharT *)range(key).end);
 	}
 
+	/** @brief locate the values of many keys in trie
+	 *
+	 * @tparam KeyT   key type, same as in find(key) const, or Range<CharT>
+	 *
+	 * @param[in]  keys     the keys
+	 * @param[in]  numKeys  number of the keys
+	 * @param[out] results  iterators to the values of the keys \n
+	 *                      If no match, end() will be written.
+	 *
+	 * Same as find(key) const for each key, but FT_LANES keys are walked in
+	 * turn, and the next node of each key is prefetched while the others are
+	 * walked. On a trie much larger than the CPU cache, cache misses of the
+	 * keys overlap instead of stalling one by one.
+	 */
+	template <class KeyT>
+	void findMany(const KeyT *keys, size_t numKeys, const_iterator *results) const
+	{
+		FindMany visitor = { m_container->m_values.begin(), end(), results };
+		walkMany(keys, numKeys, visitor);
+	}
+
+	/** @brief match many keys in trie
+	 *
+	 * @tparam KeyT   key type, same as in find(key) const, or Range<CharT>
+	 *
+	 * @param[in]  keys     the keys
+	 * @param[in]  numKeys  number of the keys
+	 * @param[out] values   values of the keys \n
+	 *                      If values is 0 or no match, no value will be written.
+	 * @param[out] matches  whether each key matches, if matches is not 0
+	 * @return              number of matched keys
+	 *
+	 * Same as match(keyBegin, keyEnd, value) const for each key, but keys are
+	 * walked in turn as in findMany(keys, numKeys, results) const.
+	 */
+	template <class KeyT>
+	uint32_t matchMany(const KeyT *keys, size_t numKeys,
+			ValueT *values = 0, bool *matches = 0) const
+	{
+		MatchMany visitor = { &m_container->m_values, values, matches, 0 };
+		return walkMany(keys, numKeys, visitor).numMatches;
+	}
+
 	/** @brief get the key of an iterator
 	 *
 	 * @tparam KeyT   key type, same as in operator ()(key) const
@@ -816,6 +1296,43 @@ public:
 	template <class KeyT>
 	const KeyT key(const_iterator it) const;
 
+	/** @brief walk all keys and values in trie in order
+	 *
+	 * @tparam VisitorT visitor type, called as visitor(keyBegin, keyEnd, it)
+	 *                  for each key, where it is the iterator to the value
+	 *
+	 * @param[in]  visitor  the visitor
+	 * @return              the visitor after walking
+	 *
+	 * Unlike key(it) const, FT_PATH is not needed: keys are rebuilt on a stack
+	 * while walking the trie depth first, so no path container is built and
+	 * memory use is bounded by the longest key. Paths saved on building are
+	 * still used to skip the search for children, which is costly on a
+	 * 65536-branches trie.
+	 */
+	template <class VisitorT>
+	VisitorT walk(VisitorT visitor) const;
+
+	/** @brief walk keys and values in trie beginning with a prefix in order
+	 *
+	 * @tparam VisitorT visitor type, same as in walk(visitor) const
+	 *
+	 * @param[in]  prefixBegin begin of the prefix
+	 * @param[in]  prefixEnd   end of the prefix
+	 * @param[in]  visitor     the visitor
+	 * @param[in]  limit       at most how many keys to visit
+	 * @return                 the visitor after walking
+	 *
+	 * Same as walk(visitor) const, but only the keys beginning with the prefix
+	 * are visited, the first limit of them in order. The node of the prefix is
+	 * located in O(|prefix|), then with FT_PATH saved, the keys under it are of
+	 * the values from its first key on, rebuilt from their paths up to it, or
+	 * else they are walked depth first from it.
+	 */
+	template <class VisitorT>
+	VisitorT walk(const CharT *prefixBegin, const CharT *prefixEnd, VisitorT visitor,
+			size_t limit = (size_t)(-1)) const;
+
 	/** @brief to std::map */
 	template <class _Key, class _Tp, class _Compare, class _Alloc>
 	operator std::map<_Key, _Tp, _Compare, _Alloc>() const
@@ -880,8 +1397,98 @@ private:
 
 	typedef typename Container<Trie<ValueT, option, CharT, SizeT> >::Node Node;
 
+	enum { FT_MARGIN = Container<Trie<ValueT, option, CharT, SizeT> >::FT_MARGIN };
 	enum { FT_MASK = Container<Trie<ValueT, option, CharT, SizeT> >::FT_MASK };
 	enum { CHAR_TERMINATOR = -1 };
+	enum { FT_LANES = 16 };
+
+	/* a key being walked by walkMany() */
+	struct Lane
+	{
+		const CharT *key;
+		const CharT *keyEnd;
+		const CharT *tail;    ///< tail to compare, 0 until it is located
+		const CharT *tailEnd;
+		SizeT node;
+		SizeT children;
+		size_t i;
+	};
+
+	/* walk at most limit keys under node depth first, each key beginning with key */
+	template <class VisitorT>
+	VisitorT walkFrom(SizeT node, std::vector<CharT> &key, VisitorT visitor,
+			size_t limit = (size_t)(-1)) const;
+
+	/* walk keys FT_LANES at a time, and call visitor(i, value) for the i'th
+	 * key, where value is the index of its value, or (SizeT)(-1) if no match */
+	template <class KeyT, class VisitorT>
+	VisitorT walkMany(const KeyT *keys, size_t numKeys, VisitorT visitor) const;
+
+	/* the code of a character in nodes, by the alphabet with FT_ALPHABET */
+	SizeT code(CharT c) const
+	{
+		return (option & FT_ALPHABET) ? (SizeT)m_container->m_codes.m_values[c] : (SizeT)c;
+	}
+	/* the character of a code in nodes */
+	CharT decode(SizeT code) const
+	{
+		return (option & FT_ALPHABET) ? m_container->m_chars.m_values[code] : (CharT)code;
+	}
+	/* the code of the i'th character in use in increasing order, and
+	 * CHAR_TERMINATOR of CHAR_TERMINATOR */
+	int32_t ordered(int32_t i) const
+	{
+		return (option & FT_ALPHABET) && i != CHAR_TERMINATOR
+				? (int32_t)m_container->m_order.m_values[i] : i;
+	}
+	/* number of characters children may be of */
+	int32_t numCharacters() const
+	{
+		return (option & FT_ALPHABET) ? (int32_t)m_container->m_order.size() : FT_MARGIN - 1;
+	}
+
+	/* prefetch the node, or the tail entry, to be visited next by a lane */
+	void prefetch(const Lane &lane) const
+	{
+		if ((option & FT_TAIL) && (lane.children & FT_MASK))
+		{
+			__builtin_prefetch(m_container->m_tails.m_entries.m_values
+					+ (lane.children & ~FT_MASK));
+			return;
+		}
+
+		SizeT next = lane.children
+				+ (lane.key == lane.keyEnd ? (SizeT)CHAR_TERMINATOR : code(*lane.key));
+		__builtin_prefetch(m_container->m_nodes.m_values + next);
+	}
+
+	struct FindMany
+	{
+		const_iterator begin;
+		const_iterator end;
+		const_iterator *results;
+
+		void operator ()(size_t i, SizeT value)
+		{
+			results[i] = value == (SizeT)(-1) ? end : begin + value;
+		}
+	};
+
+	struct MatchMany
+	{
+		const Container<ValueT> *values;
+		ValueT *results;
+		bool *matches;
+		uint32_t numMatches;
+
+		void operator ()(size_t i, SizeT value)
+		{
+			if (matches) matches[i] = value != (SizeT)(-1);
+			if (value == (SizeT)(-1)) return;
+			if (results) results[i] = (*values)[value];
+			numMatches ++;
+		}
+	};
 
 	Trie(const Container<Trie<ValueT, option, CharT, SizeT> > *container, size_t i)
 			: m_container(container), m_i(i) {}
@@ -992,6 +1599,22 @@ public:
 	const_iterator find(T *key) const
 	{ return find(key, range(key)); }
 
+	/** @brief locate many keys in hash map
+	 *
+	 * @param[in]  keys     the keys, of any type that find(key) const accepts
+	 * @param[in]  numKeys  number of the keys
+	 * @param[out] results  iterators to the key-value Pairs \n
+	 *                      If no match, end() will be written.
+	 *
+	 * Same as find(key) const for each key, but FT_LANES keys are hashed at a
+	 * time, and their buckets, then the first keys in the buckets, are
+	 * prefetched before the keys are compared. On a hash map much larger than
+	 * the CPU cache, cache misses of the keys overlap instead of stalling one
+	 * by one.
+	 */
+	template <class AnyKeyT>
+	void findMany(const AnyKeyT *keys, size_t numKeys, const_iterator *results) const;
+
 	/** @brief get the value of a key in hash map
 	 *
 	 * @param[in]  key      the key
@@ -1045,10 +1668,55 @@ private:
 	template <class StdKeyT, class T>
 	inline const_iterator find(const StdKeyT &key, Range<T> r) const;
 
+	/* find a key of a hash already computed, as find(key) const */
+	inline const_iterator find(const KeyT &key, uint64_t hash) const;
+	template <class T>
+	inline const_iterator find(Range<T> r, uint64_t hash) const;
+
+	/* a key as find(key) const compares it, the key or its characters */
+	static const KeyT & lookupKey(const KeyT &key) { return key; }
+	template <class _CharT, class _Traits, class _Alloc>
+	static Range<_CharT> lookupKey(const std::basic_string<_CharT, _Traits, _Alloc> &key)
+	{ return range(key); }
+	template <class _Tp, class _Alloc>
+	static Range<_Tp> lookupKey(const std::vector<_Tp, _Alloc> &key) { return range(key); }
+	template <class V, class S>
+	static Range<V> lookupKey(const Vector<V, S> &key) { return range(key); }
+	static Range<char> lookupKey(const char *key) { return range(key); }
+	static Range<char> lookupKey(char *key) { return range(key); }
+	template <class T>
+	static Range<T> lookupKey(T *key) { return range(key); }
+
 	template <class StdKeyT, class T>
 	inline typename Container<ValueT>::const_reference
 	operator ()(const StdKeyT &key, Range<T> r) const;
 
+	/* Pairs that may have a key of the hash: its bucket, or its only slot
+	 * for a PerfectHash */
+	inline std::pair<const_iterator, const_iterator> candidates(uint64_t hash) const;
+
+	/* slot of a hash in a map of a PerfectHash */
+	static size_t slot(const Vector<SizeT, SizeT> &seeds, uint64_t hash, size_t size)
+	{
+		SizeT seed = seeds[PerfectHash::bucket(hash, seeds.size())];
+		return seed & PerfectHash::direct<SizeT>() ? seed & ~PerfectHash::direct<SizeT>()
+				: PerfectHash::displace(hash, seed, size);
+	}
+
+	enum { FT_LANES = 16 };
+
+	/* prefetch the i'th key in a container of keys */
+	template <class T>
+	static void prefetch(const Container<T> &keys, size_t i)
+	{
+		__builtin_prefetch(keys.m_values + i);
+	}
+	template <class T, class S>
+	static void prefetch(const Container<Vector<T, S> > &keys, size_t i)
+	{
+		__builtin_prefetch(keys.m_entries.m_values + i);
+	}
+
 	static const Container<HashMap<KeyT, ValueT, HashT, SizeT> > defaultContainer();
 
 	/* HashMap is actually a pointer to the m_i'th element in m_container. */
@@ -1271,8 +1939,8 @@ private:
 };
 
 template <class ValueT>
-Container<ValueT>::Container(const char *filename, int prot, int flags)
-		: MMap<Container<ValueT> >(filename, prot, flags)
+Container<ValueT>::Container(const char *filename, int prot, int flags, int advice)
+		: MMap<Container<ValueT> >(filename, prot, flags, advice)
 {
 	if (filename[0] == 0) throw int(-1);
 
@@ -1280,6 +1948,8 @@ Container<ValueT>::Container(const char *filename, int prot, int flags)
 	const uint8_t *end = begin + this->mmap().second;
 
 	if (initPointers(begin, end) != end) throw int(-1);
+
+	if (this->warming(advice)) this->touch(begin, end);
 }
 
 template <class ValueT>
@@ -1317,8 +1987,8 @@ Container<Vector<ValueT, SizeT> >::Container()
 
 template <class ValueT, class SizeT>
 Container<Vector<ValueT, SizeT> >::
-Container(const char *filename, int prot, int flags)
-		: MMap<Container<Vector<ValueT, SizeT> > >(filename, prot, flags)
+Container(const char *filename, int prot, int flags, int advice)
+		: MMap<Container<Vector<ValueT, SizeT> > >(filename, prot, flags, advice)
 {
 	if (filename[0] == 0) throw int(-1);
 
@@ -1326,6 +1996,8 @@ Container(const char *filename, int prot, int flags)
 	const uint8_t *end = begin + this->mmap().second;
 
 	if (initPointers(begin, end) != end) throw int(-1);
+
+	if (this->warming(advice)) this->touch(begin, end);
 }
 
 template <class ValueT, class SizeT>
@@ -1355,8 +2027,8 @@ Container<Trie<ValueT, option, CharT, SizeT> >::Container()
 
 template <class ValueT, int option, class CharT, class SizeT>
 Container<Trie<ValueT, option, CharT, SizeT> >::
-Container(const char *filename, int prot, int flags)
-		: MMap<Container<Trie<ValueT, option, CharT, SizeT> > >(filename, prot, flags)
+Container(const char *filename, int prot, int flags, int advice)
+		: MMap<Container<Trie<ValueT, option, CharT, SizeT> > >(filename, prot, flags, advice)
 {
 	if (filename[0] == 0) throw int(-1);
 
@@ -1364,6 +2036,18 @@ Container(const char *filename, int prot, int flags)
 	const uint8_t *end = begin + this->mmap().second;
 
 	if (initPointers(begin, end) != end) throw int(-1);
+
+	// the nodes, paths, tails and codes every lookup reads, then the values
+	if (this->warming(advice))
+	{
+		const uint8_t *values = (option & FT_ALPHABET)
+				? (const uint8_t *)(m_order.m_values + m_order.size())
+				: (const uint8_t *)m_tails.m_values.end();
+		if (values < begin || values > end) values = begin;
+
+		this->touch(begin, values);
+		this->touch(values, end);
+	}
 }
 
 template <class ValueT, int option, class CharT, class SizeT>
@@ -1381,6 +2065,15 @@ const uint8_t * Container<Trie<ValueT, option, CharT, SizeT> >::initPointers(
 	begin = m_nodes .initPointers(begin, end); if (!begin) return 0;
 	begin = m_paths .initPointers(begin, end); if (!begin) return 0;
 	begin = m_tails .initPointers(begin, end); if (!begin) return 0;
+	if (option & FT_ALPHABET)
+	{
+		begin = m_codes.initPointers(begin, end); if (!begin) return 0;
+		begin = m_chars.initPointers(begin, end); if (!begin) return 0;
+		begin = m_order.initPointers(begin, end); if (!begin) return 0;
+
+		// every character is coded, the codes are of the nodes
+		if (m_codes.size() != FT_MARGIN - 1 || m_order.size() != m_chars.size()) return 0;
+	}
 	begin = m_values.initPointers(begin, end); if (!begin) return 0;
 
 	if ((option & FT_PATH) && m_paths.size() < m_values.size())
@@ -1434,9 +2127,9 @@ uint32_t Trie<ValueT, option, CharT, SizeT>::match(
 
 		if (key == keyEnd) break;
 
-		if (nodes[children + *key].parent != node) return 0;
-		node = children + *key;
-		children = nodes[children + *key].children;
+		if (nodes[children + code(*key)].parent != node) return 0;
+		node = children + code(*key);
+		children = nodes[children + code(*key)].children;
 	}
 
 	SizeT term = children + CHAR_TERMINATOR;
@@ -1500,9 +2193,9 @@ uint32_t Trie<ValueT, option, CharT, SizeT>::matchBeginning(
 
 		if (key == keyEnd) break;
 
-		if (nodes[children + *key].parent != node) return numMatches;
-		node = children + *key;
-		children = nodes[children + *key].children;
+		if (nodes[children + code(*key)].parent != node) return numMatches;
+		node = children + code(*key);
+		children = nodes[children + code(*key)].children;
 	}
 
 	return numMatches;
@@ -1552,9 +2245,9 @@ Trie<ValueT, option, CharT, SizeT>::find(
 
 		if (key == keyEnd) break;
 
-		if (nodes[children + *key].parent != node) return end();
-		node = children + *key;
-		children = nodes[children + *key].children;
+		if (nodes[children + code(*key)].parent != node) return end();
+		node = children + code(*key);
+		children = nodes[children + code(*key)].children;
 	}
 
 	SizeT term = children + CHAR_TERMINATOR;
@@ -1564,33 +2257,120 @@ Trie<ValueT, option, CharT, SizeT>::find(
 }
 
 template <class ValueT, int option, class CharT, class SizeT>
-typename Trie<ValueT, option, CharT, SizeT>::const_reference
-Trie<ValueT, option, CharT, SizeT>::operator ()(
-		const CharT *keyBegin, const CharT *keyEnd) const
+template <class KeyT, class VisitorT>
+VisitorT Trie<ValueT, option, CharT, SizeT>::walkMany(
+		const KeyT *keys, size_t numKeys, VisitorT visitor) const
 {
 	const Node *nodes = m_container->m_nodes.m_values;
 
-	SizeT node = 1 + m_i;
-	SizeT children = nodes[node].children;
+	Lane lanes[FT_LANES];
+	size_t numLanes = 0;
+	size_t next = 0;
 
-	for (const CharT *key = keyBegin; ; key ++)
+	for (; numLanes != FT_LANES && next != numKeys; numLanes ++, next ++)
 	{
-		if ((option & FT_TAIL) && (children & FT_MASK))
+		Lane &lane = lanes[numLanes];
+
+		lane.key = (CharT *)range(keys[next]).begin;
+		lane.keyEnd = (CharT *)range(keys[next]).end;
+		lane.tail = 0;
+		lane.node = 1 + m_i;
+		lane.children = nodes[lane.node].children;
+		lane.i = next;
+		prefetch(lane);
+	}
+
+	// each lane steps as find(keyBegin, keyEnd) const does, then the others
+	// step while the next node of the lane is being prefetched
+	while (numLanes)
+		for (size_t l = 0; l < numLanes; )
 		{
-			children &= ~FT_MASK;
+			Lane &lane = lanes[l];
+			SizeT value = (SizeT)(-1);
 
-			if ((size_t)(keyEnd - key)     != m_container->m_tails[children].size()
-					|| !std::equal(key, keyEnd, &*m_container->m_tails[children].begin()))
-				return m_zero;
+			if ((option & FT_TAIL) && (lane.children & FT_MASK))
+			{
+				SizeT children = lane.children & ~FT_MASK;
 
-			return m_container->m_values[children];
-		}
+				// locate the tail, and compare it on the next turn
+				if (!lane.tail)
+				{
+					lane.tail = &*m_container->m_tails[children].begin();
+					lane.tailEnd = &*m_container->m_tails[children].end();
+					__builtin_prefetch(lane.tail);
+					l ++;
+					continue;
+				}
 
-		if (key == keyEnd) break;
+				if (lane.keyEnd - lane.key == lane.tailEnd - lane.tail
+						&& std::equal(lane.key, lane.keyEnd, lane.tail))
+					value = children;
+			}
+			else if (lane.key == lane.keyEnd)
+			{
+				SizeT term = lane.children + CHAR_TERMINATOR;
 
-		if (nodes[children + *key].parent != node) return m_zero;
-		node = children + *key;
-		children = nodes[children + *key].children;
+				if (nodes[term].parent == lane.node) value = nodes[term].children;
+			}
+			else if (nodes[lane.children + code(*lane.key)].parent == lane.node)
+			{
+				lane.node = lane.children + code(*lane.key ++);
+				lane.children = nodes[lane.node].children;
+				prefetch(lane);
+				l ++;
+				continue;
+			}
+
+			visitor(lane.i, value);
+
+			// the lane takes the next key, or the last lane if no more keys
+			if (next == numKeys)
+			{
+				lane = lanes[-- numLanes];
+				continue;
+			}
+
+			lane.key = (CharT *)range(keys[next]).begin;
+			lane.keyEnd = (CharT *)range(keys[next]).end;
+			lane.tail = 0;
+			lane.node = 1 + m_i;
+			lane.children = nodes[lane.node].children;
+			lane.i = next ++;
+			prefetch(lane);
+			l ++;
+		}
+
+	return visitor;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+typename Trie<ValueT, option, CharT, SizeT>::const_reference
+Trie<ValueT, option, CharT, SizeT>::operator ()(
+		const CharT *keyBegin, const CharT *keyEnd) const
+{
+	const Node *nodes = m_container->m_nodes.m_values;
+
+	SizeT node = 1 + m_i;
+	SizeT children = nodes[node].children;
+
+	for (const CharT *key = keyBegin; ; key ++)
+	{
+		if ((option & FT_TAIL) && (children & FT_MASK))
+		{
+			children &= ~FT_MASK;
+
+			if ((size_t)(keyEnd - key)     != m_container->m_tails[children].size()
+					|| !std::equal(key, keyEnd, &*m_container->m_tails[children].begin()))
+				return m_zero;
+
+			return m_container->m_values[children];
+		}
+
+		if (key == keyEnd) break;
+
+		if (nodes[children + code(*key)].parent != node) return m_zero;
+		node = children + code(*key);
+		children = nodes[children + code(*key)].children;
 	}
 
 	SizeT term = children + CHAR_TERMINATOR;
@@ -1631,15 +2411,211 @@ const KeyT Trie<ValueT, option, CharT, SizeT>::key(const_iterator it) const
 	}
 	for (SizeT node = paths[i]; !(nodes[node].parent & FT_MASK);
 			node = nodes[node].parent)
-		*(-- p) = (CharT)(node - nodes[nodes[node].parent].children);
+		*(-- p) = decode(node - nodes[nodes[node].parent].children);
 
 	return result;
 }
 
+template <class ValueT, int option, class CharT, class SizeT>
+template <class VisitorT>
+VisitorT Trie<ValueT, option, CharT, SizeT>::walk(VisitorT visitor) const
+{
+	const Node  *nodes = m_container->m_nodes.m_values;
+	const SizeT *paths = m_container->m_paths.m_values;
+
+	std::vector<CharT> key;
+
+	if (m_container->m_paths.size() && m_container->m_paths.size() >= m_container->m_values.size())
+	{
+		for (const_iterator it = begin(); it != end(); ++ it)
+		{
+			size_t i = it - m_container->m_values.begin();
+
+			key.clear();
+			for (SizeT node = paths[i]; !(nodes[node].parent & FT_MASK);
+					node = nodes[node].parent)
+				key.push_back(decode(node - nodes[nodes[node].parent].children));
+			std::reverse(key.begin(), key.end());
+			if (option & FT_TAIL)
+				key.insert(key.end(),
+						m_container->m_tails[i].begin(), m_container->m_tails[i].end());
+
+			const CharT *k = key.empty() ? 0 : &key[0];
+			visitor(k, k + key.size(), it);
+		}
+
+		return visitor;
+	}
+
+	return walkFrom(1 + m_i, key, visitor);
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+template <class VisitorT>
+VisitorT Trie<ValueT, option, CharT, SizeT>::walk(
+		const CharT *prefixBegin, const CharT *prefixEnd, VisitorT visitor, size_t limit) const
+{
+	const Node  *nodes = m_container->m_nodes.m_values;
+	const SizeT *paths = m_container->m_paths.m_values;
+
+	if (limit == 0) return visitor;
+
+	SizeT node = 1 + m_i;
+	SizeT children = nodes[node].children;
+
+	for (const CharT *key = prefixBegin; key != prefixEnd; key ++)
+	{
+		if ((option & FT_TAIL) && (children & FT_MASK))
+		{
+			children &= ~FT_MASK;
+
+			/* the only key under node, if the rest of prefix begins its tail */
+			if ((size_t)(prefixEnd - key) > m_container->m_tails[children].size()
+					|| !std::equal(key, prefixEnd, &*m_container->m_tails[children].begin()))
+				return visitor;
+
+			std::vector<CharT> k(prefixBegin, key);
+			k.insert(k.end(),
+					m_container->m_tails[children].begin(),
+					m_container->m_tails[children].end());
+
+			visitor(&k[0], &k[0] + k.size(), m_container->m_values.begin() + children);
+
+			return visitor;
+		}
+
+		if (nodes[children + code(*key)].parent != node) return visitor;
+		node = children + code(*key);
+		children = nodes[children + code(*key)].children;
+	}
+
+	std::vector<CharT> key(prefixBegin, prefixEnd);
+
+	if (prefixBegin == prefixEnd || !m_container->m_paths.size()
+			|| m_container->m_paths.size() < m_container->m_values.size())
+		return walkFrom(node, key, visitor, limit);
+
+	/* the value of the first key under node, down its first children */
+	size_t i;
+	for (SizeT first = node; ; )
+	{
+		children = nodes[first].children;
+
+		if ((option & FT_TAIL) && (children & FT_MASK))
+		{
+			i = children & ~FT_MASK;
+			break;
+		}
+
+		int32_t character = CHAR_TERMINATOR;
+		while (character < numCharacters()
+				&& nodes[children + ordered(character)].parent != first) character ++;
+
+		if (character >= numCharacters()) return visitor;
+
+		if (character == CHAR_TERMINATOR)
+		{
+			i = nodes[children + character].children;
+			break;
+		}
+
+		first = children + ordered(character);
+	}
+
+	/* values are in the order of keys, so that the keys under node are of the
+	 * values from i on, up to the first whose path does not pass node */
+	size_t prefixSize = prefixEnd - prefixBegin;
+
+	for (const_iterator it = m_container->m_values.begin() + i;
+			it != end() && limit; ++ it, ++ i, -- limit)
+	{
+		key.resize(prefixSize);
+
+		SizeT n = paths[i];
+		for (; n != node && !(nodes[n].parent & FT_MASK); n = nodes[n].parent)
+			key.push_back(decode(n - nodes[nodes[n].parent].children));
+		if (n != node) break;
+
+		std::reverse(key.begin() + prefixSize, key.end());
+		if (option & FT_TAIL)
+			key.insert(key.end(),
+					m_container->m_tails[i].begin(), m_container->m_tails[i].end());
+
+		visitor(&key[0], &key[0] + key.size(), it);
+	}
+
+	return visitor;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+template <class VisitorT>
+VisitorT Trie<ValueT, option, CharT, SizeT>::walkFrom(
+		SizeT node, std::vector<CharT> &key, VisitorT visitor, size_t limit) const
+{
+	const Node *nodes = m_container->m_nodes.m_values;
+
+	/* (node, next character to try in order) of each level */
+	std::vector<std::pair<SizeT, int32_t> > stack;
+
+	stack.push_back(std::make_pair(node, (int32_t)CHAR_TERMINATOR));
+
+	while (!stack.empty())
+	{
+		SizeT   node      = stack.back().first;
+		int32_t character = stack.back().second;
+		SizeT   children  = nodes[node].children;
+
+		if ((option & FT_TAIL) && (children & FT_MASK))
+		{
+			children &= ~FT_MASK;
+
+			size_t size = key.size();
+			key.insert(key.end(),
+					m_container->m_tails[children].begin(),
+					m_container->m_tails[children].end());
+
+			const CharT *k = key.empty() ? 0 : &key[0];
+			visitor(k, k + key.size(), m_container->m_values.begin() + children);
+			if (-- limit == 0) break;
+
+			key.resize(size);
+			character = numCharacters();
+		}
+
+		while (character < numCharacters()
+				&& nodes[children + ordered(character)].parent != node) character ++;
+
+		if (character >= numCharacters())
+		{
+			stack.pop_back();
+			if (!stack.empty()) key.pop_back();
+			continue;
+		}
+
+		stack.back().second = character + 1;
+
+		if (character == CHAR_TERMINATOR)
+		{
+			const CharT *k = key.empty() ? 0 : &key[0];
+			visitor(k, k + key.size(),
+					m_container->m_values.begin() + nodes[children + character].children);
+			if (-- limit == 0) break;
+		}
+		else
+		{
+			key.push_back(decode(ordered(character)));
+			stack.push_back(std::make_pair(
+					(SizeT)(children + ordered(character)), (int32_t)CHAR_TERMINATOR));
+		}
+	}
+
+	return visitor;
+}
+
 template <class KeyT, class ValueT, class HashT, class SizeT>
 Container<HashMap<KeyT, ValueT, HashT, SizeT> >::
-Container(const char *filename, int prot, int flags)
-		: MMap<Container<HashMap<KeyT, ValueT, HashT, SizeT> > >(filename, prot, flags)
+Container(const char *filename, int prot, int flags, int advice)
+		: MMap<Container<HashMap<KeyT, ValueT, HashT, SizeT> > >(filename, prot, flags, advice)
 {
 	if (filename[0] == 0) throw int(-1);
 
@@ -1647,6 +2623,8 @@ Container(const char *filename, int prot, int flags)
 	const uint8_t *end = begin + this->mmap().second;
 
 	if (initPointers(begin, end) != end) throw int(-1);
+
+	if (this->warming(advice)) this->touch(begin, end);
 }
 
 template <class KeyT, class ValueT, class HashT, class SizeT>
@@ -1661,38 +2639,112 @@ template <class KeyT, class ValueT, class HashT, class SizeT>
 const uint8_t * Container<HashMap<KeyT, ValueT, HashT, SizeT> >::initPointers(
 		const uint8_t *begin, const uint8_t *end)
 {
+	if (IsPerfectHash<HashT>::value)
+	{
+		begin = m_seeds.initPointers(begin, end); if (!begin) return 0;
+		begin = m_maps.initPointers(begin, end); if (!begin) return 0;
+
+		return m_seeds.size() == m_maps.size() ? begin : 0;
+	}
 	begin = m_maps.initPointers(begin, end); if (!begin) return 0;
 
 	return begin;
 }
 
+template <class KeyT, class ValueT, class HashT, class SizeT>
+std::pair<typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator,
+		typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator>
+HashMap<KeyT, ValueT, HashT, SizeT>::candidates(uint64_t hash) const
+{
+	size_t size = m_container->m_maps[m_i].size();
+	if (size == 0) return std::make_pair(end(), end());
+
+	if (IsPerfectHash<HashT>::value)
+	{
+		const_iterator it = begin() + slot(m_container->m_seeds[m_i], hash, size);
+		return std::make_pair(it, it + 1);
+	}
+
+	Vector<Pair<KeyT, ValueT>, SizeT> items = m_container->m_maps[m_i][hash % size];
+	return std::make_pair(items.begin(), items.end());
+}
+
 template <class KeyT, class ValueT, class HashT, class SizeT>
 typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator
 HashMap<KeyT, ValueT, HashT, SizeT>::find(const KeyT &key) const
 {
-	// change by xiaotian
-	if( m_container->m_maps[m_i].size() == 0) return end();
-	Vector<Pair<KeyT, ValueT>, SizeT> items =
-			m_container->m_maps[m_i][HashT()(key) % m_container->m_maps[m_i].size()];
+	return find(key, HashT()(key));
+}
+
+template <class KeyT, class ValueT, class HashT, class SizeT>
+typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator
+HashMap<KeyT, ValueT, HashT, SizeT>::find(const KeyT &key, uint64_t hash) const
+{
+	std::pair<const_iterator, const_iterator> items = candidates(hash);
 
-	for (typename Vector<Pair<KeyT, ValueT>, SizeT>::const_iterator
-			it = items.begin(); it != items.end(); ++ it)
+	for (const_iterator it = items.first; it != items.second; ++ it)
 		if (key == it.m_container->m_values1[it.m_i]) return it;
 
 	return end();
 }
 
+template <class KeyT, class ValueT, class HashT, class SizeT>
+template <class AnyKeyT>
+void HashMap<KeyT, ValueT, HashT, SizeT>::findMany(
+		const AnyKeyT *keys, size_t numKeys, const_iterator *results) const
+{
+	const Container<Vector<Pair<KeyT, ValueT>, SizeT> > &buckets =
+			m_container->m_maps.m_values;
+
+	size_t firstBucket = m_container->m_maps.m_entries[m_i];
+	size_t numBuckets = m_container->m_maps[m_i].size();
+	size_t bucket[FT_LANES];
+	uint64_t hash[FT_LANES];
+
+	for (size_t i = 0; i < numKeys; i += FT_LANES)
+	{
+		size_t n = std::min((size_t)FT_LANES, numKeys - i);
+
+		if (numBuckets && IsPerfectHash<HashT>::value)
+		{
+			// seeds, then the only keys of the slots
+			Vector<SizeT, SizeT> seeds = m_container->m_seeds[m_i];
+			size_t firstPair = buckets.m_entries[firstBucket];
+			for (size_t j = 0; j != n; j ++)
+			{
+				hash[j] = HashT()(lookupKey(keys[i + j]));
+				__builtin_prefetch(&*seeds.begin() +
+						PerfectHash::bucket(hash[j], seeds.size()));
+			}
+			for (size_t j = 0; j != n; j ++)
+				prefetch(buckets.m_values.m_values1,
+						firstPair + slot(seeds, hash[j], numBuckets));
+		}
+		else if (numBuckets)
+		{
+			for (size_t j = 0; j != n; j ++)
+			{
+				hash[j] = HashT()(lookupKey(keys[i + j]));
+				bucket[j] = firstBucket + hash[j] % numBuckets;
+				__builtin_prefetch(buckets.m_entries.m_values + bucket[j]);
+			}
+			for (size_t j = 0; j != n; j ++)
+				prefetch(buckets.m_values.m_values1, buckets.m_entries[bucket[j]]);
+		}
+
+		// by the hashes above, and buckets and keys are in cache now
+		for (size_t j = 0; j != n; j ++)
+			results[i + j] = numBuckets ? find(lookupKey(keys[i + j]), hash[j]) : end();
+	}
+}
+
 template <class KeyT, class ValueT, class HashT, class SizeT>
 typename Container<ValueT>::const_reference
 HashMap<KeyT, ValueT, HashT, SizeT>::operator ()(const KeyT &key) const
 {
-	// change by xiaotian
-	if( m_container->m_maps[m_i].size() == 0) return m_zero;
-	Vector<Pair<KeyT, ValueT>, SizeT> items =
-			m_container->m_maps[m_i][HashT()(key) % m_container->m_maps[m_i].size()];
+	std::pair<const_iterator, const_iterator> items = candidates(HashT()(key));
 
-	for (typename Vector<Pair<KeyT, ValueT>, SizeT>::const_iterator
-			it = items.begin(); it != items.end(); ++ it)
+	for (const_iterator it = items.first; it != items.second; ++ it)
 		if (key == it.m_container->m_values1[it.m_i])
 			return it.m_container->m_values2[it.m_i];
 
@@ -1704,13 +2756,17 @@ template <class StdKeyT, class T>
 typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator
 HashMap<KeyT, ValueT, HashT, SizeT>::find(const StdKeyT &key, Range<T> r) const
 {
-	// change by xiaotian
-	if( m_container->m_maps[m_i].size() == 0) return end();
-	Vector<Pair<KeyT, ValueT>, SizeT> items =
-			m_container->m_maps[m_i][HashT()(key) % m_container->m_maps[m_i].size()];
+	return find(r, HashT()(key));
+}
+
+template <class KeyT, class ValueT, class HashT, class SizeT>
+template <class T>
+typename HashMap<KeyT, ValueT, HashT, SizeT>::const_iterator
+HashMap<KeyT, ValueT, HashT, SizeT>::find(Range<T> r, uint64_t hash) const
+{
+	std::pair<const_iterator, const_iterator> items = candidates(hash);
 
-	for (typename Vector<Pair<KeyT, ValueT>, SizeT>::const_iterator
-			it = items.begin(); it != items.end(); ++ it)
+	for (const_iterator it = items.first; it != items.second; ++ it)
 		if ((size_t)(r.end - r.begin)  == it.m_container->m_values1[it.m_i].size()
 				&& std::equal(r.begin, r.end, it.m_container->m_values1[it.m_i].begin()))
 			return it;
@@ -1723,13 +2779,9 @@ template <class StdKeyT, class T>
 typename Container<ValueT>::const_reference
 HashMap<KeyT, ValueT, HashT, SizeT>::operator ()(const StdKeyT &key, Range<T> r) const
 {
-	// change by xiaotian
-	if( m_container->m_maps[m_i].size() == 0) return m_zero;
-	Vector<Pair<KeyT, ValueT>, SizeT> items =
-			m_container->m_maps[m_i][HashT()(key) % m_container->m_maps[m_i].size()];
+	std::pair<const_iterator, const_iterator> items = candidates(HashT()(key));
 
-	for (typename Vector<Pair<KeyT, ValueT>, SizeT>::const_iterator
-			it = items.begin(); it != items.end(); ++ it)
+	for (const_iterator it = items.first; it != items.second; ++ it)
 		if ((size_t)(r.end - r.begin)  == it.m_container->m_values1[it.m_i].size()
 				&& std::equal(r.begin, r.end, it.m_container->m_values1[it.m_i].begin()))
 			return it.m_container->m_values2[it.m_i];
@@ -1739,8 +2791,8 @@ HashMap<KeyT, ValueT, HashT, SizeT>::operator ()(const StdKeyT &key, Range<T> r)
 
 template <class ValueT1, class ValueT2>
 Container<Pair<ValueT1, ValueT2> >::
-Container(const char *filename, int prot, int flags)
-		: MMap<Container<Pair<ValueT1, ValueT2> > >(filename, prot, flags)
+Container(const char *filename, int prot, int flags, int advice)
+		: MMap<Container<Pair<ValueT1, ValueT2> > >(filename, prot, flags, advice)
 {
 	if (filename[0] == 0) throw int(-1);
 
@@ -1748,6 +2800,8 @@ Container(const char *filename, int prot, int flags)
 	const uint8_t *end = begin + this->mmap().second;
 
 	if (initPointers(begin, end) != end) throw int(-1);
+
+	if (this->warming(advice)) this->touch(begin, end);
 }
 
 template <class ValueT1, class ValueT2>
@@ -1781,20 +2835,27 @@ OutIteratorT Container<ValueT>::build(
 		return out;
 	}
 
-	const size_t align = 16;
-
 	size_t numValues = std::distance(begin, end);
-	size_t bytes = sizeof(ValueT) * numValues;
-	bytes = (bytes + align - 1) / align * align;
 
-	std::string result(align + bytes, 0);
+	out = buildHeader(out, numValues);
 
-	((size_t *)&result[0])[0] = numValues;
-	std::copy(begin, end, (ValueT *)(&result[align]));
+	// values are converted in chunks of zeroed memory, and written a block
+	// at a time, instead of all at once into a copy of the whole
+	const size_t chunkSize = std::max((size_t)1, (size_t)65536 / sizeof(ValueT));
+	std::vector<char> chunk(std::min(numValues, chunkSize) * sizeof(ValueT));
 
-	out = std::copy(&*result.begin(), &*result.end(), out);
+	for (size_t i = 0; i < numValues; i += chunkSize)
+	{
+		size_t n = std::min(numValues - i, chunkSize);
 
-	return out;
+		std::fill(chunk.begin(), chunk.end(), 0);
+		for (ValueT *p = (ValueT *)&chunk[0]; p != (ValueT *)&chunk[0] + n; ++ p, ++ begin)
+			*p = *begin;
+
+		out = std::copy(&chunk[0], &chunk[0] + n * sizeof(ValueT), out);
+	}
+
+	return buildPadding(out, numValues);
 }
 
 template <class ValueT>
@@ -1810,20 +2871,12 @@ OutIteratorT Container<ValueT>::build(
 		return out;
 	}
 
-	const size_t align = 16;
-
 	size_t numValues = std::distance(begin, end);
-	size_t bytes = sizeof(ValueT) * numValues;
-	bytes = (bytes + align - 1) / align * align;
 
-	char zeros[align] = { 0 };
-
-	out = std::copy((char *)&numValues, (char *)(&numValues + 1), out);
-	out = std::copy(zeros, zeros + align - sizeof(numValues), out);
+	out = buildHeader(out, numValues);
 	out = std::copy((char *)begin, (char *)end, out);
-	out = std::copy(zeros, zeros + bytes - sizeof(ValueT) * numValues, out);
 
-	return out;
+	return buildPadding(out, numValues);
 }
 
 template <class ValueT, class SizeT>
@@ -1839,8 +2892,13 @@ OutIteratorT Container<Vector<ValueT, SizeT> >::build(
 	std::vector<SizeT> entries(1, 0);
 	entries.reserve(std::distance(begin, end) + 1);
 
+	size_t numValues = 0;
 	for (IteratorT it = begin; it != end; ++ it)
-		entries.push_back(entries.back() + it->size());
+	{
+		numValues += it->size();
+		if ((SizeT)numValues != numValues) throw int(FT_OVERFLOW);
+		entries.push_back(numValues);
+	}
 
 	std::vector<ValueType> values;
 	values.reserve(entries.back());
@@ -1872,22 +2930,42 @@ OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::build(
 	std::vector<SizeT>               paths;
 	std::vector<std::vector<CharT> > tails;
 	std::vector<ValueType>           values;
+	std::vector<CharT>               codes, chars, order;
 
 	size_t numTries  = std::distance(begin, end);
 	size_t numValues = 0;
 
+	BuildObserver *observer = buildObserver();
+	if (observer) { observer->begin("Trie"); observer->phase("placement"); }
+
 	for (IteratorT it = begin; it != end; ++ it)
 		numValues += it->size();
 
-	nodes.reserve(numTries + 2 + FT_MARGIN);
+	// children of a node take its children + CHAR_TERMINATOR up to children +
+	// the last code, which is one past the alphabet with FT_ALPHABET
+	size_t margin = FT_MARGIN;
+	if (option & FT_ALPHABET)
+	{
+		alphabet(begin, end, codes, chars, order);
+		margin = chars.size() + 2;
+	}
+
+	nodes.reserve(numTries + 2 + margin);
 	paths.reserve(numValues);
 	tails.reserve(numValues);
 	values.reserve(numValues);
 
-	nodes.resize(numTries + 2,             Node( 0, 1));
-	nodes.resize(numTries + 2 + FT_MARGIN, Node(-1, 1));
-	nodes[0].children          =   numTries + 2;
-	nodes[numTries + 2].parent = - numTries - 2;
+	nodes.resize(numTries + 2,          Node( 0, 1));
+	nodes.resize(numTries + 2 + margin, Node(-1, 1));
+
+	FreeNodes freeNodes;
+	freeNodes.resize(nodes.size() + margin);
+	for (size_t i = 0; i != numTries + 2; i ++)
+		freeNodes.take(i);
+
+	size_t lowest = numTries + 2; // children are placed at or after this node
+
+	std::vector<size_t> offsets;
 
 	size_t entry = 1;
 
@@ -1951,6 +3029,8 @@ OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::build(
 					open.count = 0;
 					open.character = (itSub->first.size() <= head.level)
 							? CHAR_TERMINATOR : (int32_t)(CharT)itSub->first[head.level];
+					if ((option & FT_ALPHABET) && open.character != CHAR_TERMINATOR)
+						open.character = codes[open.character];
 					open.entry = 0;
 
 					subOpenNodes.push_front(open);
@@ -1964,36 +3044,33 @@ OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::build(
 			if (!subOpenNodes.empty())
 				subOpenNodes.front().end = head.end;
 
-			SizeT children = nodes[0].children;
-			while (1 + minCharacter > (int32_t)children)
-				children += nodes[children].children;
-			children -= minCharacter;
-
 			typename std::list<OpenNode<SubIterator> >::iterator itEnt;
 
-			for (itEnt = subOpenNodes.begin(); itEnt != subOpenNodes.end(); )
+			offsets.clear();
+			for (itEnt = subOpenNodes.begin(); itEnt != subOpenNodes.end(); ++ itEnt)
+				offsets.push_back(itEnt->character - minCharacter);
+
+			// the first free node for minCharacter, with all other children free
+			size_t found = freeNodes.find(
+					std::max(lowest, (size_t)(1 + minCharacter)), offsets) - minCharacter;
+			if (found + margin * 2 >= (size_t)FT_MASK || values.size() >= (size_t)FT_MASK)
+				throw int(FT_OVERFLOW);
+
+			SizeT children = found;
+
+			if (nodes.size() < children + margin * 2)
 			{
-				if (!(nodes[children + itEnt->character].parent & FT_MASK))
-				{
-					children += nodes[children + minCharacter].children;
-					itEnt = subOpenNodes.begin();
-				}
-				else ++ itEnt;
+				nodes.resize(children + margin * 2, Node(-1, 1));
+				freeNodes.resize(nodes.size() + margin);
 			}
 
-			if (nodes.size() < children + FT_MARGIN * 2)
-				nodes.resize(children + FT_MARGIN * 2, Node(-1, 1));
-
 			nodes[head.entry].children = children;
 
 			for (itEnt = subOpenNodes.begin(); itEnt != subOpenNodes.end(); )
 			{
 				itEnt->entry = children + itEnt->character;
 
-				nodes[itEnt->entry + nodes[itEnt->entry].parent].children =
-						nodes[itEnt->entry].children - nodes[itEnt->entry].parent;
-				nodes[itEnt->entry + nodes[itEnt->entry].children].parent =
-						nodes[itEnt->entry].parent - nodes[itEnt->entry].children;
+				freeNodes.take(itEnt->entry);
 				nodes[itEnt->entry].parent = head.entry;
 
 				if (itEnt->character == CHAR_TERMINATOR)
@@ -2012,16 +3089,17 @@ OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::build(
 
 			if (option & FT_QUICKBUILD)
 			{
-				while (nodes[0].children + FT_MARGIN * 8 < nodes.size())
-					nodes[0].children += nodes[nodes[0].children].children;
-				nodes[nodes[0].children].parent = - nodes[0].children;
+				if (lowest + margin * 8 < nodes.size())
+					lowest = nodes.size() - margin * 8;
 			}
 
 			openNodes.splice(openNodes.end(), subOpenNodes);
 		}
 	}
 
-	while (nodes[nodes.size() - FT_MARGIN].parent & FT_MASK)
+	if (values.size() >= (size_t)FT_MASK) throw int(FT_OVERFLOW);
+
+	while (nodes[nodes.size() - margin].parent & FT_MASK)
 		nodes.resize(nodes.size() - 1);
 
 	nodes[0           ].children = numTries;
@@ -2034,10 +3112,465 @@ OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::build(
 	if (!(option & FT_PATH)) paths.clear();
 	if (!(option & FT_TAIL)) tails.clear();
 
+	if (observer)
+	{
+		size_t usedNodes = 0, tailBytes = 0;
+		for (size_t i = 0; i != nodes.size(); i ++)
+			usedNodes += nodes[i].parent != 0 || i < numTries + 2;
+		for (size_t i = 0; i != tails.size(); i ++)
+			tailBytes += tails[i].size() * sizeof(CharT);
+
+		observer->count("tries", numTries);
+		observer->count("keys", values.size());
+		observer->count("nodes", nodes.size());
+		observer->count("fill_ratio", nodes.empty() ? 0 : (double)usedNodes / nodes.size());
+		if (option & FT_TAIL) observer->count("tail_bytes", tailBytes);
+		if (option & FT_ALPHABET) observer->count("alphabet", chars.size());
+		if (option & FT_PATH) observer->count("path_bytes", paths.size() * sizeof(SizeT));
+		observer->phase("serialization");
+	}
+
 	Container<Node> ::build(out, &*nodes.begin(), &*nodes.end()); nodes.clear();
 	Container<SizeT>::build(out, &*paths.begin(), &*paths.end()); paths.clear();
 	Container<Vector<CharT, SizeT> >::build(out, tails.begin(), tails.end()); tails.clear();
+	if (option & FT_ALPHABET)
+	{
+		Container<CharT>::build(out, &*codes.begin(), &*codes.end());
+		Container<CharT>::build(out, &*chars.begin(), &*chars.end());
+		Container<CharT>::build(out, &*order.begin(), &*order.end());
+	}
+	if (observer) observer->phase("values");
 	Container<ValueT>::build(out, values.begin(), values.end(), skipLast); values.clear();
+	if (observer) observer->end();
+
+	return out;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+template <class IteratorT>
+void Container<Trie<ValueT, option, CharT, SizeT> >::alphabet(
+		IteratorT begin, IteratorT end, std::vector<CharT> &codes,
+		std::vector<CharT> &chars, std::vector<CharT> &order)
+{
+	typedef typename std::iterator_traits<IteratorT>
+			::value_type::iterator SubIterator;
+
+	std::vector<size_t> counts(FT_MARGIN - 1);
+
+	for (IteratorT it = begin; it != end; ++ it)
+		for (SubIterator itSub = it->begin(); itSub != it->end(); ++ itSub)
+			for (size_t i = 0; i != itSub->first.size(); i ++)
+				counts[(CharT)itSub->first[i]] ++;
+
+	// (count, character) of characters in use, the most frequent first
+	std::vector<std::pair<size_t, size_t> > ranks;
+	for (size_t c = 0; c != counts.size(); c ++)
+		if (counts[c]) ranks.push_back(std::make_pair(~counts[c], c));
+	std::sort(ranks.begin(), ranks.end());
+
+	codes.assign(counts.size(), (CharT)ranks.size());
+	chars.clear();
+	for (size_t i = 0; i != ranks.size(); i ++)
+	{
+		codes[ranks[i].second] = i;
+		chars.push_back(ranks[i].second);
+	}
+
+	order.clear();
+	for (size_t c = 0; c != counts.size(); c ++)
+		if (counts[c]) order.push_back(codes[c]);
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+void Container<Trie<ValueT, option, CharT, SizeT> >::edge(
+		const Container &trie, bool last, std::vector<CharT> &key)
+{
+	const Node *nodes = trie.m_nodes.m_values;
+
+	key.clear();
+
+	for (SizeT node = 1; ; )
+	{
+		SizeT children = nodes[node].children;
+
+		if ((option & FT_TAIL) && (children & FT_MASK))
+		{
+			Vector<CharT, SizeT> tail = trie.m_tails[children & ~FT_MASK];
+			key.insert(key.end(), tail.begin(), tail.end());
+			return;
+		}
+
+		// children + CHAR_TERMINATOR first, up to the last character
+		size_t end = std::min((size_t)children - 1 + FT_MARGIN, trie.m_nodes.size());
+		size_t child = end;
+		for (size_t i = children - 1; i < end; i ++)
+			if (nodes[i].parent == node)
+			{
+				child = i;
+				if (!last) break;
+			}
+
+		if (child == end || child == (size_t)children - 1) return;
+
+		key.push_back((CharT)(child - children));
+		node = child;
+	}
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+size_t Container<Trie<ValueT, option, CharT, SizeT> >::share(
+		std::vector<SharedNode> &shared, size_t s, int32_t c)
+{
+	typename std::map<int32_t, size_t>::iterator child = shared[s].children.find(c);
+	if (child != shared[s].children.end()) return child->second;
+
+	// a child of a node of another trie
+	if (!shared[s].characters.insert(c).second) throw int(-1);
+
+	shared[s].children[c] = shared.size();
+	shared.push_back(SharedNode(s));
+
+	return shared.size() - 1;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+void Container<Trie<ValueT, option, CharT, SizeT> >::share(
+		const Container &trie, SizeT node, size_t s,
+		std::vector<SharedNode> &shared, ShardNodes &nodes)
+{
+	const Node *trieNodes = trie.m_nodes.m_values;
+	SizeT children = trieNodes[node].children;
+
+	if ((option & FT_TAIL) && (children & FT_MASK))
+	{
+		// the only key under it, of shared nodes down to the deepest one of
+		// its prefixes, and the rest of it in a tail or a terminator
+		SizeT value = children & ~FT_MASK;
+		Vector<CharT, SizeT> tail = trie.m_tails[value];
+
+		size_t i = 0;
+		for ( ; i != tail.size() && shared[s].children.count(tail[i]); i ++)
+			s = shared[s].children[tail[i]];
+
+		if (i + 1 == tail.size()) s = share(shared, s, tail[i ++]);
+
+		int32_t c = i == tail.size() ? (int32_t)CHAR_TERMINATOR : (int32_t)tail[i ++];
+		if (!shared[s].characters.insert(c).second) throw int(-1);
+
+		nodes.tails[node] = std::make_pair(s, c);
+		nodes.drops[value] = i;
+
+		return;
+	}
+
+	nodes.shared[node] = s;
+
+	size_t end = std::min((size_t)children - 1 + FT_MARGIN, trie.m_nodes.size());
+	for (size_t i = children - 1; i < end; i ++)
+	{
+		if (trieNodes[i].parent != node) continue;
+
+		int32_t c = (int32_t)(i - (children - 1)) + CHAR_TERMINATOR;
+
+		typename std::map<int32_t, size_t>::iterator child = shared[s].children.find(c);
+		if (child != shared[s].children.end())
+			share(trie, i, child->second, shared, nodes);
+		else if (!shared[s].characters.insert(c).second)
+			throw int(-1);
+	}
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+SizeT Container<Trie<ValueT, option, CharT, SizeT> >::place(
+		const Container &trie, const ShardNodes &nodes,
+		const std::vector<SharedNode> &shared, SizeT i)
+{
+	typename std::map<SizeT, size_t>::const_iterator s = nodes.shared.find(i);
+	if (s != nodes.shared.end()) return shared[s->second].index;
+
+	typename std::map<SizeT, std::pair<size_t, int32_t> >::const_iterator
+			tail = nodes.tails.find(i);
+	if (tail != nodes.tails.end())
+	{
+		const SharedNode &node = shared[tail->second.first];
+		return tail->second.second == CHAR_TERMINATOR ? node.index
+				: node.base + tail->second.second;
+	}
+
+	SizeT parent = trie.m_nodes[i].parent;
+	s = nodes.shared.find(parent);
+	if (s != nodes.shared.end())
+		return shared[s->second].base + (i - trie.m_nodes[parent].children);
+
+	return i + nodes.shift;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+SizeT Container<Trie<ValueT, option, CharT, SizeT> >::children(
+		const Container &trie, const ShardNodes &nodes, SizeT i)
+{
+	SizeT children = trie.m_nodes[i].children;
+
+	if ((option & FT_TAIL) && (children & FT_MASK))
+		return ((children & ~FT_MASK) + nodes.value) | FT_MASK;
+	if (trie.m_nodes[trie.m_nodes[i].parent].children + CHAR_TERMINATOR == i)
+		return children + nodes.value;
+
+	return children + nodes.shift;
+}
+
+template <class ValueT, int option, class CharT, class SizeT>
+template <class OutIteratorT>
+OutIteratorT Container<Trie<ValueT, option, CharT, SizeT> >::stitch(OutIteratorT out,
+		const Container *begin, const Container *end, void *skipLast)
+{
+	// shards are coded by alphabets of their own
+	if (option & FT_ALPHABET) throw int(-1);
+
+	BuildObserver *observer = buildObserver();
+	if (observer) { observer->begin("Trie"); observer->phase("placement"); }
+
+	// prefixes shared by the last key of a trie and the first key of the
+	// next one, which must be greater, are shared nodes, the root first
+	std::vector<SharedNode> shared(1, SharedNode(0));
+	std::vector<ShardNodes> shards(end - begin);
+	std::vector<CharT>      firstKey, lastKey;
+
+	size_t numValues = 0;
+
+	for (const Container *it = begin; it != end; ++ it)
+	{
+		if (it->size() != 1) throw int(-1);
+
+		shards[it - begin].value = numValues;
+		numValues += it->m_nodes[2].parent & ~FT_MASK;
+		if (numValues == shards[it - begin].value) continue;
+
+		edge(*it, false, firstKey);
+
+		if (numValues != (it->m_nodes[2].parent & ~FT_MASK))
+		{
+			if (!std::lexicographical_compare(lastKey.begin(), lastKey.end(),
+					firstKey.begin(), firstKey.end()))
+				throw int(-1);
+
+			for (size_t i = 0, s = 0; i != lastKey.size() && i != firstKey.size()
+					&& lastKey[i] == firstKey[i]; i ++)
+				s = share(shared, s, lastKey[i]);
+		}
+
+		edge(*it, true, lastKey);
+	}
+
+	if (numValues >= (size_t)FT_MASK) throw int(FT_OVERFLOW);
+
+	// then nodes of the tries, which go with shared nodes
+	for (const Container *it = begin; it != end; ++ it)
+		if (it->m_nodes[2].parent & ~FT_MASK)
+			share(*it, 1, 0, shared, shards[it - begin]);
+
+	// shared nodes are placed as building places nodes, each after its parent
+	std::vector<Node>   nodes(3);
+	std::vector<size_t> offsets;
+
+	FreeNodes freeNodes;
+	freeNodes.resize(nodes.size() + FT_MARGIN);
+	for (size_t i = 0; i != nodes.size(); i ++)
+		freeNodes.take(i);
+
+	size_t numSharedNodes = nodes.size();
+
+	for (size_t s = 0; s != shared.size(); s ++)
+	{
+		std::set<int32_t> &characters = shared[s].characters;
+		int32_t minCharacter = characters.empty() ? 0 : *characters.begin();
+
+		offsets.clear();
+		for (std::set<int32_t>::iterator c = characters.begin(); c != characters.end(); ++ c)
+			offsets.push_back(*c - minCharacter);
+
+		size_t found = freeNodes.find(
+				std::max((size_t)3, (size_t)(1 + minCharacter)), offsets) - minCharacter;
+		if (found + FT_MARGIN * 2 >= (size_t)FT_MASK) throw int(FT_OVERFLOW);
+
+		if (nodes.size() < found + FT_MARGIN * 2)
+		{
+			nodes.resize(found + FT_MARGIN * 2);
+			freeNodes.resize(nodes.size() + FT_MARGIN);
+		}
+
+		shared[s].base = found;
+		for (std::set<int32_t>::iterator c = characters.begin(); c != characters.end(); ++ c)
+			freeNodes.take(found + *c);
+		for (typename std::map<int32_t, size_t>::iterator
+				child = shared[s].children.begin(); child != shared[s].children.end(); ++ child)
+			shared[child->second].index = found + child->first;
+
+		numSharedNodes = std::max(numSharedNodes, found + FT_MARGIN - 1);
+	}
+
+	shared[0].index = 1;
+	nodes.resize(numSharedNodes);
+
+	nodes[0] = Node(0, 1);
+	nodes[1] = Node(FT_MASK, shared[0].base);
+	nodes[2] = Node(numValues | FT_MASK, 1);
+
+	for (size_t s = 1; s != shared.size(); s ++)
+		nodes[shared[s].index] = Node(shared[shared[s].parent].index, shared[s].base);
+
+	// other nodes of each trie are shifted to follow those of the last one,
+	// free nodes at the end are kept for the last one only
+	size_t numNodes = numSharedNodes;
+	size_t first    = numSharedNodes;
+	size_t numTails = 0;
+
+	for (const Container *it = begin; it != end; ++ it)
+	{
+		ShardNodes &shard = shards[it - begin];
+
+		size_t last = it->m_nodes.size();
+		while (last > 3 && !it->m_nodes[last - 1].parent) last --;
+
+		shard.shift = first - 3;
+		shard.last  = last;
+		numNodes    = std::max(numNodes, first - 3 + it->m_nodes.size());
+		first      += last - 3;
+
+		// children of shared nodes, of nodes of them or tails moved to them
+		for (typename std::map<SizeT, size_t>::iterator
+				s = shard.shared.begin(); s != shard.shared.end(); ++ s)
+		{
+			const Node *trieNodes = it->m_nodes.m_values;
+			SizeT children = trieNodes[s->first].children;
+
+			size_t end = std::min((size_t)children - 1 + FT_MARGIN, it->m_nodes.size());
+			for (size_t i = children - 1; i < end; i ++)
+				if (trieNodes[i].parent == s->first && moved(*it, shard, i) == 1)
+					nodes[place(*it, shard, shared, i)]
+							= Node(shared[s->second].index, Container::children(*it, shard, i));
+		}
+
+		for (typename std::map<SizeT, std::pair<size_t, int32_t> >::iterator
+				t = shard.tails.begin(); t != shard.tails.end(); ++ t)
+		{
+			const SharedNode &s = shared[t->second.first];
+			SizeT value = (it->m_nodes[t->first].children & ~FT_MASK) + shard.value;
+
+			if (t->second.second == CHAR_TERMINATOR)
+				nodes[s.base + CHAR_TERMINATOR] = Node(s.index, value);
+			else
+				nodes[s.base + t->second.second] = Node(s.index, value | FT_MASK);
+		}
+
+		if (option & FT_TAIL)
+		{
+			numTails += it->m_tails.m_values.size();
+			for (typename std::map<SizeT, size_t>::iterator
+					d = shard.drops.begin(); d != shard.drops.end(); ++ d)
+				numTails -= d->second;
+		}
+	}
+
+	if (numNodes >= (size_t)FT_MASK || (SizeT)numTails != numTails) throw int(FT_OVERFLOW);
+
+	if (observer)
+	{
+		size_t usedNodes = 0;
+		for (size_t i = 0; i != nodes.size(); i ++)
+			usedNodes += nodes[i].parent != 0 || i < 3;
+		for (const Container *it = begin; it != end; ++ it)
+			for (size_t i = 3; i < shards[it - begin].last; i ++)
+				usedNodes += moved(*it, shards[it - begin], i) == 0;
+
+		observer->count("tries", 1);
+		observer->count("shards", end - begin);
+		observer->count("shared_nodes", shared.size());
+		observer->count("keys", numValues);
+		observer->count("nodes", numNodes);
+		observer->count("fill_ratio", (double)usedNodes / numNodes);
+		if (option & FT_TAIL) observer->count("tail_bytes", numTails * sizeof(CharT));
+		if (option & FT_PATH) observer->count("path_bytes", numValues * sizeof(SizeT));
+		observer->phase("serialization");
+	}
+
+	// nodes of the tries, which do not go with shared nodes, follow those
+	out = Container<Node>::buildHeader(out, numNodes);
+	out = std::copy((char *)&*nodes.begin(), (char *)&*nodes.end(), out);
+	std::vector<Node>().swap(nodes);
+
+	for (const Container *it = begin; it != end; ++ it)
+	{
+		const ShardNodes &shard = shards[it - begin];
+		const Node *trieNodes = it->m_nodes.m_values;
+
+		for (size_t i = 3; i < shard.last; i ++)
+		{
+			Node node;
+
+			if (moved(*it, shard, i) == 0)
+				node = Node(place(*it, shard, shared, trieNodes[i].parent),
+						children(*it, shard, i));
+
+			out = std::copy((char *)&node, (char *)(&node + 1), out);
+		}
+	}
+
+	for (Node node; first != numNodes; first ++)
+		out = std::copy((char *)&node, (char *)(&node + 1), out);
+	out = Container<Node>::buildPadding(out, numNodes);
+
+	// nodes of the keys, then tails, in the order of values
+	size_t numPaths = (option & FT_PATH) ? numValues : 0;
+	out = Container<SizeT>::buildHeader(out, numPaths);
+	for (const Container *it = begin; it != end && numPaths; ++ it)
+		for (size_t i = 0; i != it->m_paths.size(); i ++)
+		{
+			SizeT path = place(*it, shards[it - begin], shared, it->m_paths[i]);
+			out = std::copy((char *)&path, (char *)(&path + 1), out);
+		}
+	out = Container<SizeT>::buildPadding(out, numPaths);
+
+	size_t numTailEntries = (option & FT_TAIL) ? numValues + 1 : 1;
+	SizeT tailEntry = 0;
+	out = Container<SizeT>::buildHeader(out, numTailEntries);
+	out = std::copy((char *)&tailEntry, (char *)(&tailEntry + 1), out);
+	for (const Container *it = begin; it != end && (option & FT_TAIL); ++ it)
+		for (size_t i = 0; i != it->m_tails.size(); i ++)
+		{
+			typename std::map<SizeT, size_t>::const_iterator
+					drop = shards[it - begin].drops.find(i);
+			tailEntry += it->m_tails[i].size() - (drop == shards[it - begin].drops.end()
+					? 0 : drop->second);
+			out = std::copy((char *)&tailEntry, (char *)(&tailEntry + 1), out);
+		}
+	out = Container<SizeT>::buildPadding(out, numTailEntries);
+
+	out = Container<CharT>::buildHeader(out, numTails);
+	for (const Container *it = begin; it != end && (option & FT_TAIL); ++ it)
+		for (size_t i = 0; i != it->m_tails.size(); i ++)
+		{
+			typename std::map<SizeT, size_t>::const_iterator
+					drop = shards[it - begin].drops.find(i);
+			Vector<CharT, SizeT> tail = it->m_tails[i];
+			out = std::copy((char *)(tail.begin() + (drop == shards[it - begin].drops.end()
+					? 0 : drop->second)), (char *)tail.end(), out);
+		}
+	out = Container<CharT>::buildPadding(out, numTails);
+
+	if (observer) observer->phase("values");
+	if (skipLast == 0)
+	{
+		out = Container<ValueT>::buildHeader(out, numValues);
+		for (const Container *it = begin; it != end; ++ it)
+			out = std::copy((char *)it->m_values.begin(), (char *)it->m_values.end(), out);
+		out = Container<ValueT>::buildPadding(out, numValues);
+	}
+	else if (skipLast != (void *)(-1))
+		for (const Container *it = begin; it != end; ++ it)
+			std::copy(it->m_values.begin(), it->m_values.end(),
+					(ValueT *)skipLast + shards[it - begin].value);
+	if (observer) observer->end();
 
 	return out;
 }
@@ -2056,10 +3589,22 @@ OutIteratorT Container<HashMap<KeyT, ValueT, HashT, SizeT> >::build(
 	typedef std::pair<KeyType, ValueType> ItemType;
 
 	std::vector<std::vector<std::vector<ItemType> > > items;
+	std::vector<std::vector<SizeT> > seeds;
+
+	BuildObserver *observer = buildObserver();
+	if (observer) { observer->begin("HashMap"); observer->phase("map"); }
 
 	items.reserve(std::distance(begin, end));
 	for (IteratorT it = begin; it != end; ++ it)
 	{
+		if (IsPerfectHash<HashT>::value)
+		{
+			items.push_back(std::vector<std::vector<ItemType> >(it->size()));
+			seeds.push_back(std::vector<SizeT>());
+			displace(it->begin(), it->end(), items.back(), seeds.back());
+			continue;
+		}
+
 		size_t bucket_size = it->size() ? (it->size() | 1) : 0;
 
 		std::vector<SizeT> counts(bucket_size);
@@ -2079,12 +3624,111 @@ OutIteratorT Container<HashMap<KeyT, ValueT, HashT, SizeT> >::build(
 					ItemType(itSub->first, itSub->second));
 	}
 
+	if (observer)
+	{
+		size_t numKeys = 0, numBuckets = 0, usedBuckets = 0, numSeeds = 0;
+		for (size_t i = 0; i != items.size(); i ++)
+			for (size_t j = 0; j != items[i].size(); j ++)
+			{
+				numKeys += items[i][j].size();
+				usedBuckets += !items[i][j].empty();
+				numBuckets ++;
+			}
+		for (size_t i = 0; i != seeds.size(); i ++)
+			numSeeds += seeds[i].size();
+
+		observer->count("maps", items.size());
+		observer->count("keys", numKeys);
+		observer->count("buckets", numBuckets);
+		observer->count("fill_ratio", numBuckets ? (double)usedBuckets / numBuckets : 0);
+		if (IsPerfectHash<HashT>::value) observer->count("seed_bytes", numSeeds * sizeof(SizeT));
+		observer->phase("serialization");
+	}
+
+	if (IsPerfectHash<HashT>::value)
+	{
+		Container<Vector<SizeT, SizeT> >::build(out, seeds.begin(), seeds.end());
+		seeds.clear();
+	}
 	Container<Vector<Vector<Pair<KeyT, ValueT>, SizeT>, SizeT> >::build(
 			out, items.begin(), items.end(), skipLast); items.clear();
+	if (observer) observer->end();
 
 	return out;
 }
 
+template <class KeyT, class ValueT, class HashT, class SizeT>
+template <class SubIteratorT, class ItemT>
+void Container<HashMap<KeyT, ValueT, HashT, SizeT> >::displace(
+		SubIteratorT begin, SubIteratorT end,
+		std::vector<std::vector<ItemT> > &slots, std::vector<SizeT> &seeds)
+{
+	typedef std::vector<std::pair<uint64_t, SubIteratorT> > Bucket;
+
+	size_t size = slots.size();
+	std::vector<Bucket> buckets((size + PerfectHash::FT_BUCKET - 1) / PerfectHash::FT_BUCKET);
+	seeds.assign(buckets.size(), 0);
+
+	size_t maxBucket = 0;
+	for (SubIteratorT it = begin; it != end; ++ it)
+	{
+		uint64_t hash = HashT()(it->first);
+		Bucket &bucket = buckets[PerfectHash::bucket(hash, buckets.size())];
+		for (size_t i = 0; i != bucket.size(); i ++)
+			if (bucket[i].first == hash)
+				throw int(bucket[i].second->first == it->first ? -1 : FT_COLLISION);
+		bucket.push_back(std::make_pair(hash, it));
+		maxBucket = std::max(maxBucket, bucket.size());
+	}
+
+	// largest buckets first, while most slots are free
+	std::vector<std::vector<size_t> > bySize(maxBucket + 1);
+	for (size_t i = 0; i != buckets.size(); i ++)
+		bySize[buckets[i].size()].push_back(i);
+
+	std::vector<bool> used(size);
+	std::vector<size_t> taken;
+	size_t free = 0;
+
+	for (size_t n = maxBucket; n >= 1; n --)
+		for (size_t k = 0; k != bySize[n].size(); k ++)
+		{
+			Bucket &bucket = buckets[bySize[n][k]];
+			SizeT &seed = seeds[bySize[n][k]];
+
+			if (n == 1)
+			{
+				// a key alone takes any free slot, which its seed tells
+				while (used[free]) free ++;
+				if (free >= (size_t)PerfectHash::direct<SizeT>()) throw int(FT_OVERFLOW);
+				seed = PerfectHash::direct<SizeT>() | (SizeT)free;
+				taken.assign(1, free);
+			}
+			else for (seed = 0; ; seed ++)
+			{
+				// no seed left, as if keys had equal hashes
+				if (seed == PerfectHash::direct<SizeT>()) throw int(FT_COLLISION);
+
+				taken.clear();
+				for (size_t i = 0; i != n; i ++)
+				{
+					size_t slot = PerfectHash::displace(bucket[i].first, seed, size);
+					if (used[slot] || std::find(taken.begin(), taken.end(), slot)
+							!= taken.end()) break;
+					taken.push_back(slot);
+				}
+				if (taken.size() == n) break;
+			}
+
+			for (size_t i = 0; i != n; i ++)
+			{
+				used[taken[i]] = true;
+				slots[taken[i]].push_back(
+						ItemT(bucket[i].second->first, bucket[i].second->second));
+			}
+		}
+}
+
 template <class ValueT1, class ValueT2>
 template <class OutIteratorT, class IteratorT>
 OutIteratorT Container<Pair<ValueT1, ValueT2> >::build(
@@ -4,159 +4,468 @@
 #define __MMAP_2_H__
 
 #include <fcntl.h>
+#include <sched.h>
+#include <unistd.h>
 #include <sys/mman.h>
 #include <sys/stat.h>
 #include <pthread.h>
+#include <stdint.h>
 
+#include <algorithm>
 #include <string>
 #include <map>
+#include <vector>
 
 namespace ft2 {
 
+/** @brief residency policies of a mapping, or-ed as the advice of MMap and
+ *  Container, applied once to the mapping shared by them */
+enum
+{
+	FT_RANDOM     = 1,  ///< madvise(MADV_RANDOM): no read-ahead around lookups
+	FT_SEQUENTIAL = 2,  ///< madvise(MADV_SEQUENTIAL): read-ahead, e.g. for dumping
+	FT_WILLNEED   = 4,  ///< madvise(MADV_WILLNEED): read in, in the background
+	FT_HUGEPAGE   = 8,  ///< madvise(MADV_HUGEPAGE): transparent huge pages, where
+	                    ///< the kernel backs files by them
+	FT_MLOCK      = 16, ///< mlock(2): read in and kept in memory, failing beyond
+	                    ///< RLIMIT_MEMLOCK
+	FT_WARMUP     = 32, ///< touch every page by threads before loading returns,
+	                    ///< the nodes and tails of a Trie first
+};
+
 template <class T>
 class MMap
 {
 public:
-	MMap(const char *filename = "", int prot = PROT_READ, int flags = MAP_SHARED);
+	MMap(const char *filename = "", int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0);
 	MMap(const MMap &from);
 	MMap & operator =(const MMap &from);
 	~MMap();
 
-	const std::string & filename() const { return m_filename; }
+	const std::string & filename() const;
 
 	std::pair<const void *, size_t> mmap() const;
 
+	/** @brief whether filename names another file than the one mapped, e.g.
+	 *  a new one renamed over it */
+	bool replaced() const;
+
+protected:
+	/* whether to warm the mapping up for advice, by the caller, once */
+	bool warming(int advice);
+
+	/* touch the pages of [begin, end) of the mapping by threads at once */
+	void touch(const void *begin, const void *end) const;
+
 private:
+	/* a mapping of a file, shared by the MMaps of it, which count themselves
+	 * in used by atomic operations, and outlives its place in m_mmaps once
+	 * the file is replaced, until the last is gone */
 	struct Usage
 	{
-		Usage() : fd(-1), address(0), length(0), used(0) {}
+		Usage() : fd(-1), address(0), length(0), used(1), advised(0) {}
+
+		bool same(const struct stat &st) const
+		{
+			return st.st_dev == dev && st.st_ino == ino && (size_t)st.st_size == length
+					&& st.st_mtim.tv_sec == mtime.tv_sec && st.st_mtim.tv_nsec == mtime.tv_nsec;
+		}
+
+		/* count one more MMap of it, unless the last one is gone */
+		bool acquire()
+		{
+			for (size_t n = used; n; n = used)
+				if (__sync_bool_compare_and_swap(&used, n, n + 1)) return true;
+			return false;
+		}
 
+		std::string filename;
 		int fd;
 		const void *address;
 		size_t length;
-		size_t used;
+		volatile size_t used;
+		volatile int advised; ///< residency policies applied
+		dev_t dev;
+		ino_t ino;
+		struct timespec mtime;
 	};
 
-	std::string m_filename;
+	/* the current mapping of filename of the same file as st, counted */
+	static Usage *find(const std::string &filename, const struct stat *st);
+	/* a new mapping of filename, or the current one of the same file */
+	static Usage *map(const char *filename, int prot, int flags);
+
+	bool advise(int advice);
+	void release();
+
+	static void *touchPages(void *range);
+
+	Usage *m_usage;
 
+	/* m_mutex guards m_mmaps, taken by an MMap of a filename and by the last
+	 * MMap of a mapping only */
 	static pthread_mutex_t m_mutex;
-	static std::map<std::string, Usage> *m_mmaps;
+	static std::map<std::string, Usage *> *m_mmaps;
 };
 
 template <class T>
-MMap<T>::MMap(const char *filename, int prot, int flags) : m_filename(filename)
+MMap<T>::MMap(const char *filename, int prot, int flags, int advice) : m_usage(0)
 {
-	if (m_filename.empty()) return;
+	if (filename[0] == 0) return;
 
+	struct stat st;
+	if (!(m_usage = find(filename, stat(filename, &st) == 0 ? &st : 0)))
+		m_usage = map(filename, prot, flags);
+
+	if (!advise(advice))
+	{
+		release();
+		throw int(-1);
+	}
+}
+
+template <class T>
+typename MMap<T>::Usage *MMap<T>::map(const char *filename, int prot, int flags)
+{
+	// map the file out of the lock, and keep the mapping of the same file
+	// if another thread has made it meanwhile
+	struct stat st;
 	Usage usage;
+	usage.fd = open(filename, (prot & PROT_WRITE && flags & MAP_SHARED) ? O_RDWR : O_RDONLY);
+	if (usage.fd < 0) throw int(-1);
+	if (fstat(usage.fd, &st) < 0 || st.st_size == 0
+			|| (usage.address = ::mmap(0, st.st_size, prot, flags, usage.fd, 0)) == MAP_FAILED)
+	{
+		close(usage.fd);
+		throw int(-1);
+	}
+	usage.filename = filename;
+	usage.length = st.st_size;
+	usage.dev = st.st_dev;
+	usage.ino = st.st_ino;
+	usage.mtime = st.st_mtim;
+	if (flags & MAP_POPULATE)
+		madvise((void *)usage.address, usage.length, MADV_WILLNEED);
+
+	Usage *mapped;
 
 	pthread_mutex_lock(&m_mutex);
-	if (m_mmaps == 0) m_mmaps = new std::map<std::string, Usage>();
-	typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-	if (it == m_mmaps->end())
+	if (m_mmaps == 0) m_mmaps = new std::map<std::string, Usage *>();
+	Usage *&current = (*m_mmaps)[usage.filename];
+	if (current && current->same(st) && current->acquire())
+		mapped = current;
+	else // the mapping of a file replaced is left to the MMaps still using it
+		mapped = current = new Usage(usage);
+	pthread_mutex_unlock(&m_mutex);
+
+	if (mapped->address != usage.address)
 	{
-		usage.fd = open(m_filename.c_str(),
-				(prot & PROT_WRITE && flags & MAP_SHARED) ? O_RDWR : O_RDONLY);
-		if (usage.fd < 0) goto error;
-		struct stat st;
-		if (fstat(usage.fd, &st) < 0 || st.st_size == 0) goto error;
-		usage.address = ::mmap(0, st.st_size, prot, flags, usage.fd, 0);
-		if (usage.address == MAP_FAILED) goto error;
-		usage.length = st.st_size;
-		if (flags & MAP_POPULATE)
-			madvise((void *)usage.address, usage.length, MADV_WILLNEED);
-		it = m_mmaps->insert(std::make_pair(m_filename, usage)).first;
+		munmap((void *)usage.address, usage.length);
+		close(usage.fd);
 	}
-	it->second.used ++;
-	pthread_mutex_unlock(&m_mutex);
-	return;
 
-error:
-	if (usage.fd >= 0) close(usage.fd);
-	if (m_mmaps && m_mmaps->empty()) { delete m_mmaps; m_mmaps = 0; }
-	pthread_mutex_unlock(&m_mutex);
-	throw int(-1);
+	return mapped;
 }
 
 template <class T>
-MMap<T>::MMap(const MMap<T> &from) : m_filename(from.m_filename)
+typename MMap<T>::Usage *MMap<T>::find(const std::string &filename, const struct stat *st)
 {
-	if (m_filename.empty()) return;
+	Usage *usage = 0;
 
 	pthread_mutex_lock(&m_mutex);
-	typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-	it->second.used ++;
+	if (m_mmaps)
+	{
+		typename std::map<std::string, Usage *>::iterator it = m_mmaps->find(filename);
+		// a file gone keeps its mapping, as one renamed over does not
+		if (it != m_mmaps->end() && (!st || it->second->same(*st)) && it->second->acquire())
+			usage = it->second;
+	}
 	pthread_mutex_unlock(&m_mutex);
+
+	return usage;
+}
+
+template <class T>
+MMap<T>::MMap(const MMap<T> &from) : m_usage(from.m_usage)
+{
+	if (m_usage) __sync_fetch_and_add(&m_usage->used, 1);
 }
 
 template <class T>
 MMap<T> & MMap<T>::operator =(const MMap<T> &from)
 {
-	if (&from == this) return *this;
+	if (from.m_usage) __sync_fetch_and_add(&from.m_usage->used, 1);
+	if (m_usage) release();
 
-	if (!m_filename.empty())
-	{
-		pthread_mutex_lock(&m_mutex);
-		typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-		it->second.used --;
-		if (it->second.used == 0)
-		{
-			munmap((void *)it->second.address, it->second.length);
-			close(it->second.fd);
-			m_mmaps->erase(it);
-		}
-		if (m_mmaps && m_mmaps->empty()) { delete m_mmaps; m_mmaps = 0; }
-		pthread_mutex_unlock(&m_mutex);
-	}
+	m_usage = from.m_usage;
+
+	return *this;
+}
+
+template <class T>
+MMap<T>::~MMap()
+{
+	if (m_usage) release();
+}
+
+/* apply the policies of advice not yet applied to the mapping, failing
+ * only if mlock fails, as the others are mere advice */
+template <class T>
+bool MMap<T>::advise(int advice)
+{
+	advice &= ~(m_usage->advised | FT_WARMUP);
+	if (advice == 0) return true;
+
+	void *address = (void *)m_usage->address;
+	size_t length = m_usage->length;
+
+	if (advice & FT_RANDOM)     madvise(address, length, MADV_RANDOM);
+	if (advice & FT_SEQUENTIAL) madvise(address, length, MADV_SEQUENTIAL);
+	if (advice & FT_WILLNEED)   madvise(address, length, MADV_WILLNEED);
+#ifdef MADV_HUGEPAGE
+	if (advice & FT_HUGEPAGE)   madvise(address, length, MADV_HUGEPAGE);
+#endif
+	if (advice & FT_MLOCK && mlock(address, length) < 0) return false;
+
+	__sync_fetch_and_or(&m_usage->advised, advice);
+	return true;
+}
+
+template <class T>
+bool MMap<T>::warming(int advice)
+{
+	return m_usage && advice & FT_WARMUP
+			&& !(__sync_fetch_and_or(&m_usage->advised, FT_WARMUP) & FT_WARMUP);
+}
+
+template <class T>
+void *MMap<T>::touchPages(void *range)
+{
+	static volatile uint8_t sink;
 
-	m_filename = from.m_filename;
+	const uint8_t **pages = (const uint8_t **)range;
+	size_t page = sysconf(_SC_PAGESIZE);
+	uint8_t x = 0;
 
-	if (!m_filename.empty())
+	for (const uint8_t *p = pages[0]; p < pages[1]; p += page) x ^= *p;
+	sink = x;
+
+	return 0;
+}
+
+template <class T>
+void MMap<T>::touch(const void *begin, const void *end) const
+{
+	// a slice of at least 1MB for each thread, some in a thread of their own
+	static const size_t slice = 1 << 20;
+
+	size_t page = sysconf(_SC_PAGESIZE);
+	const uint8_t *first = (const uint8_t *)((size_t)begin / page * page);
+	size_t length = (const uint8_t *)end - first;
+	if ((const uint8_t *)end <= first) return;
+
+	// read in ahead by large reads, even with FT_RANDOM, advised again after
+	madvise((void *)first, length, MADV_SEQUENTIAL);
+
+	long cpus = sysconf(_SC_NPROCESSORS_ONLN);
+	size_t threads = std::min((size_t)std::max(cpus, 1L), (length + slice - 1) / slice);
+	size_t size = (length / threads + page - 1) / page * page;
+
+	std::vector<const uint8_t *> ranges(threads * 2);
+	std::vector<pthread_t> ids(threads);
+	std::vector<bool> started(threads);
+
+	for (size_t i = 0; i != threads; i ++)
 	{
-		pthread_mutex_lock(&m_mutex);
-		typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-		it->second.used ++;
-		pthread_mutex_unlock(&m_mutex);
+		ranges[i * 2] = first + std::min(i * size, length);
+		ranges[i * 2 + 1] = i + 1 == threads ? (const uint8_t *)end
+				: first + std::min((i + 1) * size, length);
+		started[i] = i && pthread_create(&ids[i], 0, touchPages, &ranges[i * 2]) == 0;
 	}
 
-	return *this;
+	for (size_t i = 0; i != threads; i ++)
+		if (!started[i]) touchPages(&ranges[i * 2]);
+	for (size_t i = 0; i != threads; i ++)
+		if (started[i]) pthread_join(ids[i], 0);
+
+	madvise((void *)first, length, m_usage->advised & FT_RANDOM ? MADV_RANDOM
+			: m_usage->advised & FT_SEQUENTIAL ? MADV_SEQUENTIAL : MADV_NORMAL);
 }
 
 template <class T>
-MMap<T>::~MMap()
+void MMap<T>::release()
 {
-	if (m_filename.empty()) return;
+	if (__sync_sub_and_fetch(&m_usage->used, 1)) return;
 
+	// the last one, after which no MMap acquires it from m_mmaps
 	pthread_mutex_lock(&m_mutex);
-	typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-	it->second.used --;
-	if (it->second.used == 0)
-	{
-		munmap((void *)it->second.address, it->second.length);
-		close(it->second.fd);
-		m_mmaps->erase(it);
-	}
-	if (m_mmaps && m_mmaps->empty()) { delete m_mmaps; m_mmaps = 0; }
+	typename std::map<std::string, Usage *>::iterator it = m_mmaps->find(m_usage->filename);
+	if (it != m_mmaps->end() && it->second == m_usage) m_mmaps->erase(it);
+	if (m_mmaps->empty()) { delete m_mmaps; m_mmaps = 0; }
 	pthread_mutex_unlock(&m_mutex);
+
+	munmap((void *)m_usage->address, m_usage->length);
+	close(m_usage->fd);
+	delete m_usage;
+}
+
+template <class T>
+const std::string & MMap<T>::filename() const
+{
+	static const std::string none;
+
+	return m_usage ? m_usage->filename : none;
 }
 
 template <class T>
 std::pair<const void *, size_t> MMap<T>::mmap() const
 {
-	if (m_filename.empty()) return std::pair<const void *, size_t>();
+	if (!m_usage) return std::pair<const void *, size_t>();
 
-	pthread_mutex_lock(&m_mutex);
-	typename std::map<std::string, Usage>::iterator it = m_mmaps->find(m_filename);
-	std::pair<const void *, size_t> result(it->second.address, it->second.length);
-	pthread_mutex_unlock(&m_mutex);
+	return std::pair<const void *, size_t>(m_usage->address, m_usage->length);
+}
 
-	return result;
+template <class T>
+bool MMap<T>::replaced() const
+{
+	struct stat st;
+
+	return m_usage && stat(m_usage->filename.c_str(), &st) == 0 && !m_usage->same(st);
 }
 
 template <class T>
 pthread_mutex_t MMap<T>::m_mutex = PTHREAD_MUTEX_INITIALIZER;
 template <class T>
-std::map<std::string, typename MMap<T>::Usage> *MMap<T>::m_mmaps = 0;
+std::map<std::string, typename MMap<T>::Usage *> *MMap<T>::m_mmaps = 0;
+
+/** @brief a container of a file, loaded again when the file is replaced
+ *
+ * Threads read the container through a Reading, in the epoch it begins, at
+ * the cost of two atomic operations and no lock. reload() maps a replaced
+ * file next to the one in use, publishes the container of it to readings of
+ * a new epoch, and waits for the readings of the last epoch to end before it
+ * releases the old container, so that the old file is unmapped once the
+ * lookups in flight on it drain, e.g.:
+ *
+ *   Reloadable<Container<Trie<int> > > words("words.ft");
+ *   ...
+ *   {
+ *       Reloadable<Container<Trie<int> > >::Reading reading(words);
+ *       int x = (*reading)[0]("word");
+ *   }
+ *   ...
+ *   words.reload(); // now and then, or after renaming a new words.ft over
+ *
+ * @tparam T      container type, e.g. Container<Trie<int> >
+ */
+template <class T>
+class Reloadable
+{
+public:
+	/** @brief load the container of filename
+	 *
+	 * @param[in]  filename filename to be loaded, as in Container
+	 * @param[in]  prot     see mmap(2)
+	 * @param[in]  flags    see mmap(2)
+	 * @param[in]  advice   residency policies, e.g. FT_MLOCK | FT_WARMUP, of
+	 *                      the file and of each loaded again before it is used
+	 * @throw      int      failed (file not exists, unreadable, etc.)
+	 */
+	explicit Reloadable(const char *filename, int prot = PROT_READ, int flags = MAP_SHARED,
+			int advice = 0)
+			: m_filename(filename), m_prot(prot), m_flags(flags), m_advice(advice),
+			  m_current(new T(filename, prot, flags, advice)), m_epoch(0)
+	{
+		m_readers[0] = m_readers[1] = 0;
+		pthread_mutex_init(&m_reloading, 0);
+	}
+	~Reloadable()
+	{
+		delete m_current;
+		pthread_mutex_destroy(&m_reloading);
+	}
+
+	/** @brief the container of the epoch a reading begins in, valid until
+	 *  the reading ends */
+	class Reading
+	{
+	public:
+		explicit Reading(const Reloadable &reloadable) : m_reloadable(reloadable)
+		{
+			// counted in the epoch unless it has passed meanwhile
+			for (;;)
+			{
+				m_epoch = m_reloadable.m_epoch;
+				__sync_fetch_and_add(&m_reloadable.m_readers[m_epoch & 1], 1);
+				if (m_epoch == m_reloadable.m_epoch) break;
+				__sync_fetch_and_sub(&m_reloadable.m_readers[m_epoch & 1], 1);
+			}
+			m_container = m_reloadable.m_current;
+		}
+		~Reading() { __sync_fetch_and_sub(&m_reloadable.m_readers[m_epoch & 1], 1); }
+
+		const T & operator *() const { return *m_container; }
+		const T * operator ->() const { return m_container; }
+
+	private:
+		Reading(const Reading &);
+		Reading & operator =(const Reading &);
+
+		const Reloadable &m_reloadable;
+		size_t m_epoch;
+		const T *m_container;
+	};
+
+	/** @brief load the file again if it is replaced
+	 *
+	 * @return              whether the container is replaced; a replaced
+	 *                      file failing to load keeps the one in use
+	 */
+	bool reload()
+	{
+		pthread_mutex_lock(&m_reloading);
+
+		T *next = 0;
+		if (m_current->replaced())
+		{
+			try { next = new T(m_filename.c_str(), m_prot, m_flags, m_advice); }
+			catch (int) {}
+		}
+
+		if (next)
+		{
+			T *last = const_cast<T *>(m_current);
+			size_t epoch = m_epoch;
+
+			m_current = next;
+			__sync_synchronize();
+			m_epoch = epoch + 1;
+			__sync_synchronize();
+
+			while (m_readers[epoch & 1]) sched_yield();
+			delete last;
+		}
+
+		pthread_mutex_unlock(&m_reloading);
+
+		return next != 0;
+	}
+
+private:
+	Reloadable(const Reloadable &);
+	Reloadable & operator =(const Reloadable &);
+
+	std::string m_filename;
+	int m_prot;
+	int m_flags;
+	int m_advice;
+
+	const T *volatile m_current;
+	volatile size_t m_epoch;
+	mutable volatile size_t m_readers[2]; ///< readings of even and odd epochs
+	pthread_mutex_t m_reloading;
+};
 
 } // namespace ft2
 
@@ -10,7 +10,7 @@
 # au BufReadPost *.py syntax region CppRegion keepend contains=@Cpp
 #     \ start=+"" """+ end=+""" ""+
 
-import sys, optparse, re, os, tempfile, shutil, signal, md5
+import sys, optparse, re, os, tempfile, shutil, signal, fcntl, md5, struct
 
 if sys.version_info >= (2, 4):
 	import subprocess
@@ -28,12 +28,86 @@ parser.add_option("-d", "--disk",  action = "store_true", default = False,
 		help = "swap intermediate data on disk during building (default: in memory)")
 parser.add_option("-p", "--print", action = "store_true", default = False,
 		help = "print Trie values by manually inputing keys", dest = "printing")
+parser.add_option("--prefix", action = "store_true", default = False,
+		help = "print the keys and values of input.ft beginning with each prefix "
+				"from stdin, in order, each followed by an empty record, for a Trie "
+				"format only", dest = "prefixing")
+parser.add_option("--limit", metavar = "N", type = "int",
+		help = "print at most N keys of each prefix of --prefix (default: all)")
+parser.add_option("-b", "--bench", action = "store_true", default = False,
+		help = "look up keys from stdin in input.ft and print the throughput and "
+				"latency percentiles in JSON", dest = "benching")
+parser.add_option("-B", "--batch", metavar = "MODE", choices = ["hits", "values"],
+		help = "look up binary keys from stdin in input.ft, each a native uint32_t "
+				"length in bytes and the raw key units, and write a bitmap of hits or "
+				"the raw values (zeros for misses) to stdout, MODE is hits or values")
+parser.add_option("-P", "--pipe", action = "store_true", default = False,
+		help = "look up framed binary requests from stdin in input.ft and write "
+				"framed responses to stdout, for ftclient.Client, loading input.ft "
+				"again once a new one is renamed over it", dest = "piping")
+parser.add_option("--serve", metavar = "SOCKET",
+		help = "keep input.ft mapped and serve the framed requests of -P on the "
+				"UNIX socket SOCKET, in a pool of threads (-j N, default: one per "
+				"CPU), until interrupted, loading input.ft again once a new one is "
+				"renamed over it, without dropping requests")
+parser.add_option("--scan", metavar = "MODE", choices = ["all", "longest"],
+		help = "scan documents, the files after input.ft or stdin, for the keys of "
+				"input.ft in chunks by a pool of threads (-j N, default: one per CPU), "
+				"and print the offset, key and value of each match, then the throughput "
+				"in JSON to stderr, MODE is all for every match at every offset, or "
+				"longest for the longest leftmost matches without overlaps, for a Trie "
+				"format of c* keys only")
+parser.add_option("--residency", metavar = "POLICY,...",
+		help = "load input.ft by the residency policies POLICY, any of random (no "
+				"read-ahead around lookups), sequential (read-ahead), willneed (read in "
+				"ahead in the background), hugepage (transparent huge pages, where the "
+				"kernel backs files by them), mlock (kept in memory, failing beyond "
+				"RLIMIT_MEMLOCK) and warmup (touch every page by a pool of threads before "
+				"the first lookup, the nodes and tails of a Trie first)")
+parser.add_option("--sizes", metavar = "BITS", choices = ["32", "64", "auto"], default = "auto",
+		help = "size types of containers not given one in the format, 32 or 64 bits "
+				"for billions of keys, or auto to build by 32 bits and again by 64 when "
+				"sizes exceed them, and to read input.ft by those it was built with; a "
+				"size type is given by a last template argument, e.g. T,FT_PATH,64 or "
+				"V,uint64_t (default: %default)")
+parser.add_option("-s", "--sorted", action = "store_true", default = False,
+		help = "input keys are sorted (e.g. by LC_ALL=C sort) and uniqued, "
+				"build a Trie of c* or u* keys without sorting them in memory")
+parser.add_option("-j", "--jobs", metavar = "N", type = "int", default = 1,
+		help = "build a Trie in N parallel processes, each for a key range split "
+				"by the first character (implies -d)")
+parser.add_option("-M", "--memory-limit", metavar = "MB", type = "int",
+		help = "build a Trie of input larger than memory: sort records on disk in "
+				"runs of about MB megabytes, merge them, build key ranges of about "
+				"an eighth of it one by one and join them on disk; the values of "
+				"all keys are still built at once in memory (implies -d)")
+parser.add_option("-i", "--input-format", metavar = "FORMAT",
+		choices = ["text", "binary"], default = "text",
+		help = "read input.txt as text, or as binary records of the types of the "
+				"format string in native byte order, as written by ftwriter, to build "
+				"in memory without parsing, FORMAT is text or binary (default: %default)")
+parser.add_option("-o", "--output", metavar = "FILE",
+		help = "write output.ft to FILE in large blocks instead of to stdout, "
+				"replacing FILE only once it is complete and synced")
+parser.add_option("-C", "--compat-text", action = "store_true", default = False,
+		help = "print floats with the fixed precision of earlier versions, 8 digits "
+				"of a float and 17 of a double, instead of the shortest text that "
+				"reads back to the same value")
+parser.add_option("--stats", metavar = "FILE",
+		help = "write timings of the phases of building, peak RSS and statistics "
+				"of the containers built in JSON to FILE")
 parser.add_option("-I", "--include", metavar = "DIR",
 		help = "specify the path to FastTrie.h and MMap.h")
 parser.add_option("-x", "--extend", metavar = "FILE", action = "append", default = [],
 		help = "include some C/C++ source file for use in HashMap")
 parser.add_option("-c", "--compile", metavar = "DIR",
-		help = "generate and compile C++ source code in DIR")
+		help = "generate and compile C++ source code in DIR, which caches the "
+				"compiled binaries (default: $FASTTRIE_COMPILE or ~/.cache/fasttrie)")
+parser.add_option("--no-cache", action = "store_true", default = False,
+		help = "compile in a temporary directory instead of the default cache")
+parser.add_option("--cache-size", metavar = "MB", type = "int", default = 256,
+		help = "evict least recently used binaries when the cache exceeds MB "
+				"megabytes (default: %default)")
 
 (options, args) = parser.parse_args()
 
@@ -75,6 +149,22 @@ class Container:
 			"f": "float",   "d": "double",   "u": "uint16_t",
 	}
 
+	# whether the format gives a size type of any container
+	sized = False
+
+	# template arguments of the format after the value type, e.g. ",FT_TAIL",
+	# where a last 32 or 64 is the size type after defaults of the others, and
+	# with --sizes 64 a size type not given is uint64_t
+	def targs(self, defaults):
+		arg = self.m.group("arg").split(",")[1:]
+		if len(arg) >= len(defaults) or arg and arg[-1].strip() in ["32", "64"]:
+			Container.sized = True
+		if arg and arg[-1].strip() in ["32", "64"]:
+			arg = arg[:-1] + defaults[len(arg) - 1:-1] + ["uint" + arg[-1].strip() + "_t"]
+		elif options.sizes == "64" and len(arg) < len(defaults):
+			arg = arg + defaults[len(arg):-1] + ["uint64_t"]
+		return "".join(map(lambda x: "," + x, arg))
+
 	# generate containers recursively
 	# self.type: C++ type of the container, e.g. Trie<Vector<Struct_2 > >
 	# self.code: C++ code for reading or writing the C++ type above
@@ -87,14 +177,19 @@ class Container:
 				# a struct
 				self.type = "Struct_" + str(n) + " "
 				self.code = self.format2Struct(n) \
-						+ self.format2getStruct(n) + self.format2putStruct(n) \
+						+ self.format2getStruct(n) + self.format2getStructText(n) \
+						+ self.format2readStruct(n) \
+						+ self.format2putStruct(n) \
 						+ self.format2buildStruct(n)
 				self.size = 1
 			else:
 				# a struct sequence
-				self.type = "Vector<Struct_" + str(n) + " > "
+				self.type = "Vector<Struct_" + str(n) \
+						+ (options.sizes == "64" and ", uint64_t" or "") + " > "
 				self.code = self.format2Struct(n) \
-						+ self.format2getVectorStruct(n) + self.format2putVectorStruct(n) \
+						+ self.format2getVectorStruct(n) + self.format2getVectorStructText(n) \
+						+ self.format2readVectorStruct(n) \
+						+ self.format2putVectorStruct(n) \
 						+ self.format2buildVectorStruct(n)
 				self.size = 1
 		elif re.match(self.pttnVector + '$', format):
@@ -103,10 +198,11 @@ class Container:
 			self.sub = Container(n + 1, self.m.group("sub"))
 
 			# a Vector
-			self.type = "Vector<" + self.sub.type + self.m.group("arg") + " > "
-			self.fake = "Vector<bool"             + self.m.group("arg") + " > "
+			self.type = "Vector<" + self.sub.type + self.targs(["uint32_t"]) + " > "
+			self.fake = "Vector<bool"             + self.targs(["uint32_t"]) + " > "
 			self.code = self.sub.code \
-					+ self.format2getVector(n) + self.format2putVector(n) \
+					+ self.format2getVector(n) + self.format2readVector(n) \
+					+ self.format2putVector(n) \
 					+ self.format2buildVector(n)
 			self.size = self.sub.size + 1
 		elif re.match(self.pttnTrieSet + '$', format):
@@ -115,9 +211,10 @@ class Container:
 			self.key = Container(n + 1, self.m.group("key"))
 
 			# a Trie<bool>
-			self.type = "Trie<bool" + self.m.group("arg") + " > "
+			self.type = "Trie<bool" + self.targs(["FT_TAIL", "uint8_t", "uint32_t"]) + " > "
 			self.code = self.key.code \
-					+ self.format2getTrieSet(n) + self.format2putTrieSet(n) \
+					+ self.format2getTrieSet(n) + self.format2readTrieSet(n) \
+					+ self.format2putTrieSet(n) \
 					+ self.format2buildTrieSet(n)
 			self.size = self.key.size + 1
 		elif re.match(self.pttnTrie + '$', format):
@@ -127,10 +224,13 @@ class Container:
 			self.sub = Container(n + 2, self.m.group("sub"))
 
 			# a Trie
-			self.type = "Trie<"  + self.sub.type + self.m.group("arg") + " > "
-			self.fake = "Trie<fstream::pos_type" + self.m.group("arg") + " > "
+			self.type = "Trie<"  + self.sub.type \
+					+ self.targs(["FT_TAIL", "uint8_t", "uint32_t"]) + " > "
+			self.fake = "Trie<fstream::pos_type" \
+					+ self.targs(["FT_TAIL", "uint8_t", "uint32_t"]) + " > "
 			self.code = self.key.code + self.sub.code \
-					+ self.format2getTrie(n) + self.format2putTrie(n) \
+					+ self.format2getTrie(n) + self.format2readTrie(n) \
+					+ self.format2putTrie(n) \
 					+ self.format2buildTrie(n)
 			self.size = self.key.size + self.sub.size + 1
 		elif re.match(self.pttnHashSet + '$', format):
@@ -140,9 +240,10 @@ class Container:
 
 			# a HashMap<bool>
 			self.type = "HashMap<" + self.key.type \
-					+ ", bool" + self.m.group("arg") + " > "
+					+ ", bool" + self.targs(["MulAddHash", "uint32_t"]) + " > "
 			self.code = self.key.code \
-					+ self.format2getTrieSet(n) + self.format2putTrieSet(n) \
+					+ self.format2getTrieSet(n) + self.format2readTrieSet(n) \
+					+ self.format2putTrieSet(n) \
 					+ self.format2buildTrieSet(n) # just use Trie's code
 			self.size = self.key.size + 1
 		elif re.match(self.pttnHashMap + '$', format):
@@ -153,11 +254,12 @@ class Container:
 
 			# a HashMap
 			self.type = "HashMap<" + self.key.type \
-					+ ", "  + self.sub.type + self.m.group("arg") + " > "
+					+ ", "  + self.sub.type + self.targs(["MulAddHash", "uint32_t"]) + " > "
 			self.fake = "HashMap<" + self.key.type \
-					+ ", fstream::pos_type" + self.m.group("arg") + " > "
+					+ ", fstream::pos_type" + self.targs(["MulAddHash", "uint32_t"]) + " > "
 			self.code = self.key.code + self.sub.code \
-					+ self.format2getTrie(n) + self.format2putTrie(n) \
+					+ self.format2getTrie(n) + self.format2readTrie(n) \
+					+ self.format2putTrie(n) \
 					+ self.format2buildTrie(n) # just use Trie's code
 			self.size = self.key.size + self.sub.size + 1
 		else:
@@ -184,10 +286,29 @@ class Container:
 			# a Pair
 			self.type = "Pair<" + self.sub1.type + ", " + self.sub2.type + "> "
 			self.code = self.sub1.code + self.sub2.code \
-					+ self.format2getPair(n) + self.format2putPair(n) \
+					+ self.format2getPair(n) + self.format2readPair(n) \
+					+ self.format2putPair(n) \
 					+ self.format2buildPair(n)
 			self.size = self.sub1.size + self.sub2.size + 1
 
+	# generate code reading text [begin, end) of line into x by get_n of
+	# this container, over the text itself for a struct or struct sequence,
+	# or through an istringstream named stream otherwise, end None for the
+	# end of line, followed by cond, e.g. ") continue;"
+	def format2getText(self, n, indent, stream, line, begin, end, x, cond):
+		if self.type.startswith("Struct_") or self.type.startswith("Vector<Struct_"):
+			return indent + "if (get_" + str(n) + "(" \
+					+ line + ".data()" + (begin != "0" and " + " + begin or "") + ", " \
+					+ line + ".data() + " + (end or line + ".size()") + ", " + x + ")" + cond + "\n"
+
+		if begin == "0" and not end: text = line
+		elif not end: text = line + ".substr(" + begin + ")"
+		elif begin == "0": text = line + ".substr(0, " + end + ")"
+		else: text = line + ".substr(" + begin + ", " + end + " - " + begin + ")"
+
+		return indent + "istringstream " + stream + "(" + text + ");\n" \
+				+ indent + "if (get_" + str(n) + "(" + stream + ", " + x + ")" + cond + "\n"
+
 	# generate struct
 	def format2Struct(self, n):
 		matches = map(lambda x: x, re.finditer(
@@ -220,6 +341,8 @@ class Container:
 		return "" """\
 int build_""" + str(n) + """(istream &in, const string &separator = "")
 {
+	StatsBuild statsBuild(""" + str(n) + """);
+
 	string line;
 
 	typedef Container<""" + self.type + """>::std_value_type std_type;
@@ -229,6 +352,7 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 	{
 		string values((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
 
+		stats.phase("serialization");
 		Container<""" + self.type + """>::build(ostreambuf_iterator<char>(cout),
 				(std_type *)&*values.begin(), (std_type *)&*values.end());
 	}
@@ -243,11 +367,11 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		else
 			while (getline(in, line, separator))
 			{
-				istringstream isv(line);
-				if (get_""" + str(n) + """(isv, v) == 0)
+""" + self.format2getText(n, "\t\t\t\t", "isv", "line", "0", None, "v", " == 0)") + """\
 					values.push_back(v);
 			}
 
+		stats.phase("serialization");
 		Container<""" + self.type + """>::build(ostreambuf_iterator<char>(cout),
 				&*values.begin(), &*values.end());
 	}
@@ -296,6 +420,66 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 
 		return code
 
+	# generate code reading a field of a struct over text, by the parsers of
+	# text, which fails in C++ code of fail
+	def format2getField(self, type, name, indent, fail):
+		# read int8_t/uint8_t as int instead of char
+		if   type == "b":
+			return indent + "{  int32_t b; if (!ok || !getInteger(p, end, b)) " + fail + " " + name + " = b; }\n"
+		elif type == "B":
+			return indent + "{ uint32_t B; if (!ok || !getInteger(p, end, B)) " + fail + " " + name + " = B; }\n"
+		elif type == "c" or type == "C":
+			return indent + "if (!ok || !getChar(p, end, " + name + ")) " + fail + "\n"
+		elif type == "u":
+			return indent + "if (!ok || !getUtf16(p, end, " + name + ")) " + fail + "\n"
+		elif type == "f" or type == "d":
+			return indent + "if (!ok || !getFloat(p, end, " + name + ")) " + fail + "\n"
+		else:
+			return indent + "if (!ok || !getInteger(p, end, " + name + ")) " + fail + "\n"
+
+	# generate function for reading a struct from text [p, end), as get_N
+	# does from an istringstream of the text, without iostream
+	def format2getStructText(self, n):
+		matches = map(lambda x: x, re.finditer(
+				'(' + self.pttnType + ')(' + self.pttnWeakerSep + '*)', self.m.group("seq")))
+
+		code = "int get_" + str(n) + "(const char *p, const char *end, Container<" \
+				+ self.type + ">::std_value_type &x)\n{\n"
+
+		code += "\tbool ok = true;\n"
+		code += "\tmemset(&x, 0, sizeof(x));\n"
+
+		if self.m.group("pre"):
+			code += "\tskip(p, end, \"" + self.m.group("pre") + "\", ok);\n"
+
+		for v in range(len(matches)):
+			type = matches[v].group(1)
+			stop = matches[v].group(2)
+			name = len(matches) > 1 and "x.v" + str(v) or "x"
+
+			code += self.format2getField(type, name, "\t", "return -1;")
+			if stop:
+				code += "\tskip(p, end, \"" + stop + "\", ok);\n"
+
+		code += "\n\treturn 0;\n}\n\n"
+
+		return code
+
+	# generate function for reading a struct from binary input, in C layout
+	def format2readStruct(self, n):
+		return "" """\
+int read_""" + str(n) + """(const char *&p, const char *end,
+		Container<""" + self.type + """>::std_value_type &x, bool = true)
+{
+	if ((size_t)(end - p) < sizeof(x)) return -1;
+	memcpy(&x, p, sizeof(x));
+	p += sizeof(x);
+
+	return 0;
+}
+
+""" ""
+
 	# generate function for writing a struct
 	def format2putStruct(self, n):
 		matches = map(lambda x: x, re.finditer(
@@ -305,24 +489,23 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 				+ "(ostream &out, const " + self.type + " &x)\n{\n"
 
 		if self.m.group("pre"):
-			code += "\tout << \"" + self.m.group("pre") + "\";\n"
+			code += "\tputText(out, \"" + self.m.group("pre") + "\");\n"
 
 		for v in range(len(matches)):
 			type = matches[v].group(1)
 			stop = matches[v].group(2)
 			name = len(matches) > 1 and "x.v" + str(v) or "x"
 
-			# set proper floating point precision
-			if   type == "f": code += "\tout.precision(numeric_limits<float >::digits10+2);\n"
-			elif type == "d": code += "\tout.precision(numeric_limits<double>::digits10+2);\n"
-			# write int8_t/uint8_t as int instead of char
-			if   type == "b": code += "\tout << ( int32_t)" + name + ";\n"
-			elif type == "B": code += "\tout << (uint32_t)" + name + ";\n"
+			# write floats in the shortest text reading back the same
+			if   type in "fd":   code += "\tputFloat(out, " + name + ");\n"
+			# write integers, int8_t/uint8_t as int instead of char
+			elif type in "bslq": code += "\tputInteger(out, ( int64_t)" + name + ");\n"
+			elif type in "BSLQ": code += "\tputInteger(out, (uint64_t)" + name + ");\n"
 			# write UTF-16 as UTF-8 chars
-			elif type == "u": code += "\tputUtf16(out, " + name + ");\n"
-			# write other types using iostream
-			else:             code += "\tout << " + name + ";\n"
-			if stop:          code += "\tout << \"" + stop + "\";\n"
+			elif type == "u":    code += "\tputUtf16(out, " + name + ");\n"
+			# write chars using iostream
+			else:                code += "\tout << " + name + ";\n"
+			if stop:             code += "\tputText(out, \"" + stop + "\");\n"
 
 		code += "}\n\n"
 
@@ -333,19 +516,25 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		return "" """\
 int build_""" + str(n) + """(istream &in, const string &separator = "")
 {
+	StatsBuild statsBuild(""" + str(n) + """);
+
 	string line;
 
 	typedef Container<""" + self.type + """>::std_value_type std_type;
 
-	vector<uint32_t> entries(1);
+	typedef """ + (options.sizes == "64" and "uint64_t" or "uint32_t") + """ SizeT;
+
+	vector<SizeT> entries(1);
 
 	if (separator.empty() && """\
 			+ (self.m.group(0).lower() == "c*" and "true" or "false") + """)
 	{
 		string values((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
+		if ((SizeT)values.size() != values.size()) throw int(FT_OVERFLOW);
 		entries.push_back(values.size());
 
-		Container<uint32_t>::build(ostreambuf_iterator<char>(cout),
+		stats.phase("serialization");
+		Container<SizeT>::build(ostreambuf_iterator<char>(cout),
 				&*entries.begin(), &*entries.end());
 		Container<std_type::value_type>::build(
 				ostreambuf_iterator<char>(cout),
@@ -359,14 +548,14 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		if (separator.empty())
 		{
 			get_""" + str(n) + """(in, values);
+			if ((SizeT)values.size() != values.size()) throw int(FT_OVERFLOW);
 			entries.push_back(values.size());
 		}
 		else
 			while (getline(in, line, separator))
 			{
 """ + (self.m.group(0).lower() == "c*" and " " or """\
-				istringstream isv(line);
-				if (get_""" + str(n) + """(isv, v)) continue;
+""" + self.format2getText(n, "\t\t\t\t", "isv", "line", "0", None, "v", ") continue;") + """\
 """) + """\
 
 """ + (self.m.group(0).lower() == "c*" and """\
@@ -376,10 +565,12 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 """ or """\
 				values.insert(values.end(), v.begin(), v.end());
 """) + """\
+				if ((SizeT)values.size() != values.size()) throw int(FT_OVERFLOW);
 				entries.push_back(values.size());
 			}
 
-		Container<uint32_t>::build(ostreambuf_iterator<char>(cout),
+		stats.phase("serialization");
+		Container<SizeT>::build(ostreambuf_iterator<char>(cout),
 				&*entries.begin(), &*entries.end());
 		Container<std_type::value_type>::build(
 				ostreambuf_iterator<char>(cout), &*values.begin(), &*values.end());
@@ -434,6 +625,61 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 
 		return code
 
+	# generate function for reading a struct sequence from text [p, end), as
+	# get_N does from an istringstream of the text, without iostream
+	def format2getVectorStructText(self, n):
+		matches = map(lambda x: x, re.finditer(
+				'(' + self.pttnType + ')(' + self.pttnWeakerSep + '*)', self.m.group("seq")))
+
+		code = "int get_" + str(n) + "(const char *p, const char *end, Container<" \
+				+ self.type + ">::std_value_type &x)\n{\n"
+
+		code += "\tContainer<" + self.type + ">::std_value_type::value_type v;\n"
+		code += "\tmemset(&v, 0, sizeof(v));\n"
+		code += "\tx.resize(0);\n\n"
+		code += "\tbool ok = true;\n"
+		code += "\twhile (ok)\n\t{\n"
+
+		if self.m.group("pre"):
+			code += "\t\tskip(p, end, \"" + self.m.group("pre") + "\", ok);\n"
+
+		for v in range(len(matches)):
+			type = matches[v].group(1)
+			stop = matches[v].group(2)
+			name = len(matches) > 1 and "v.v" + str(v) or "v"
+
+			code += self.format2getField(type, name, "\t\t", "{ ok = false; continue; }")
+			if stop:
+				code += "\t\tskip(p, end, \"" + stop + "\", ok);\n"
+
+		code += "\n\t\tx.push_back(v);\n"
+		code += "\t}\n\n"
+		code += "\treturn 0;\n}\n\n"
+
+		return code
+
+	# generate function for reading a struct sequence from binary input, at
+	# once, the outermost one up to the end of input
+	def format2readVectorStruct(self, n):
+		return "" """\
+int read_""" + str(n) + """(const char *&p, const char *end,
+		Container<""" + self.type + """>::std_value_type &x, bool counted = true)
+{
+	typedef Container<""" + self.type + """>::std_value_type::value_type value_type;
+
+	size_t count = (end - p) / sizeof(value_type);
+	if (counted ? readCount(p, end, count) : (end - p) % sizeof(value_type)) return -1;
+	if ((size_t)(end - p) / sizeof(value_type) < count) return -1;
+
+	x.resize(count);
+	if (count) memcpy(&x[0], p, count * sizeof(value_type));
+	p += count * sizeof(value_type);
+
+	return 0;
+}
+
+""" ""
+
 	# generate function for writing a struct sequence
 	def format2putVectorStruct(self, n):
 		matches = map(lambda x: x, re.finditer(
@@ -445,24 +691,23 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		code += "\tfor (size_t i = 0; i != x.size(); i ++)\n\t{\n"
 
 		if self.m.group("pre"):
-			code += "\t\tout << \"" + self.m.group("pre") + "\";\n"
+			code += "\t\tputText(out, \"" + self.m.group("pre") + "\");\n"
 
 		for v in range(len(matches)):
 			type = matches[v].group(1)
 			stop = matches[v].group(2)
 			name = len(matches) > 1 and "x[i].v" + str(v) or "x[i]"
 
-			# set proper floating point precision
-			if   type == "f": code += "\t\tout.precision(numeric_limits<float >::digits10 + 2);\n"
-			elif type == "d": code += "\t\tout.precision(numeric_limits<double>::digits10 + 2);\n"
-			# write int8_t/uint8_t as int instead of char
-			if   type == "b": code += "\t\tout << ( int32_t)" + name + ";\n"
-			elif type == "B": code += "\t\tout << (uint32_t)" + name + ";\n"
+			# write floats in the shortest text reading back the same
+			if   type in "fd":   code += "\t\tputFloat(out, " + name + ");\n"
+			# write integers, int8_t/uint8_t as int instead of char
+			elif type in "bslq": code += "\t\tputInteger(out, ( int64_t)" + name + ");\n"
+			elif type in "BSLQ": code += "\t\tputInteger(out, (uint64_t)" + name + ");\n"
 			# write UTF-16 as UTF-8 chars
-			elif type == "u": code += "\t\tputUtf16(out, " + name + ");\n"
-			# write other types using iostream
-			else:             code += "\t\tout << " + name + ";\n"
-			if stop:          code += "\t\tout << \"" + stop + "\";\n"
+			elif type == "u":    code += "\t\tputUtf16(out, " + name + ");\n"
+			# write chars using iostream
+			else:                code += "\t\tout << " + name + ";\n"
+			if stop:             code += "\t\tputText(out, \"" + stop + "\");\n"
 
 		code += "\t}\n}\n\n"
 
@@ -473,6 +718,8 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		return "" """\
 int build_""" + str(n) + """(istream &in, const string &separator = "")
 {
+	StatsBuild statsBuild(""" + str(n) + """);
+
 	string line;
 
 	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
@@ -493,8 +740,7 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 		while (getline(in, line, sep))
 		{
 """ + (self.m.group("sub").lower() == "c*" and " " or """\
-			istringstream isv(line);
-			if (get_""" + str(n + 1) + """(isv, v)) continue;
+""" + self.sub.format2getText(n + 1, "\t\t\t", "isv", "line", "0", None, "v", ") continue;") + """\
 """) + """\
 
 			fake_values.back().push_back(fake_type::value_type());
@@ -515,6 +761,7 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 			tmp << line;
 		}
 
+	stats.phase("serialization");
 	Container<""" + self.fake + """>::build(ostreambuf_iterator<char>(cout),
 			fake_values.begin(), fake_values.end(), (void *)(-1));
 	fake_values.clear();
@@ -547,8 +794,7 @@ int get_""" + str(n) + """(
 	while (getline(in, line, sep))
 	{
 """ + (self.m.group("sub").lower() == "c*" and " " or """\
-		istringstream isv(line);
-		if (get_""" + str(n + 1) + """(isv, v)) continue;
+""" + self.sub.format2getText(n + 1, "\t\t", "isv", "line", "0", None, "v", ") continue;") + """\
 """) + """\
 
 """ + (self.m.group("sub").lower() == "c*" and """\
@@ -563,6 +809,28 @@ int get_""" + str(n) + """(
 	return 0;
 }
 
+""" ""
+
+	# generate function for reading a Vector from binary input
+	def format2readVector(self, n):
+		return "" """\
+int read_""" + str(n) + """(const char *&p, const char *end,
+		Container<""" + self.type + """>::std_value_type &x, bool counted = true)
+{
+	Container<""" + self.sub.type + """>::std_value_type v;
+	size_t count = 0;
+	if (counted && readCount(p, end, count)) return -1;
+	x.resize(0);
+
+	for (size_t i = 0; counted ? i != count : p != end; i ++)
+	{
+		if (read_""" + str(n + 1) + """(p, end, v)) return -1;
+		x.push_back(v);
+	}
+
+	return 0;
+}
+
 """ ""
 
 	# generate function for writing a Vector
@@ -588,9 +856,11 @@ void put_""" + str(n) + """(ostream &out, const ContainerT &x)
 
 	# generate function for building a Trie<bool> container
 	def format2buildTrieSet(self, n):
-		return "" """\
+		return (n == 0 and self.type[0] == 'T' and self.format2parallelTrie(n) or "") + "" """\
 int build_""" + str(n) + """(istream &in, const string &separator = "")
 {
+	StatsBuild statsBuild(""" + str(n) + """);
+
 	string line;
 
 	typedef Container<""" + self.type + """>::std_value_type std_type;
@@ -598,6 +868,38 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 	vector<std_type> values;
 	std_type v;
 
+""" + (n == 0 and self.type[0] == 'T' and """\
+	if (separator.empty() && (jobs > 1 || memoryLimit))
+	{
+		vector<string> names = memoryLimit ? external_""" + str(n) + """(in)
+				: parallel_""" + str(n) + """(in, shard_""" + str(n) + """);
+
+		vector<Container<""" + self.type + """> > shards;
+		for (size_t i = 0; i != names.size(); i ++)
+			shards.push_back(Container<""" + self.type + """>((names[i] + "-trie").c_str()));
+
+		Container<""" + self.type + """>::stitch(ostreambuf_iterator<char>(cout),
+				&*shards.begin(), &*shards.end());
+		shards.clear();
+
+		for (size_t i = 0; i != names.size(); i ++)
+			unlink((names[i] + "-trie").c_str());
+
+		return 0;
+	}
+
+	if (separator.empty() && sorted)
+	{
+		Container<""" + self.type + """>::sorted_value_type sorted_values;
+		get_""" + str(n) + """(in, sorted_values);
+
+		Container<""" + self.type + """>::build(ostreambuf_iterator<char>(cout),
+				&sorted_values, &sorted_values + 1);
+
+		return 0;
+	}
+
+""" or "") + """\
 	if (separator.empty())
 	{
 		values.push_back(std_type());
@@ -623,8 +925,8 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 	# generate function for reading a Trie<bool>
 	def format2getTrieSet(self, n):
 		return "" """\
-int get_""" + str(n) + """(
-		istream &in, Container<""" + self.type + """>::std_value_type &x)
+template <class MapT> // std_value_type, or sorted_value_type for a Trie
+int get_""" + str(n) + """(istream &in, MapT &x)
 {
 	string line;
 
@@ -640,8 +942,7 @@ int get_""" + str(n) + """(
 	while (getline(in, line, keysep))
 	{
 """ + (self.m.group("key").lower() == "c*" and " " or """\
-		istringstream isk(line);
-		if (get_""" + str(n + 1) + """(isk, k)) continue;
+""" + self.key.format2getText(n + 1, "\t\t", "isk", "line", "0", None, "k", ") continue;") + """\
 """) + """\
 
 """ + (self.type[0] == 'T' and """\
@@ -666,9 +967,45 @@ int get_""" + str(n) + """(
 
 """ ""
 
+	# generate function for reading a Trie<bool> from binary input
+	def format2readTrieSet(self, n):
+		return "" """\
+template <class MapT> // std_value_type, or sorted_value_type for a Trie
+int read_""" + str(n) + """(const char *&p, const char *end, MapT &x, bool counted = true)
+{
+""" + (self.type[0] == 'T' and """\
+	typedef Container<""" + self.type + """>::std_value_type
+			::value_type::first_type::value_type char_type;
+""" or "") + """\
+	Container<""" + self.key.type + """>::std_value_type k;
+	size_t count = 0;
+	if (counted && readCount(p, end, count)) return -1;
+	x.clear();
+
+	for (size_t i = 0; counted ? i != count : p != end; i ++)
+	{
+		if (read_""" + str(n + 1) + """(p, end, k)) return -1;
+""" + self.format2readKey("true") + """\
+	}
+
+	return 0;
+}
+
+""" ""
+
+	# generate code storing value by key k into x, as get_N does
+	def format2readKey(self, value):
+		if self.type[0] != 'T':
+			return "\t\tx[k] = " + value + ";\n"
+		if self.key.type[0] == 'V':
+			return "\t\tx[vector<char_type>((char_type *)&k[0], (char_type *)&k[k.size()])] = " \
+					+ value + ";\n"
+		return "\t\tx[vector<char_type>((char_type *)(&k), (char_type *)(&k + 1))] = " \
+				+ value + ";\n"
+
 	# generate function for writing a Trie<bool>
 	def format2putTrieSet(self, n):
-		return "" """\
+		return (self.type[0] == 'T' and self.format2walkTrie(n) or "" """\
 template <class ContainerT>
 void put_""" + str(n) + """(ostream &out, const ContainerT &x)
 {
@@ -676,26 +1013,18 @@ void put_""" + str(n) + """(ostream &out, const ContainerT &x)
 
 	for (size_t i = 0; i != x.size(); i ++)
 	{
-""" + (self.type[0] == 'T' and """\
-""" + (self.m.group("key").lower() == "c*" and """\
-		out << x.template key<string>(x.begin() + i);
-""" or """\
-		put_""" + str(n + 1) + """(out, x.template key<Container<
-				""" + self.key.type + """>::std_value_type>(x.begin() + i));
-""") + """\
-""" or """\
 """ + (self.m.group("key").lower() == "c*" and """\
 		out << string(
 				(char *)(x.begin() + i)->first.begin(),
 				(char *)(x.begin() + i)->first.end());
 """ or """\
 		put_""" + str(n + 1) + """(out, (x.begin() + i)->first);
-""") + """\
 """) + """\
 		out << keysep;
 	}
 }
 
+""" "") + "" """\
 template <class _Key, class _Tp, class _Compare, class _Alloc>
 void put_""" + str(n) + """(
 		ostream &out, const map<_Key, _Tp, _Compare, _Alloc> &x)
@@ -728,13 +1057,73 @@ void put_""" + str(n) + """(
 	}
 }
 
+""" ""
+
+	# generate function for writing a Trie (or Trie<bool>) by walking it
+	def format2walkTrie(self, n):
+		return "" """\
+struct Putter_""" + str(n) + """
+{
+	ostream &out;
+
+	Putter_""" + str(n) + """(ostream &out) : out(out) {}
+
+	template <class CharT, class IteratorT>
+	void operator ()(const CharT *keyBegin, const CharT *keyEnd, IteratorT it) const
+	{
+		putKey(out, keyBegin, keyEnd);
+		putText(out, """ + '\"' + self.m.group("keysep") + '\"' + """);
+""" + ("sub" in self.m.groupdict() and """\
+		putValue(out, it);
+		putText(out, """ + '\"' + self.m.group("sep"   ) + '\"' + """);
+""" or "") + """\
+	}
+
+	template <class CharT>
+	static void putKey(ostream &out, const CharT *keyBegin, const CharT *keyEnd)
+	{
+		typedef Container<""" + self.key.type + """>::std_value_type key_type;
+
+""" + (self.m.group("key").lower() == "c*" and """\
+		out.rdbuf()->sputn((char *)keyBegin, (char *)keyEnd - (char *)keyBegin);
+""" or (self.key.type[0] == 'V' and """\
+		put_""" + str(n + 1) + """(out, key_type(
+				(key_type::value_type *)keyBegin, (key_type::value_type *)keyEnd));
+""" or """\
+		put_""" + str(n + 1) + """(out, (char *)keyEnd - (char *)keyBegin == sizeof(key_type)
+				? *(key_type *)keyBegin : key_type());
+""")) + """\
+	}
+""" + ("sub" in self.m.groupdict() and """\
+
+	template <class IteratorT>
+	static void putValue(ostream &out, IteratorT it)
+	{
+""" + (self.m.group("sub").lower() == "c*" and """\
+		out << string((char *)it->begin(), (char *)it->end());
+""" or """\
+		put_""" + str(n + 2) + """(out, *it);
+""") + """\
+	}
+""" or "") + """\
+};
+
+template <class ContainerT>
+void put_""" + str(n) + """(ostream &out, const ContainerT &x)
+{
+	x.walk(Putter_""" + str(n) + """(out));
+}
+
 """ ""
 
 	# generate function for building a Trie container
 	def format2buildTrie(self, n):
-		return "" """\
+		return (n == 0 and self.type[0] == 'T' and
+				self.format2recordTrie(n) + self.format2parallelTrie(n) or "") + "" """\
 int build_""" + str(n) + """(istream &in, const string &separator = "")
 {
+	StatsBuild statsBuild(""" + str(n) + """);
+
 	string line;
 
 	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
@@ -756,6 +1145,8 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 	fstream tmg((tmpdir + """ + '\"/' + str(n) + '-g\"' + """).c_str(),
 			ios::in | ios::out | ios::trunc);
 
+""" + (n == 0 and self.type[0] == 'T' and
+		self.format2buildParallelTrie(n) + self.format2buildSortedTrie(n) or "") + """\
 	if (separator.empty())
 	{
 		fake_values.push_back(fake_type());
@@ -765,13 +1156,11 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 			if (t == string::npos) continue;
 
 """ + (self.m.group("key").lower() == "c*" and " " or """\
-			istringstream isk(line.substr(0, t));
-			if (get_""" + str(n + 1) + """(isk, k)) continue;
+""" + self.key.format2getText(n + 1, "\t\t\t", "isk", "line", "0", "t", "k", ") continue;") + """\
 """) + """\
 
 """ + (self.m.group("sub").lower() == "c*" and " " or """\
-			istringstream isv(line.substr(t + keysep.size()));
-			if (get_""" + str(n + 2) + """(isv, v)) continue;
+""" + self.sub.format2getText(n + 2, "\t\t\t", "isv", "line", "t + keysep.size()", None, "v", ") continue;") + """\
 """) + """\
 
 """ + (self.type[0] == 'T' and """\
@@ -815,8 +1204,7 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 				if (t == string::npos || t > s_next - sep.size()) continue;
 
 """ + (self.m.group("key").lower() == "c*" and " " or """\
-				istringstream isk(line.substr(s, t - s));
-				if (get_""" + str(n + 1) + """(isk, k)) continue;
+""" + self.key.format2getText(n + 1, "\t\t\t\t", "isk", "line", "s", "t", "k", ") continue;") + """\
 """) + """\
 
 """ + (self.type[0] == 'T' and """\
@@ -843,6 +1231,9 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 			}
 		}
 
+	// values are relayed in the order of keys in the container
+	stats.phase("map");
+
 """ + (self.type[0] == 'T' and """\
 	for (size_t i = 0; i != fake_values.size(); i ++)
 		for (fake_type::const_iterator
@@ -890,417 +1281,3062 @@ int build_""" + str(n) + """(istream &in, const string &separator = "")
 
 """ ""
 
-	# generate function for reading a Trie
-	def format2getTrie(self, n):
+	# generate function for parsing a record of a top level Trie into its key,
+	# and writing its value to a stream
+	def format2recordTrie(self, n):
 		return "" """\
-int get_""" + str(n) + """(
-		istream &in, Container<""" + self.type + """>::std_value_type &x)
+int record_""" + str(n) + """(const string &line,
+		Container<""" + self.type + """>::std_value_type::key_type &key, ostream &values)
 {
-	string line;
-
 	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
 	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
 
-""" + ((self.type[0] == 'T' or self.m.group("key").lower() == "c*") and """\
-	typedef Container<""" + self.type + """>::std_value_type
-			::value_type::first_type::value_type char_type;
-""" or " ") + """\
-	typedef Container<""" + self.sub.type + """>::std_value_type value_type;
+	typedef Container<""" + self.type + """>::std_value_type::key_type::value_type char_type;
+
 	Container<""" + self.key.type + """>::std_value_type k;
 	Container<""" + self.sub.type + """>::std_value_type v;
-	x.clear();
-
-	while (getline(in, line, sep))
-	{
-		size_t t = line.find(keysep);
-		if (t == string::npos) continue;
 
-""" + (self.m.group("key").lower() == "c*" and " " or """\
-		istringstream isk(line.substr(0, t));
-		if (get_""" + str(n + 1) + """(isk, k)) continue;
-""") + """\
+	size_t t = line.find(keysep);
+	if (t == string::npos) return -1;
 
-""" + (self.m.group("sub").lower() == "c*" and " " or """\
-		istringstream isv(line.substr(t + keysep.size()));
-		if (get_""" + str(n + 2) + """(isv, v)) continue;
-""") + """\
+""" + (self.m.group("key").lower() != "c*" and """\
+""" + self.key.format2getText(n + 1, "\t", "isk", "line", "0", "t", "k", ") return -1;") + """\
+""" or "") + (self.m.group("sub").lower() != "c*" and """\
+""" + self.sub.format2getText(n + 2, "\t", "isv", "line", "t + keysep.size()", None, "v", ") return -1;") + """\
+""" or "") + """\
 
-""" + (self.type[0] == 'T' and """\
 """ + (self.m.group("key").lower() == "c*" and """\
-		x[vector<char_type>((char_type *)&line[0], (char_type *)&line[t])] =
+	key.assign((char_type *)&line[0], (char_type *)&line[t]);
 """ or (self.key.type[0] == 'V' and """\
-		x[vector<char_type>((char_type *)&k[0], (char_type *)&k[k.size()])] =
+	key.assign((char_type *)&k[0], (char_type *)&k[k.size()]);
 """ or """\
-		x[vector<char_type>((char_type *)(&k), (char_type *)(&k + 1))] =
-""")) + """\
-""" or """\
-""" + (self.m.group("key").lower() == "c*" and """\
-		x[vector<char_type>((char_type *)&line[0], (char_type *)&line[t])] =
-""" or """\
-		x[k] =
-""") + """\
-""") + """\
-
-""" + (self.m.group("sub").lower() == "c*" and """\
-				value_type(
-					(value_type::value_type *)&line[t + keysep.size()],
-					(value_type::value_type *)&line[line.size()]);
+	key.assign((char_type *)(&k), (char_type *)(&k + 1));
+""")) + (self.m.group("sub").lower() == "c*" and """\
+	values << line.substr(t + keysep.size()) << sep;
 """ or """\
-				v;
+	put_""" + str(n + 2) + """(values, v); values << sep;
 """) + """\
-	}
 
 	return 0;
 }
 
 """ ""
 
-	# generate function for writing a Trie
-	def format2putTrie(self, n):
+	# generate functions for building a top level Trie in parallel: records
+	# are split into shards of consecutive key ranges by the first character,
+	# each built by shard_N in a worker process into a file of name-trie, or
+	# with a memory limit, sorted on disk and merged into shards by external_N
+	def format2parallelTrie(self, n):
+		sep = self.m.group("sub" in self.m.groupdict() and "sep" or "keysep")
+
 		return "" """\
-template <class ContainerT>
-void put_""" + str(n) + """(ostream &out, const ContainerT &x)
+int32_t first_""" + str(n) + """(const string &record)
 {
 	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
-	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
 
-	for (size_t i = 0; i != x.size(); i ++)
-	{
-""" + (self.type[0] == 'T' and """\
-""" + (self.m.group("key").lower() == "c*" and """\
-		out << x.template key<string>(x.begin() + i);
-""" or """\
-		put_""" + str(n + 1) + """(out, x.template key<Container<
-				""" + self.key.type + """>::std_value_type>(x.begin() + i));
-""") + """\
-""" or """\
+	typedef Container<""" + self.type + """>::std_value_type::key_type::value_type char_type;
+
+	string key = record.substr(0, record.find(keysep));
+
 """ + (self.m.group("key").lower() == "c*" and """\
-		out << string(
-				(char *)(x.begin() + i)->first.begin(),
-				(char *)(x.begin() + i)->first.end());
+	if (key.size() < sizeof(char_type)) return -1;
+	return *(char_type *)&key[0];
 """ or """\
-		put_""" + str(n + 1) + """(out, (x.begin() + i)->first);
-""") + """\
-""") + """\
-		out << keysep;
+	Container<""" + self.key.type + """>::std_value_type k;
 
-""" + (self.type[0] == 'T' and """\
-""" + (self.m.group("sub").lower() == "c*" and """\
-		out << string(
-				(char *)(x.begin() + i)->begin(), (char *)(x.begin() + i)->end());
-""" or """\
-		put_""" + str(n + 2) + """(out, *(x.begin() + i));
-""") + """\
-""" or """\
-""" + (self.m.group("sub").lower() == "c*" and """\
-		out << string(
-				(char *)(x.begin() + i)->second.begin(),
-				(char *)(x.begin() + i)->second.end());
+""" + self.key.format2getText(n + 1, "\t", "isk", "key", "0", None, "k", ") return -1;") + """\
+
+""" + (self.key.type[0] == 'V' and """\
+	if (k.size() * sizeof(k[0]) < sizeof(char_type)) return -1;
+	return *(char_type *)&k[0];
 """ or """\
-		put_""" + str(n + 2) + """(out, (x.begin() + i)->second);
-""") + """\
-""") + """\
-		out << sep;
-	}
+	return *(char_type *)&k;
+""")) + """\
 }
 
-template <class _Key, class _Tp, class _Compare, class _Alloc>
-void put_""" + str(n) + """(
-		ostream &out, const map<_Key, _Tp, _Compare, _Alloc> &x)
+vector<string> parallel_""" + str(n) + """(istream &in,
+		int (*worker)(istream &in, const string &name))
 {
-	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
-	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+	string line;
 
-	typedef Container<""" + self.key.type + """>::std_value_type key_type;
+	static const string sep    = """ + '\"' + sep + '\"' + """;
 
-	for (typename map<_Key, _Tp, _Compare, _Alloc>::const_iterator
-			it = x.begin(); it != x.end(); ++ it)
+	typedef Container<""" + self.type + """>::std_value_type::key_type::value_type char_type;
+
+	string name = tmpdir + """ + '\"/' + str(n) + '-all\"' + """;
+	fstream all(name.c_str(), ios::in | ios::out | ios::trunc);
+
+	vector<size_t> counts((1 << sizeof(char_type) * 8) + 1);
+	size_t numRecords = 0;
+
+	while (getline(in, line, sep))
 	{
-""" + (self.type[0] == 'T' and """\
-""" + (self.m.group("key").lower() == "c*" and """\
-		out << string((char *)&*it->first.begin(), (char *)&*it->first.end());
-""" or (self.key.type[0] == 'V' and """\
-		put_""" + str(n + 1) + """(out, key_type(
-				(key_type::value_type *)&*it->first.begin(),
-				(key_type::value_type *)&*it->first.end()));
-""" or """\
-		put_""" + str(n + 1) + """(out, *(key_type *)&*it->first.begin());
-""")) + """\
-""" or """\
-""" + (self.m.group("key").lower() == "c*" and """\
-		out << string((char *)&*it->first.begin(), (char *)&*it->first.end());
-""" or """\
-		put_""" + str(n + 1) + """(out, it->first);
-""") + """\
-""") + """\
-		out << keysep;
+		counts[first_""" + str(n) + """(line) + 1] ++;
+		numRecords ++;
+		all << line << sep;
+	}
 
-""" + (self.m.group("sub").lower() == "c*" and """\
-		out << string((char *)&*it->second.begin(), (char *)&*it->second.end());
-""" or """\
-		put_""" + str(n + 2) + """(out, it->second);
-""") + """\
-		out << sep;
+	// characters go to shards in order, about numRecords / jobs records each
+	vector<int> shards(counts.size());
+	for (size_t c = 0, sum = 0; c != counts.size(); sum += counts[c ++])
+		shards[c] = min(sum * jobs / max(numRecords, (size_t)1), (size_t)jobs - 1);
+
+	vector<string> names;
+	vector<fstream *> files;
+
+	for (int i = 0; i != jobs; i ++)
+	{
+		ostringstream os;
+		os << tmpdir << "/""" + str(n) + """-shard-" << i;
+		names.push_back(os.str());
+		files.push_back(new fstream(names[i].c_str(), ios::out | ios::trunc));
 	}
-}
 
-""" ""
+	all.seekg(0, ios::beg);
+	while (getline(all, line, sep))
+		*files[shards[first_""" + str(n) + """(line) + 1]] << line << sep;
 
-	# generate function for building a Pair container
-	def format2buildPair(self, n):
-		return "" """\
-int build_""" + str(n) + """(istream &in, const string &separator = "")
+	for (int i = 0; i != jobs; i ++)
+		delete files[i];
+
+	all.close();
+	unlink(name.c_str());
+
+	cout.flush();
+
+	vector<pid_t> pids;
+
+	for (int i = 0; i != jobs; i ++)
+	{
+		pid_t pid = fork();
+		if (pid == 0)
+		{
+			ifstream shard(names[i].c_str());
+			_exit(worker(shard, names[i]));
+		}
+		pids.push_back(pid);
+	}
+
+	int failed = 0;
+
+	for (int i = 0; i != jobs; i ++)
+	{
+		int status;
+		if (pids[i] < 0 || waitpid(pids[i], &status, 0) < 0 || !WIFEXITED(status))
+			failed = max(failed, 1);
+		else if (WEXITSTATUS(status))
+			failed = WEXITSTATUS(status) == 3 ? 3 : max(failed, 1);
+
+		unlink(names[i].c_str());
+	}
+
+	if (failed)
+	{
+		cerr << "failed to build shards in parallel" << endl;
+		exit(failed);
+	}
+
+	return names;
+}
+
+""" + ("sub" in self.m.groupdict() and """\
+template <class MapT> // std_value_type, or sorted_value_type of the fake type
+int shardMap_""" + str(n) + """(istream &in, const string &name, MapT &fake_values)
 {
 	string line;
 
-	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
-
-	typedef Container<""" + self.type + """>::std_value_type std_type;
+	static const string sep    = """ + '\"' + sep + '\"' + """;
 
-	fstream tmp1((tmpdir + """ + '\"/' + str(n) + '-1\"' + """).c_str(),
-			ios::in | ios::out | ios::trunc);
-	fstream tmp2((tmpdir + """ + '\"/' + str(n) + '-2\"' + """).c_str(),
-			ios::in | ios::out | ios::trunc);
+	Container<""" + self.fake + """>::std_value_type::key_type key;
 
-	const string sep1 = separator.empty() ? "" : sep;
-	const string sep2 = separator.empty() ? "" : separator;
+	// in sorted case, values are already in key order
+	fstream tmp((name + "-p").c_str(), ios::in | ios::out | ios::trunc);
+	fstream tmg((name + "-values").c_str(), ios::in | ios::out | ios::trunc);
+	fstream &spool = sorted ? tmg : tmp;
 
-	if (separator.empty())
+	while (getline(in, line, sep))
 	{
-		string line((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
+		fstream::pos_type position = spool.tellp();
+		if (record_""" + str(n) + """(line, key, spool) == 0)
+			fake_values[key] = position;
+	}
 
-		size_t t = line.find(sep);
-		if (t == string::npos) return -1;
+	if (!sorted)
+		for (typename MapT::const_iterator
+				it = fake_values.begin(); it != fake_values.end(); ++ it)
+		{
+			tmp.seekg(it->second, ios::beg);
+			getline(tmp, line, sep);
+			tmg << line << sep;
+		}
 
-		tmp1 << line.substr(0, t);
-		tmp2 << line.substr(t + sep.size());
+	tmp.close();
+	tmg.close();
+	unlink((name + "-p").c_str());
+
+	// the values are put into -values, and left empty in -trie
+	ofstream out((name + "-trie").c_str());
+
+	Container<""" + self.fake + """>::build(ostreambuf_iterator<char>(out),
+			&fake_values, &fake_values + 1, (void *)(-1));
+	Container<fstream::pos_type>::build(ostreambuf_iterator<char>(out),
+			(fstream::pos_type *)0, (fstream::pos_type *)0);
+
+	out.close();
+
+	return out.fail() || tmg.fail();
+}
+
+int shard_""" + str(n) + """(istream &in, const string &name)
+{
+	try
+	{
+		if (sorted)
+		{
+			Container<""" + self.fake + """>::sorted_value_type fake_values;
+			return shardMap_""" + str(n) + """(in, name, fake_values);
+		}
+		else
+		{
+			Container<""" + self.fake + """>::std_value_type fake_values;
+			return shardMap_""" + str(n) + """(in, name, fake_values);
+		}
 	}
-	else
-		while (getline(in, line, separator))
+	catch (int error)
+	{
+		return buildFailed(error);
+	}
+}
+""" or """\
+int shard_""" + str(n) + """(istream &in, const string &name)
+{
+	ofstream out((name + "-trie").c_str());
+
+	try
+	{
+		if (sorted)
 		{
-			size_t t = line.find(sep);
-			if (t == string::npos) return -1;
+			Container<""" + self.type + """>::sorted_value_type values;
+			get_""" + str(n) + """(in, values);
 
-			tmp1 << line.substr(0, t);           tmp1 << sep1;
-			tmp2 << line.substr(t + sep.size()); tmp2 << sep2;
+			Container<""" + self.type + """>::build(ostreambuf_iterator<char>(out),
+					&values, &values + 1);
 		}
+		else
+		{
+			Container<""" + self.type + """>::std_value_type values;
+			get_""" + str(n) + """(in, values);
 
-	tmp1.seekg(0, ios::beg);
-	tmp2.seekg(0, ios::beg);
-	build_""" + str(n + 1)                  + """(tmp1, sep1);
-	build_""" + str(n + 1 + self.sub1.size) + """(tmp2, sep2);
+			Container<""" + self.type + """>::build(ostreambuf_iterator<char>(out),
+					&values, &values + 1);
+		}
+	}
+	catch (int error)
+	{
+		return buildFailed(error);
+	}
 
-	tmp1.close();
-	tmp2.close();
-	unlink((tmpdir + """ + '\"/' + str(n) + '-1\"' + """).c_str());
-	unlink((tmpdir + """ + '\"/' + str(n) + '-2\"' + """).c_str());
+	out.close();
 
-	return 0;
+	return out.fail();
 }
+""") + """\
 
-""" ""
-
-	# generate function for reading a Pair
-	def format2getPair(self, n):
-		return "" """\
-int get_""" + str(n) + """(
-		istream &in, Container<""" + self.type + """>::std_value_type &x)
+int key_""" + str(n) + """(const string &record, vector<
+		Container<""" + self.type + """>::std_value_type::key_type::value_type> &key)
 {
-	string line((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
-
-	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
 
-	typedef Container<""" + self.sub1.type + """>::std_value_type first_type;
-	typedef Container<""" + self.sub2.type + """>::std_value_type second_type;
+	typedef Container<""" + self.type + """>::std_value_type::key_type::value_type char_type;
 
-	size_t t = line.find(sep);
+	size_t t = record.find(keysep);
+""" + ("sub" in self.m.groupdict() and """\
 	if (t == string::npos) return -1;
+""" or "") + """\
+	string text = record.substr(0, t);
 
-""" + (self.m.group("sub1").lower() == "c*" and """\
-	x.first = first_type(
-			(first_type::value_type *)&line[0],
-			(first_type::value_type *)&line[t]);
+""" + (self.m.group("key").lower() == "c*" and """\
+	key.assign((char_type *)text.data(), (char_type *)text.data() + text.size() / sizeof(char_type));
 """ or """\
-	istringstream isv1(line.substr(0, t));
-	if (get_""" + str(n + 1) + """(isv1, x.first)) return -1;
-""") + """\
+	Container<""" + self.key.type + """>::std_value_type k;
 
-""" + (self.m.group("sub2").lower() == "c*" and """\
-	x.second = second_type(
-			(second_type::value_type *)&line[t + sep.size()],
-			(second_type::value_type *)&line[line.size()]);
+""" + self.key.format2getText(n + 1, "\t", "isk", "text", "0", None, "k", ") return -1;") + """\
+
+""" + (self.key.type[0] == 'V' and """\
+	key.assign((char_type *)&k[0], (char_type *)&k[k.size()]);
 """ or """\
-	istringstream isv2(line.substr(t + sep.size()));
-	if (get_""" + str(n + 1 + self.sub1.size) + """(isv2, x.second)) return -1;
-""") + """\
+	key.assign((char_type *)(&k), (char_type *)(&k + 1));
+""")) + """\
 
 	return 0;
 }
 
-""" ""
+// sort records into runs of about memoryLimit bytes, merge them into shards
+// and build each by shard_""" + str(n) + """ in turn, as parallel_""" + str(n) + """ does at once
 
-	# generate function for writing a Pair
-	def format2putPair(self, n):
-		return "" """\
-template <class ContainerT>
-void put_""" + str(n) + """(ostream &out, const ContainerT &x)
+vector<string> external_""" + str(n) + """(istream &in)
 {
-	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+	string line;
 
-""" + (self.m.group("sub1").lower() == "c*" and """\
-	out << string((char *)&*x.first.begin(), (char *)&*x.first.end());
-""" or """\
-	put_""" + str(n + 1) + """(out, x.first);
-""") + """\
-	out << sep;
+	static const string sep    = """ + '\"' + sep + '\"' + """;
 
-""" + (self.m.group("sub2").lower() == "c*" and """\
-	out << string((char *)&*x.second.begin(), (char *)&*x.second.end());
-""" or """\
-	put_""" + str(n + 1 + self.sub1.size) + """(out, x.second);
-""") + """\
+	typedef Container<""" + self.type + """>::std_value_type::key_type::value_type char_type;
+
+	string prefix = tmpdir + """ + '\"/' + str(n) + '\"' + """;
+	vector<RunRecord<char_type> > records;
+	vector<string> runs;
+	size_t bytes = 0;
+
+	stats.phase("runs");
+
+	while (getline(in, line, sep))
+	{
+		records.push_back(RunRecord<char_type>());
+		if (key_""" + str(n) + """(line, records.back().key))
+		{
+			records.pop_back();
+			continue;
+		}
+		records.back().record.swap(line);
+
+		// records count with the spare capacity of their vector and the
+		// buffer of stable_sort, and their text and key with a header of
+		// malloc each
+		bytes += records.back().record.capacity() + 2 * sizeof(size_t)
+				+ records.back().key.capacity() * sizeof(char_type) + 2 * sizeof(size_t);
+		if (bytes + 2 * records.capacity() * sizeof(RunRecord<char_type>) >= memoryLimit)
+		{
+			runs.push_back(sortRun(records, prefix));
+			vector<RunRecord<char_type> >().swap(records);
+			bytes = 0;
+		}
+	}
+
+	if (!records.empty()) runs.push_back(sortRun(records, prefix));
+	vector<RunRecord<char_type> >().swap(records);
+
+	// merged records are sorted and uniqued, and a shard takes up to about
+	// eight times the size of its records to be built
+	stats.phase("merge");
+	sorted = true;
+
+	ShardWriter<char_type> shards(prefix, sep, memoryLimit / 8, shard_""" + str(n) + """);
+	mergeRuns<char_type>(runs, prefix, shards);
+
+	return shards.finish();
 }
 
 """ ""
 
-container = Container(0, options.format)
+	# generate code for building a top level Trie in parallel, values of all
+	# shards are concatenated in key order and built at once
+	def format2buildParallelTrie(self, n):
+		return "" """\
+	if (separator.empty() && (jobs > 1 || memoryLimit))
+	{
+		vector<string> names = memoryLimit ? external_""" + str(n) + """(in)
+				: parallel_""" + str(n) + """(in, shard_""" + str(n) + """);
 
-# generate C++ source code
+		vector<Container<""" + self.fake + """> > shards;
+		for (size_t i = 0; i != names.size(); i ++)
+			shards.push_back(Container<""" + self.fake + """>((names[i] + "-trie").c_str()));
 
-cpp = "" """\
-// generated by fasttrie.py -f '""" + options.format + """'
+		Container<""" + self.fake + """>::stitch(ostreambuf_iterator<char>(cout),
+				&*shards.begin(), &*shards.end(), (void *)(-1));
+		shards.clear();
 
-#include <iostream>
-#include <fstream>
-#include <sstream>
-#include <limits>
+		stats.phase("map");
+		for (size_t i = 0; i != names.size(); i ++)
+		{
+			ifstream values((names[i] + "-values").c_str());
+			if (values.peek() != EOF) tmg << values.rdbuf();
 
-#include "FastTrie.h"
+			unlink((names[i] + "-trie"  ).c_str());
+			unlink((names[i] + "-values").c_str());
+		}
 
-""" + "\n".join(map(lambda x: '#include \"' + x + '\"', options.extend)) + """\
+		tmg.seekg(0, ios::beg);
+		build_""" + str(n + 2) + """(tmg, sep);
 
-using namespace std;
-using namespace ft2;
+		tmp.close();
+		tmg.close();
+		unlink((tmpdir + """ + '\"/' + str(n) + '-p\"' + """).c_str());
+		unlink((tmpdir + """ + '\"/' + str(n) + '-g\"' + """).c_str());
 
-// common utility functions
+		return 0;
+	}
 
-const vector<string> split(const string &delimiter, const string &source)
+""" ""
+
+	# generate code for building a top level Trie from sorted input, which
+	# writes values in key order and needs no reordering
+	def format2buildSortedTrie(self, n):
+		return "" """\
+	if (separator.empty() && sorted)
+	{
+		Container<""" + self.fake + """>::sorted_value_type sorted_values;
+		Container<""" + self.fake + """>::std_value_type::key_type key;
+
+		while (getline(in, line, sep))
+		{
+			fstream::pos_type position = tmp.tellp();
+			if (record_""" + str(n) + """(line, key, tmp) == 0)
+				sorted_values[key] = position;
+		}
+
+		Container<""" + self.fake + """>::build(ostreambuf_iterator<char>(cout),
+				&sorted_values, &sorted_values + 1, (void *)(-1));
+		sorted_values.clear();
+
+		tmp.seekg(0, ios::beg);
+		build_""" + str(n + 2) + """(tmp, sep);
+
+		tmp.close();
+		tmg.close();
+		unlink((tmpdir + """ + '\"/' + str(n) + '-p\"' + """).c_str());
+		unlink((tmpdir + """ + '\"/' + str(n) + '-g\"' + """).c_str());
+
+		return 0;
+	}
+
+""" ""
+
+	# generate function for reading a Trie
+	def format2getTrie(self, n):
+		return "" """\
+template <class MapT> // std_value_type, or sorted_value_type for a Trie
+int get_""" + str(n) + """(istream &in, MapT &x)
 {
-	if (delimiter.empty()) return vector<string>(1, source);
+	string line;
 
-	vector<string> result;
+	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
 
-	size_t prev_pos = 0;
-	size_t pos = source.find(delimiter, 0);
-	while (pos != string::npos)
+""" + ((self.type[0] == 'T' or self.m.group("key").lower() == "c*") and """\
+	typedef Container<""" + self.type + """>::std_value_type
+			::value_type::first_type::value_type char_type;
+""" or " ") + """\
+	typedef Container<""" + self.sub.type + """>::std_value_type value_type;
+	Container<""" + self.key.type + """>::std_value_type k;
+	Container<""" + self.sub.type + """>::std_value_type v;
+	x.clear();
+
+	while (getline(in, line, sep))
 	{
-		result.push_back(source.substr(prev_pos, pos - prev_pos));
-		pos += delimiter.size();
-		prev_pos = pos;
-		pos = source.find(delimiter, pos);
+		size_t t = line.find(keysep);
+		if (t == string::npos) continue;
+
+""" + (self.m.group("key").lower() == "c*" and " " or """\
+""" + self.key.format2getText(n + 1, "\t\t", "isk", "line", "0", "t", "k", ") continue;") + """\
+""") + """\
+
+""" + (self.m.group("sub").lower() == "c*" and " " or """\
+""" + self.sub.format2getText(n + 2, "\t\t", "isv", "line", "t + keysep.size()", None, "v", ") continue;") + """\
+""") + """\
+
+""" + (self.type[0] == 'T' and """\
+""" + (self.m.group("key").lower() == "c*" and """\
+		x[vector<char_type>((char_type *)&line[0], (char_type *)&line[t])] =
+""" or (self.key.type[0] == 'V' and """\
+		x[vector<char_type>((char_type *)&k[0], (char_type *)&k[k.size()])] =
+""" or """\
+		x[vector<char_type>((char_type *)(&k), (char_type *)(&k + 1))] =
+""")) + """\
+""" or """\
+""" + (self.m.group("key").lower() == "c*" and """\
+		x[vector<char_type>((char_type *)&line[0], (char_type *)&line[t])] =
+""" or """\
+		x[k] =
+""") + """\
+""") + """\
+
+""" + (self.m.group("sub").lower() == "c*" and """\
+				value_type(
+					(value_type::value_type *)&line[t + keysep.size()],
+					(value_type::value_type *)&line[line.size()]);
+""" or """\
+				v;
+""") + """\
+	}
+
+	return 0;
+}
+
+""" ""
+
+	# generate function for reading a Trie from binary input
+	def format2readTrie(self, n):
+		return "" """\
+template <class MapT> // std_value_type, or sorted_value_type for a Trie
+int read_""" + str(n) + """(const char *&p, const char *end, MapT &x, bool counted = true)
+{
+""" + (self.type[0] == 'T' and """\
+	typedef Container<""" + self.type + """>::std_value_type
+			::value_type::first_type::value_type char_type;
+""" or "") + """\
+	Container<""" + self.key.type + """>::std_value_type k;
+	Container<""" + self.sub.type + """>::std_value_type v;
+	size_t count = 0;
+	if (counted && readCount(p, end, count)) return -1;
+	x.clear();
+
+	for (size_t i = 0; counted ? i != count : p != end; i ++)
+	{
+		if (read_""" + str(n + 1) + """(p, end, k) || read_""" + str(n + 2) + """(p, end, v))
+			return -1;
+""" + self.format2readKey("v") + """\
+	}
+
+	return 0;
+}
+
+""" ""
+
+	# generate function for writing a Trie
+	def format2putTrie(self, n):
+		return (self.type[0] == 'T' and self.format2walkTrie(n) or "" """\
+template <class ContainerT>
+void put_""" + str(n) + """(ostream &out, const ContainerT &x)
+{
+	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+
+	for (size_t i = 0; i != x.size(); i ++)
+	{
+""" + (self.m.group("key").lower() == "c*" and """\
+		out << string(
+				(char *)(x.begin() + i)->first.begin(),
+				(char *)(x.begin() + i)->first.end());
+""" or """\
+		put_""" + str(n + 1) + """(out, (x.begin() + i)->first);
+""") + """\
+		out << keysep;
+
+""" + (self.m.group("sub").lower() == "c*" and """\
+		out << string(
+				(char *)(x.begin() + i)->second.begin(),
+				(char *)(x.begin() + i)->second.end());
+""" or """\
+		put_""" + str(n + 2) + """(out, (x.begin() + i)->second);
+""") + """\
+		out << sep;
+	}
+}
+
+""" "") + "" """\
+template <class _Key, class _Tp, class _Compare, class _Alloc>
+void put_""" + str(n) + """(
+		ostream &out, const map<_Key, _Tp, _Compare, _Alloc> &x)
+{
+	static const string keysep = """ + '\"' + self.m.group("keysep") + '\"' + """;
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+
+	typedef Container<""" + self.key.type + """>::std_value_type key_type;
+
+	for (typename map<_Key, _Tp, _Compare, _Alloc>::const_iterator
+			it = x.begin(); it != x.end(); ++ it)
+	{
+""" + (self.type[0] == 'T' and """\
+""" + (self.m.group("key").lower() == "c*" and """\
+		out << string((char *)&*it->first.begin(), (char *)&*it->first.end());
+""" or (self.key.type[0] == 'V' and """\
+		put_""" + str(n + 1) + """(out, key_type(
+				(key_type::value_type *)&*it->first.begin(),
+				(key_type::value_type *)&*it->first.end()));
+""" or """\
+		put_""" + str(n + 1) + """(out, *(key_type *)&*it->first.begin());
+""")) + """\
+""" or """\
+""" + (self.m.group("key").lower() == "c*" and """\
+		out << string((char *)&*it->first.begin(), (char *)&*it->first.end());
+""" or """\
+		put_""" + str(n + 1) + """(out, it->first);
+""") + """\
+""") + """\
+		out << keysep;
+
+""" + (self.m.group("sub").lower() == "c*" and """\
+		out << string((char *)&*it->second.begin(), (char *)&*it->second.end());
+""" or """\
+		put_""" + str(n + 2) + """(out, it->second);
+""") + """\
+		out << sep;
+	}
+}
+
+""" ""
+
+	# generate function for building a Pair container
+	def format2buildPair(self, n):
+		return "" """\
+int build_""" + str(n) + """(istream &in, const string &separator = "")
+{
+	StatsBuild statsBuild(""" + str(n) + """);
+
+	string line;
+
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+
+	typedef Container<""" + self.type + """>::std_value_type std_type;
+
+	fstream tmp1((tmpdir + """ + '\"/' + str(n) + '-1\"' + """).c_str(),
+			ios::in | ios::out | ios::trunc);
+	fstream tmp2((tmpdir + """ + '\"/' + str(n) + '-2\"' + """).c_str(),
+			ios::in | ios::out | ios::trunc);
+
+	const string sep1 = separator.empty() ? "" : sep;
+	const string sep2 = separator.empty() ? "" : separator;
+
+	if (separator.empty())
+	{
+		string line((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
+
+		size_t t = line.find(sep);
+		if (t == string::npos) return -1;
+
+		tmp1 << line.substr(0, t);
+		tmp2 << line.substr(t + sep.size());
+	}
+	else
+		while (getline(in, line, separator))
+		{
+			size_t t = line.find(sep);
+			if (t == string::npos) return -1;
+
+			tmp1 << line.substr(0, t);           tmp1 << sep1;
+			tmp2 << line.substr(t + sep.size()); tmp2 << sep2;
+		}
+
+	tmp1.seekg(0, ios::beg);
+	tmp2.seekg(0, ios::beg);
+	build_""" + str(n + 1)                  + """(tmp1, sep1);
+	build_""" + str(n + 1 + self.sub1.size) + """(tmp2, sep2);
+
+	tmp1.close();
+	tmp2.close();
+	unlink((tmpdir + """ + '\"/' + str(n) + '-1\"' + """).c_str());
+	unlink((tmpdir + """ + '\"/' + str(n) + '-2\"' + """).c_str());
+
+	return 0;
+}
+
+""" ""
+
+	# generate function for reading a Pair
+	def format2getPair(self, n):
+		return "" """\
+int get_""" + str(n) + """(
+		istream &in, Container<""" + self.type + """>::std_value_type &x)
+{
+	string line((istreambuf_iterator<char>(in)), istreambuf_iterator<char>());
+
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+
+	typedef Container<""" + self.sub1.type + """>::std_value_type first_type;
+	typedef Container<""" + self.sub2.type + """>::std_value_type second_type;
+
+	size_t t = line.find(sep);
+	if (t == string::npos) return -1;
+
+""" + (self.m.group("sub1").lower() == "c*" and """\
+	x.first = first_type(
+			(first_type::value_type *)&line[0],
+			(first_type::value_type *)&line[t]);
+""" or """\
+""" + self.sub1.format2getText(n + 1, "\t", "isv1", "line", "0", "t", "x.first", ") return -1;") + """\
+""") + """\
+
+""" + (self.m.group("sub2").lower() == "c*" and """\
+	x.second = second_type(
+			(second_type::value_type *)&line[t + sep.size()],
+			(second_type::value_type *)&line[line.size()]);
+""" or """\
+""" + self.sub2.format2getText(n + 1 + self.sub1.size, "\t", "isv2", "line", "t + sep.size()", None, "x.second", ") return -1;") + """\
+""") + """\
+
+	return 0;
+}
+
+""" ""
+
+	# generate function for reading a Pair from binary input
+	def format2readPair(self, n):
+		return "" """\
+int read_""" + str(n) + """(const char *&p, const char *end,
+		Container<""" + self.type + """>::std_value_type &x, bool = true)
+{
+	if (read_""" + str(n + 1) + """(p, end, x.first)) return -1;
+	if (read_""" + str(n + 1 + self.sub1.size) + """(p, end, x.second)) return -1;
+
+	return 0;
+}
+
+""" ""
+
+	# generate function for writing a Pair
+	def format2putPair(self, n):
+		return "" """\
+template <class ContainerT>
+void put_""" + str(n) + """(ostream &out, const ContainerT &x)
+{
+	static const string sep    = """ + '\"' + self.m.group("sep"   ) + '\"' + """;
+
+""" + (self.m.group("sub1").lower() == "c*" and """\
+	out << string((char *)&*x.first.begin(), (char *)&*x.first.end());
+""" or """\
+	put_""" + str(n + 1) + """(out, x.first);
+""") + """\
+	out << sep;
+
+""" + (self.m.group("sub2").lower() == "c*" and """\
+	out << string((char *)&*x.second.begin(), (char *)&*x.second.end());
+""" or """\
+	put_""" + str(n + 1 + self.sub1.size) + """(out, x.second);
+""") + """\
+}
+
+""" ""
+
+# with --sizes auto, input.ft is read by the size types it was built with,
+# and a build is by 32 bits until they overflow (see rebuild below)
+
+if options.sizes == "auto" and args and os.path.isfile(args[0]):
+	try:
+		sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+		import ftreader
+		options.sizes = ftreader.sizesOf(args[0], options.format) or "auto"
+	except (ImportError, ValueError, EnvironmentError):
+		pass
+
+container = Container(0, options.format)
+
+if options.sorted and container.type[0] != 'T':
+	parser.error("--sorted works on a Trie format only")
+if options.sorted and container.m.group("key").lower() not in ["c*", "u*"]:
+	# keys of other types are ordered by their bytes in memory, which no
+	# text sort gives
+	parser.error("--sorted works on a Trie of c* or u* keys only")
+if options.jobs > 1 and container.type[0] != 'T' and not options.serve:
+	parser.error("--jobs works on a Trie format only")
+if options.memory_limit is not None and (container.type[0] != 'T' or args):
+	parser.error("--memory-limit works on building a Trie format only")
+if options.memory_limit is not None and options.memory_limit <= 0:
+	parser.error("--memory-limit must be positive")
+if options.memory_limit and options.jobs > 1:
+	parser.error("--memory-limit builds key ranges one by one, without --jobs")
+if (options.jobs > 1 or options.memory_limit) and not args and "FT_ALPHABET" in container.m.group("arg"):
+	parser.error("a Trie with FT_ALPHABET builds in one piece, without --jobs or --memory-limit")
+if options.input_format == "binary" and args:
+	parser.error("--input-format works on building only")
+if options.input_format == "binary" and (options.disk or options.jobs > 1 or options.memory_limit):
+	parser.error("--input-format=binary builds in memory, without --disk, --jobs or --memory-limit")
+if (options.jobs > 1 or options.memory_limit) and not args:
+	options.disk = True
+if options.benching and "key" not in container.m.groupdict():
+	parser.error("--bench works on a Trie or HashMap format only")
+if options.prefixing and (container.type[0] != 'T' or not args):
+	parser.error("--prefix works on files of a Trie format only")
+if options.limit is not None and (not options.prefixing or options.limit <= 0):
+	parser.error("--limit must be positive, with --prefix")
+if options.scan and (container.type[0] != 'T' or container.m.group("key").lower() != "c*"
+		or not args):
+	parser.error("--scan works on a file of a Trie format of c* keys only")
+if options.piping and "key" not in container.m.groupdict():
+	parser.error("--pipe works on a Trie or HashMap format only")
+if options.serve and ("key" not in container.m.groupdict() or len(args) != 1):
+	parser.error("--serve works on one file of a Trie or HashMap format only")
+if options.batch and "key" not in container.m.groupdict():
+	parser.error("--batch works on a Trie or HashMap format only")
+if options.batch == "values" and not ("sub" in container.m.groupdict()
+		and container.sub.type.startswith("Struct_")):
+	parser.error("--batch values works on a fixed-size value (e.g. (l) or (l:f)) only")
+if options.residency is not None:
+	policies = options.residency.split(",")
+	if [x for x in policies if x not in
+			["random", "sequential", "willneed", "hugepage", "mlock", "warmup"]]:
+		parser.error("--residency takes random, sequential, willneed, hugepage, mlock or warmup")
+	if "random" in policies and "sequential" in policies:
+		parser.error("--residency takes one of random and sequential")
+	if not args:
+		parser.error("--residency works on input.ft only")
+if options.stats and args:
+	parser.error("--stats works on building only")
+if options.output and args:
+	parser.error("--output works on building only")
+
+# generate C++ source code
+
+cpp = "" """\
+// generated by fasttrie.py -f '""" + options.format + """'
+
+#include <iostream>
+#include <fstream>
+#include <sstream>
+#include <limits>
+#include <queue>
+
+#include <stdio.h>
+#include <stdlib.h>
+#include <math.h>
+#include <errno.h>
+#include <fcntl.h>
+#include <time.h>
+#include <poll.h>
+#include <pthread.h>
+#include <signal.h>
+#include <sys/wait.h>
+#include <sys/resource.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
+#include <sys/epoll.h>
+#include <sys/socket.h>
+#include <sys/un.h>
+
+#include "FastTrie.h"
+
+""" + "\n".join(map(lambda x: '#include \"' + x + '\"', options.extend)) + """\
+
+using namespace std;
+using namespace ft2;
+
+// common utility functions
+
+// report an error thrown by building, and return the exit status for it, 3
+// for sizes exceeding the size type, for fasttrie.py to build again by 64 bits
+int buildFailed(int error)
+{
+	if (error == FT_OVERFLOW)
+	{
+		cerr << "sizes exceed the size type, build with --sizes 64 "
+				"or a size type of 64 bits in the format (e.g. T,FT_TAIL,uint8_t,64)" << endl;
+		return 3;
+	}
+	if (error == FT_COLLISION)
+	{
+		cerr << "keys have the same hash by PerfectHash, "
+				"build the HashMap by the default hash instead (e.g. H instead of H,PerfectHash)" << endl;
+		return 1;
+	}
+
+	cerr << "keys are not in increasing order, "
+			"sort the input in C locale and remove duplicated keys" << endl;
+	return 1;
+}
+
+const vector<string> split(const string &delimiter, const string &source)
+{
+	if (delimiter.empty()) return vector<string>(1, source);
+
+	vector<string> result;
+
+	size_t prev_pos = 0;
+	size_t pos = source.find(delimiter, 0);
+	while (pos != string::npos)
+	{
+		result.push_back(source.substr(prev_pos, pos - prev_pos));
+		pos += delimiter.size();
+		prev_pos = pos;
+		pos = source.find(delimiter, pos);
+	}
+	result.push_back(source.substr(prev_pos));
+
+	return result;
+}
+
+istream &getUtf16(istream &in, uint16_t &utf16)
+{
+	const uint16_t replacementChar = 0xFFFD;
+
+	uint16_t result = (uint8_t)in.get(); if (!in) return in;
+
+	if      (result < 0x80) ;
+	else if (result < 0xC2) // unexpected continuation byte or overlong
+		result = replacementChar;
+	else if (result < 0xE0) // 2 bytes
+	{
+		result = (result & 0x1F) << 6;
+
+		uint16_t next = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		result |= (next & 0x3F);
+	}
+	else if (result < 0xF0) // 3 bytes
+	{
+		result = (result & 0xF) << 12;
+
+		uint16_t next = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		result |= (next & 0x3F) << 6;
+
+		next          = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		result |= (next & 0x3F);
+
+		if (result < 0x800) result = replacementChar; // overlong
+	}
+	else if (result < 0xF8) // 4 bytes
+	{
+		uint16_t next = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		next          = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		next          = (uint8_t)in.get(); if (!in) return in;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+
+		result = replacementChar; // not in UCS-2
+	}
+	else
+		result = replacementChar; // not in UTF-8 standard
+
+	utf16 = result; return in;
+}
+
+ostream &putUtf16(ostream &out, uint16_t utf16)
+{
+	if      (utf16 < 0x80 )
+		out << (char)(utf16);
+	else if (utf16 < 0x800)
+		out << (char)(utf16 >>  6 | 0xC0) << (char)(utf16 & 0x3F | 0x80);
+	else
+		out << (char)(utf16 >> 12        | 0xE0)
+				<< (char)(utf16 >>  6 & 0x3F | 0x80)
+				<< (char)(utf16       & 0x3F | 0x80);
+
+	return out;
+}
+
+istream &getline(istream &in, string &line, const string &delimiter)
+{
+	if (delimiter.empty()) return getline(in, line);
+
+	getline(in, line, delimiter[delimiter.size() - 1]);
+	while (delimiter.size() > line.size() && line.size()
+			|| delimiter.size() > 1 && strcmp(delimiter.c_str(),
+			line.c_str() + line.size() - delimiter.size() + 1))
+	{
+		line += delimiter[delimiter.size() - 1];
+		getline(in, line, delimiter[delimiter.size() - 1]);
+	}
+	if (delimiter.size() > 1)
+		line.resize(line.size() - delimiter.size() + 1);
+
+	return in;
+}
+
+inline void skip(istream &in, const char *separator)
+{
+	for (const char *p = separator; *p; p ++)
+		if (in.get() != *p) { in.unget(); break; }
+}
+
+// parsers over text in memory, which read as an istringstream of the text
+// does, in the C locale: ok turns false as the stream fails, and plain
+// decimal numbers are parsed by hand, anything else by istream >>
+
+inline bool isSpace(char c)
+{
+	return c == ' ' || (c >= '\\t' && c <= '\\r');
+}
+
+inline bool isDigit(char c)
+{
+	return (unsigned char)(c - '0') < 10;
+}
+
+inline void skip(const char *&p, const char *end, const char *separator, bool &ok)
+{
+	for (const char *s = separator; *s; s ++)
+	{
+		if (!ok || p == end) { ok = false; return; }
+		if (*p != *s) return;
+		p ++;
+	}
+}
+
+template <class T>
+bool getStream(const char *&p, const char *end, T &x)
+{
+	istringstream in(string(p, end));
+	if (!(in >> x)) return false;
+
+	p = in.eof() ? end : p + (size_t)in.tellg();
+	return true;
+}
+
+template <class T>
+bool getInteger(const char *&p, const char *end, T &x)
+{
+	const char *q = p;
+	while (q != end && isSpace(*q)) q ++;
+
+	bool negative = q != end && *q == '-';
+	if (q != end && (*q == '-' || *q == '+')) q ++;
+
+	// up to 18 digits, which fit in uint64_t
+	const char *digits = q;
+	uint64_t value = 0;
+	while (q != end && isDigit(*q) && q - digits < 18)
+		value = value * 10 + (*q ++ - '0');
+
+	if (q == digits || (q != end && isDigit(*q))
+			|| (negative && !numeric_limits<T>::is_signed)
+			|| value > (uint64_t)numeric_limits<T>::max() + negative)
+		return getStream(p, end, x);
+
+	x = negative ? (T)(0 - (int64_t)value) : (T)value;
+	p = q;
+	return true;
+}
+
+// what num_get collects, [+-]digits[.digits][(e|E)[+-]digits], converted by
+// strtof or strtod as num_get does
+
+inline double toFloat(const char *text, char **stop, double) { return strtod(text, stop); }
+inline float  toFloat(const char *text, char **stop, float ) { return strtof(text, stop); }
+
+template <class T>
+bool getFloat(const char *&p, const char *end, T &x)
+{
+	const char *q = p;
+	while (q != end && isSpace(*q)) q ++;
+
+	const char *begin = q;
+	if (q != end && (*q == '-' || *q == '+')) q ++;
+
+	size_t digits = 0;
+	for (; q != end && isDigit(*q); q ++) digits ++;
+	if (q != end && *q == '.')
+		for (q ++; q != end && isDigit(*q); q ++) digits ++;
+	if (!digits) return getStream(p, end, x);
+
+	if (q != end && (*q == 'e' || *q == 'E'))
+	{
+		q ++;
+		if (q != end && (*q == '-' || *q == '+')) q ++;
+		const char *exponent = q;
+		while (q != end && isDigit(*q)) q ++;
+		if (q == exponent) return getStream(p, end, x);
+	}
+
+	char text[64];
+	if (q - begin >= (ptrdiff_t)sizeof(text)) return getStream(p, end, x);
+	memcpy(text, begin, q - begin);
+	text[q - begin] = 0;
+
+	char *stop;
+	errno = 0;
+	T value = toFloat(text, &stop, T());
+	if (stop != text + (q - begin) || errno == ERANGE) return getStream(p, end, x);
+
+	x = value;
+	p = q;
+	return true;
+}
+
+inline bool getChar(const char *&p, const char *end, char &x)
+{
+	if (p == end) return false;
+	x = *p ++;
+	return true;
+}
+
+inline bool getChar(const char *&p, const char *end, unsigned char &x)
+{
+	if (p == end) return false;
+	x = *p ++;
+	return true;
+}
+
+bool getUtf16(const char *&p, const char *end, uint16_t &utf16)
+{
+	const uint16_t replacementChar = 0xFFFD;
+
+	if (p == end) return false;
+	uint16_t result = (uint8_t)*p ++;
+
+	// continuation bytes expected after the first one
+	int more = result < 0x80 ? 0 : result < 0xC2 ? -1 : result < 0xE0 ? 1
+			: result < 0xF0 ? 2 : result < 0xF8 ? 3 : -1;
+
+	if      (more == 1) result = (result & 0x1F) << 6;
+	else if (more == 2) result = (result & 0xF) << 12;
+
+	for (int i = more; i > 0; i --)
+	{
+		if (p == end) return false;
+		uint16_t next = (uint8_t)*p ++;
+		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return true; }
+		result |= (next & 0x3F) << (6 * (i - 1));
+	}
+
+	if (more < 0 || more == 3 || (more == 2 && result < 0x800)) // not in UCS-2, or overlong
+		result = replacementChar;
+
+	utf16 = result; return true;
+}
+
+// binary input (-i binary), in native byte order, which read_N copies in
+// place of parsing text: a struct in C layout, a struct sequence, Vector,
+// Trie or HashMap a uint32_t count and its items (keys and values of a map
+// in turn), a Pair its first then its second, and the outermost container
+// its items up to the end of input without the count; read_N returns -1 on
+// input cut short
+
+inline int readCount(const char *&p, const char *end, size_t &count)
+{
+	uint32_t n;
+	if ((size_t)(end - p) < sizeof(n)) return -1;
+	memcpy(&n, p, sizeof(n));
+	p += sizeof(n);
+	count = n;
+	return 0;
+}
+
+// writers of text into the stream buffer at once, in place of ostream <<:
+// integers by hand, and floats in the shortest text that reads back to the
+// same value, or with the fixed precision of earlier versions, as ostream <<
+// writes them, for compatibleText (-C)
+
+bool compatibleText = false;
+
+inline void putInteger(ostream &out, uint64_t x, bool negative = false)
+{
+	char text[24], *p = text + sizeof(text);
+
+	do *-- p = '0' + x % 10; while (x /= 10);
+	if (negative) *-- p = '-';
+	out.rdbuf()->sputn(p, text + sizeof(text) - p);
+}
+
+inline void putInteger(ostream &out, int64_t x)
+{
+	putInteger(out, x < 0 ? 0 - (uint64_t)x : (uint64_t)x, x < 0);
+}
+
+template <size_t N>
+inline void putText(ostream &out, const char (&text)[N])
+{
+	out.rdbuf()->sputn(text, N - 1);
+}
+
+// powers of 10, exact in double up to 10^22, and in long double up to 10^27
+
+static const double powers10[] = {
+	1e0,  1e1,  1e2,  1e3,  1e4,  1e5,  1e6,  1e7,  1e8,  1e9,  1e10, 1e11,
+	1e12, 1e13, 1e14, 1e15, 1e16, 1e17, 1e18, 1e19, 1e20, 1e21, 1e22,
+};
+
+static const long double powers10L[] = {
+	1e0L,  1e1L,  1e2L,  1e3L,  1e4L,  1e5L,  1e6L,  1e7L,  1e8L,  1e9L,
+	1e10L, 1e11L, 1e12L, 1e13L, 1e14L, 1e15L, 1e16L, 1e17L, 1e18L, 1e19L,
+	1e20L, 1e21L, 1e22L, 1e23L, 1e24L, 1e25L, 1e26L, 1e27L,
+};
+
+// whether digits * 10^exponent, in text, reads back to x: a float by the
+// double nearest to it, which rounds to the same float unless it lies on the
+// midpoint of two floats, and otherwise by strtof or strtod of the text
+
+inline bool readsBack(uint64_t digits, int exponent, const char *text, float x)
+{
+	if (exponent >= -22 && exponent <= 22 && !(digits >> 53))
+	{
+		double d = exponent >= 0 ? digits * powers10[exponent] : digits / powers10[-exponent];
+		float f = (float)d, g = nextafterf(f, d > f ? HUGE_VALF : -HUGE_VALF);
+		if (d == f || d - f != ((double)g - f) / 2) return (x < 0 ? -f : f) == x;
+	}
+
+	return strtof(text, 0) == x;
+}
+
+inline bool readsBack(uint64_t, int, const char *text, double x)
+{
+	return strtod(text, 0) == x;
+}
+
+// x in the shortest text that reads back to x, of digits10 digits or more,
+// as %g writes it at that precision: the digits by scaling x in long double,
+// or by %g itself where the scale is not exact
+
+template <class T>
+int shortestText(char *text, T x)
+{
+	const int maxDigits = sizeof(T) == sizeof(float) ? 9 : 17;
+	int precision = numeric_limits<T>::digits10;
+
+	long double a = x < 0 ? -(long double)x : x;
+	bool finite = x != 0 && x - x == 0;
+	int k = finite ? (int)floor(log10((double)a)) : 0; // exponent of the first digit
+	if (k - precision >= -28 && k - precision <= 26)
+	{
+		long double scaled = precision - 1 - k >= 0 ? a * powers10L[precision - 1 - k]
+				: a / powers10L[k - precision + 1];
+		if (scaled >= powers10L[precision]) k ++;
+		else if (scaled < powers10L[precision - 1]) k --;
+	}
+
+	for (; finite && precision <= maxDigits; precision ++)
+	{
+		int scale = precision - 1 - k;
+		if (scale < -27 || scale > 27) break;
+
+		// up to 10^17 within 0.006 of a * 10^scale, rounded as %g only away
+		// from a tie
+		long double scaled = scale >= 0 ? a * powers10L[scale] : a / powers10L[-scale];
+		if (fabsl(scaled - floorl(scaled) - 0.5L) < 0.01L) break;
+		uint64_t digits = llrintl(scaled);
+
+		char buffer[24], *end = buffer + sizeof(buffer), *d = end;
+		for (uint64_t v = digits; v; v /= 10) *-- d = '0' + v % 10;
+		int first = k + (int)(end - d) - precision; // exponent of the first digit
+		while (end - d > 1 && end[-1] == '0') { end --; digits /= 10; }
+		int last = first - (int)(end - d - 1);      // exponent of the last digit
+
+		char *p = text;
+		if (x < 0) *p ++ = '-';
+		if (first < -4 || first >= precision)
+		{
+			*p ++ = *d ++;
+			if (d != end) *p ++ = '.';
+			while (d != end) *p ++ = *d ++;
+			*p ++ = 'e';
+			*p ++ = first < 0 ? '-' : '+';
+			int e = first < 0 ? -first : first;
+			if (e >= 100) *p ++ = '0' + e / 100;
+			*p ++ = '0' + e / 10 % 10;
+			*p ++ = '0' + e % 10;
+		}
+		else if (first >= 0)
+		{
+			for (int i = 0; i <= first; i ++) *p ++ = d != end ? *d ++ : '0';
+			if (d != end) *p ++ = '.';
+			while (d != end) *p ++ = *d ++;
+		}
+		else
+		{
+			*p ++ = '0';
+			*p ++ = '.';
+			for (int i = -1; i > first; i --) *p ++ = '0';
+			while (d != end) *p ++ = *d ++;
+		}
+		*p = 0;
+
+		if (readsBack(digits, last, text, x)) return p - text;
+	}
+
+	int size;
+	do size = snprintf(text, 32, "%.*g", precision, (double)x);
+	while (x == x && toFloat(text, 0, T()) != x && ++ precision <= 17);
+	return size;
+}
+
+template <class T>
+void putFloat(ostream &out, T x)
+{
+	if (compatibleText)
+	{
+		out.precision(numeric_limits<T>::digits10 + 2);
+		out << x;
+		return;
+	}
+
+	// integers of up to digits10 digits, as %g writes them
+	const double limit = sizeof(T) == sizeof(float) ? 1e6 : 1e15;
+	if (x == 0 && signbit(x)) putText(out, "-0");
+	else if (x > -limit && x < limit && x == (T)(int64_t)x) putInteger(out, (int64_t)x);
+	else
+	{
+		char text[32];
+		out.rdbuf()->sputn(text, shortestText(text, x));
+	}
+}
+
+// time lookups of keys, the first ones one by one for the latencies right
+// after loading, then as a whole for the throughput with find() and with
+// findMany(), then one by one again for the latencies, which include the
+// overhead of reading the clock
+
+inline double now()
+{
+	timespec ts;
+	clock_gettime(CLOCK_MONOTONIC, &ts);
+	return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+template <class ContainerT, class KeyT>
+void bench(const ContainerT &container, const vector<KeyT> &keys, double loading)
+{
+	static volatile size_t sink;
+
+	size_t hits = 0;
+
+	// warm up, timing the first lookups, then repeat lookups for at least 0.1s
+	vector<double> firsts(keys.size());
+	for (size_t i = 0; i != keys.size(); i ++)
+	{
+		double begin = now();
+		hits += container.find(keys[i]) != container.end();
+		firsts[i] = now() - begin;
+	}
+
+	size_t rounds = 0;
+	double start = now(), seconds = 0;
+	while (!keys.empty() && seconds < 0.1)
+	{
+		for (size_t i = 0; i != keys.size(); i ++)
+			hits += container.find(keys[i]) != container.end();
+		rounds ++;
+		seconds = now() - start;
+	}
+	sink = hits;
+
+	// the same with findMany()
+	vector<typename ContainerT::const_iterator> results(keys.size());
+	size_t roundsMany = 0;
+	double startMany = now(), secondsMany = 0;
+	while (!keys.empty() && secondsMany < 0.1)
+	{
+		container.findMany(&keys[0], keys.size(), &results[0]);
+		roundsMany ++;
+		secondsMany = now() - startMany;
+	}
+
+	hits = 0;
+	vector<double> latencies(keys.size()), clocks(keys.size());
+	for (size_t i = 0; i != keys.size(); i ++)
+	{
+		double begin = now();
+		hits += container.find(keys[i]) != container.end();
+		latencies[i] = now() - begin;
+	}
+	for (size_t i = 0; i != keys.size(); i ++)
+	{
+		double begin = now();
+		clocks[i] = now() - begin;
+	}
+	sort(latencies.begin(), latencies.end());
+	sort(clocks.begin(), clocks.end());
+	sort(firsts.begin(), firsts.end());
+
+	static const double ps[] = { 0.5, 0.9, 0.99, 1.0 };
+	static const char *names[] = { "p50", "p90", "p99", "max" };
+
+	cout << "{\\"lookups\\": " << keys.size() << ", \\"hits\\": " << hits
+			<< ", \\"seconds\\": " << seconds << ", \\"lookups_per_second\\": "
+			<< (seconds > 0 ? rounds * keys.size() / seconds : 0)
+			<< ", \\"many_lookups_per_second\\": "
+			<< (secondsMany > 0 ? roundsMany * keys.size() / secondsMany : 0);
+	for (size_t i = 0; i != sizeof(ps) / sizeof(ps[0]); i ++)
+		cout << ", \\"" << names[i] << "_ns\\": " << (latencies.empty() ? 0 :
+				latencies[min((size_t)(ps[i] * latencies.size()), latencies.size() - 1)] * 1e9);
+	cout << ", \\"load_seconds\\": " << loading;
+	for (size_t i = 0; i != sizeof(ps) / sizeof(ps[0]); i ++)
+		cout << ", \\"first_" << names[i] << "_ns\\": " << (firsts.empty() ? 0 :
+				firsts[min((size_t)(ps[i] * firsts.size()), firsts.size() - 1)] * 1e9);
+	cout << ", \\"clock_ns\\": "
+			<< (clocks.empty() ? 0 : clocks[clocks.size() / 2] * 1e9) << "}" << endl;
+}
+
+// convert a key of raw bytes to a struct or a vector of structs
+
+template <class T>
+inline bool getBytes(const char *begin, const char *end, T &key)
+{
+	if (end - begin != sizeof(T)) return false;
+
+	memcpy(&key, begin, sizeof(T));
+	return true;
+}
+
+template <class T>
+inline bool getBytes(const char *begin, const char *end, vector<T> &key)
+{
+	if ((end - begin) % sizeof(T)) return false;
+
+	key.resize((end - begin) / sizeof(T));
+	if (!key.empty()) memcpy(&key[0], begin, end - begin);
+	return true;
+}
+
+template <class T>
+inline void putBytes(vector<char> &out, const T &value)
+{
+	out.insert(out.end(), (const char *)&value, (const char *)&value + sizeof(T));
+}
+
+// look up length-prefixed keys from stdin, write a bitmap of hits or raw
+// values to stdout, both in big chunks, then the throughput in JSON to stderr
+
+template <class ContainerT, class KeyT>
+int batch(const ContainerT &container, KeyT key, bool values)
+{
+	static const size_t chunk = 1048576;
+
+	vector<char> in(chunk), out;
+	size_t begin = 0, end = 0;
+	size_t numKeys = 0, hits = 0;
+	uint8_t bits = 0;
+
+	// keys of a chunk to look up with findMany(), and whether they are valid
+	vector<KeyT> keys;
+	vector<char> valid;
+	vector<typename ContainerT::const_iterator> results;
+
+	double start = now();
+	for (;;)
+	{
+		uint32_t length = 0;
+		if (end - begin >= sizeof(length)) memcpy(&length, &in[begin], sizeof(length));
+
+		if (end - begin < sizeof(length) || end - begin - sizeof(length) < length)
+		{
+			if (!keys.empty())
+			{
+				results.resize(keys.size());
+				container.findMany(&keys[0], keys.size(), &results[0]);
+
+				for (size_t i = 0; i != keys.size(); i ++, numKeys ++)
+				{
+					if (valid[i] && results[i] != container.end())
+					{
+						bits |= 1 << numKeys % 8;
+						hits ++;
+					}
+					if (numKeys % 8 == 7) { out.push_back(bits); bits = 0; }
+				}
+				keys.clear();
+				valid.clear();
+			}
+
+			// move the incomplete key to the beginning and read more
+			memmove(&in[0], &in[begin], end - begin);
+			end -= begin;
+			begin = 0;
+			if (in.size() < sizeof(length) + length) in.resize(sizeof(length) + length);
+
+			size_t size = fread(&in[end], 1, in.size() - end, stdin);
+			if (size == 0) break;
+			end += size;
+			continue;
+		}
+
+		const char *k = &in[begin + sizeof(length)];
+		begin += sizeof(length) + length;
+
+		if (values)
+		{
+			if (getBytes(k, k + length, key))
+				putBytes(out, container(key));
+			else // a key of a wrong length never hits
+				out.resize(out.size() + sizeof(container(key)));
+			numKeys ++;
+		}
+		else
+		{
+			keys.push_back(key);
+			valid.push_back(getBytes(k, k + length, keys.back()));
+		}
+
+		if (out.size() >= chunk)
+		{
+			fwrite(&out[0], 1, out.size(), stdout);
+			out.clear();
+		}
+	}
+	if (!values && numKeys % 8) out.push_back(bits);
+	if (!out.empty()) fwrite(&out[0], 1, out.size(), stdout);
+	fflush(stdout);
+	double seconds = now() - start;
+
+	if (begin != end)
+	{
+		cerr << "incomplete key at the end of input" << endl;
+		return 1;
+	}
+
+	cerr << "{\\"keys\\": " << numKeys;
+	if (!values) cerr << ", \\"hits\\": " << hits;
+	cerr << ", \\"seconds\\": " << seconds << ", \\"keys_per_second\\": "
+			<< (seconds > 0 ? numKeys / seconds : 0) << "}" << endl;
+
+	return 0;
+}
+
+// the framed binary protocol of -P and -U, in native byte order: a request
+// is a uint32_t id, a uint32_t operation, a uint32_t length and the key in
+// text as in input.txt, and a response the id, the length of the result, or
+// FRAME_MISS for a key not found or FRAME_ERROR for a request not served,
+// and the result, so that results may hold any byte:
+// - FRAME_FIND:      the value in text
+// - FRAME_PREFIX:    the keys beginning with the key, and their values
+// - FRAME_MATCH_ALL: the keys found anywhere in the key, and their values
+// - FRAME_STATS:     latencies of the requests in JSON
+// Keys and values in a result are records of a uint32_t length and the text.
+
+enum { FRAME_FIND, FRAME_PREFIX, FRAME_MATCH_ALL, FRAME_STATS, FRAME_OPERATIONS };
+
+const uint32_t FRAME_MISS  = 0xFFFFFFFF;
+const uint32_t FRAME_ERROR = 0xFFFFFFFE;
+
+struct Request
+{
+	uint32_t id;
+	uint32_t operation;
+	string   key;
+	double   start; // time read in, for the latency
+};
+
+// take the complete requests in in[0, end), move the rest to the beginning,
+// and make room in in for all of the next request
+
+void takeRequests(vector<char> &in, size_t &end, vector<Request> &requests)
+{
+	uint32_t header[3];
+	size_t begin = 0;
+	double start = now();
+
+	while (end - begin >= sizeof(header))
+	{
+		memcpy(header, &in[begin], sizeof(header));
+		if (end - begin - sizeof(header) < header[2]) break;
+
+		requests.push_back(Request());
+		requests.back().id        = header[0];
+		requests.back().operation = header[1];
+		requests.back().key.assign(&in[begin + sizeof(header)], header[2]);
+		requests.back().start     = start;
+		begin += sizeof(header) + header[2];
+	}
+
+	memmove(&in[0], &in[begin], end - begin);
+	end -= begin;
+
+	if (end >= sizeof(header) && in.size() < sizeof(header) + header[2])
+		in.resize(sizeof(header) + header[2]);
+}
+
+// read requests from fd into in[0, end), wait for one, then take all the
+// complete ones, return false at the end of input or on an error
+
+bool readRequests(int fd, vector<char> &in, size_t &end, vector<Request> &requests)
+{
+	for (;;)
+	{
+		takeRequests(in, end, requests);
+		if (!requests.empty()) return true;
+
+		ssize_t size = read(fd, &in[end], in.size() - end);
+		if (size < 0 && errno == EINTR) continue;
+		if (size <= 0) return false;
+		end += size;
+	}
+}
+
+inline void putResponse(vector<char> &out, uint32_t id, const string &result)
+{
+	uint32_t header[2] = { id, (uint32_t)result.size() };
+
+	out.insert(out.end(), (const char *)header, (const char *)(header + 2));
+	out.insert(out.end(), result.begin(), result.end());
+}
+
+inline void putResponse(vector<char> &out, uint32_t id, uint32_t status)
+{
+	uint32_t header[2] = { id, status };
+
+	out.insert(out.end(), (const char *)header, (const char *)(header + 2));
+}
+
+inline void putRecord(string &out, const string &text)
+{
+	uint32_t length = text.size();
+
+	out.append((const char *)&length, sizeof(length));
+	out.append(text);
+}
+
+// write all of out to fd, waiting for a non-blocking one to be writable
+
+bool writeAll(int fd, const vector<char> &out)
+{
+	for (size_t begin = 0; begin != out.size(); )
+	{
+		ssize_t size = write(fd, &out[begin], out.size() - begin);
+		if (size < 0 && errno == EINTR) continue;
+		if (size < 0 && errno == EAGAIN)
+		{
+			pollfd writable = { fd, POLLOUT, 0 };
+			poll(&writable, 1, -1);
+			continue;
+		}
+		if (size <= 0) return false;
+		begin += size;
+	}
+
+	return true;
+}
+
+// latencies of requests from being read in to being answered, by operation,
+// in histograms of powers of 2 nanoseconds, added to by many threads at once
+
+class Latencies
+{
+public:
+	Latencies() { memset(this, 0, sizeof(*this)); }
+
+	void add(uint32_t operation, double seconds)
+	{
+		if (operation >= FRAME_OPERATIONS) return;
+
+		uint64_t ns = (uint64_t)(seconds * 1e9);
+		int bucket = 0;
+		while (bucket < 63 && (ns >> (bucket + 1))) bucket ++;
+
+		__sync_fetch_and_add(&m_counts[operation][bucket], 1);
+		__sync_fetch_and_add(&m_ns[operation], ns);
+	}
+
+	// requests, mean and percentiles, each the upper bound of its bucket
+	string json() const
+	{
+		static const char *operations[] = { "find", "prefix", "match_all", "stats" };
+		static const double ps[] = { 0.5, 0.9, 0.99, 1.0 };
+		static const char *names[] = { "p50", "p90", "p99", "max" };
+
+		ostringstream os;
+		os << "{";
+		for (int i = 0; i != FRAME_OPERATIONS; i ++)
+		{
+			uint64_t requests = 0;
+			for (int j = 0; j != 64; j ++) requests += m_counts[i][j];
+
+			os << (i ? ", " : "") << "\\"" << operations[i] << "\\": {\\"requests\\": " << requests
+					<< ", \\"mean_ns\\": " << (requests ? m_ns[i] / requests : 0);
+			for (size_t p = 0; p != sizeof(ps) / sizeof(ps[0]); p ++)
+			{
+				uint64_t count = 0;
+				int j = 0;
+				while (j != 63 && (count += m_counts[i][j]) < ps[p] * requests) j ++;
+				os << ", \\"" << names[p] << "_ns\\": " << (requests ? (uint64_t)2 << j : 0);
+			}
+			os << "}";
+		}
+		os << "}";
+
+		return os.str();
+	}
+
+private:
+	uint64_t m_counts[FRAME_OPERATIONS][64];
+	uint64_t m_ns[FRAME_OPERATIONS];
+};
+
+Latencies latencies;
+
+// serve requests on a UNIX socket (-U): threads of a pool wait on an epoll
+// set, where each connection is armed one shot, so that it is read and
+// answered by one thread at a time, until SIGINT or SIGTERM, while the main
+// thread loads the container again every second its file is replaced
+
+volatile sig_atomic_t stopping = 0;
+
+void stop(int) { stopping = 1; }
+
+struct Connection
+{
+	Connection(int fd) : fd(fd), in(65536), end(0) {}
+
+	int fd;
+	vector<char> in;
+	size_t end;
+};
+
+template <class ContainerT, class RespondT>
+struct Server
+{
+	Reloadable<ContainerT> *container;
+	RespondT respond;
+	int listener;
+	int epoll;
+
+	// arm a connection, or the listener for 0, for one event
+	void arm(int op, int fd, Connection *connection)
+	{
+		epoll_event event;
+		event.events = EPOLLIN | EPOLLONESHOT;
+		event.data.ptr = connection;
+		epoll_ctl(epoll, op, fd, &event);
+	}
+
+	static void *run(void *arg)
+	{
+		Server &server = *(Server *)arg;
+
+		vector<Request> requests;
+		vector<char> out;
+		epoll_event event;
+
+		while (!stopping)
+		{
+			if (epoll_wait(server.epoll, &event, 1, 100) <= 0) continue;
+
+			if (!event.data.ptr)
+			{
+				for (int fd; (fd = accept(server.listener, 0, 0)) >= 0; )
+				{
+					fcntl(fd, F_SETFL, O_NONBLOCK);
+					server.arm(EPOLL_CTL_ADD, fd, new Connection(fd));
+				}
+				server.arm(EPOLL_CTL_MOD, server.listener, 0);
+				continue;
+			}
+
+			Connection *c = (Connection *)event.data.ptr;
+			bool open = true;
+
+			// answer the requests of each read, until no more to read
+			while (open)
+			{
+				ssize_t size = read(c->fd, &c->in[c->end], c->in.size() - c->end);
+				if (size < 0 && errno == EINTR) continue;
+				if (size < 0 && errno == EAGAIN) break;
+				if (size <= 0) { open = false; break; }
+				c->end += size;
+
+				takeRequests(c->in, c->end, requests);
+				if (requests.empty()) continue;
+
+				{
+					typename Reloadable<ContainerT>::Reading reading(*server.container);
+					server.respond((*reading)[0], requests, out);
+				}
+				open = writeAll(c->fd, out);
+				requests.clear();
+				out.clear();
+			}
+
+			if (open) server.arm(EPOLL_CTL_MOD, c->fd, c);
+			else
+			{
+				close(c->fd);
+				delete c;
+			}
+		}
+
+		return 0;
+	}
+};
+
+template <class ContainerT, class RespondT>
+int serveSocket(Reloadable<ContainerT> &container, RespondT respond, const string &path,
+		int threads)
+{
+	Server<ContainerT, RespondT> server = { &container, respond, -1, -1 };
+
+	sockaddr_un address;
+	memset(&address, 0, sizeof(address));
+	address.sun_family = AF_UNIX;
+	if (path.size() >= sizeof(address.sun_path))
+	{
+		cerr << "socket path " << path << " is too long" << endl;
+		return 1;
+	}
+	strcpy(address.sun_path, path.c_str());
+
+	// take over a socket left by a server gone, but not one still serving
+	server.listener = socket(AF_UNIX, SOCK_STREAM, 0);
+	if (bind(server.listener, (sockaddr *)&address, sizeof(address)) && errno == EADDRINUSE)
+	{
+		int probe = socket(AF_UNIX, SOCK_STREAM, 0);
+		bool served = connect(probe, (sockaddr *)&address, sizeof(address)) == 0;
+		close(probe);
+		if (!served) unlink(path.c_str());
+		if (served || bind(server.listener, (sockaddr *)&address, sizeof(address)))
+		{
+			cerr << "failed to bind socket " << path << endl;
+			return 1;
+		}
+	}
+	if (listen(server.listener, SOMAXCONN))
+	{
+		cerr << "failed to listen on socket " << path << endl;
+		return 1;
+	}
+	fcntl(server.listener, F_SETFL, O_NONBLOCK);
+
+	server.epoll = epoll_create(1);
+	server.arm(EPOLL_CTL_ADD, server.listener, 0);
+
+	signal(SIGINT,  stop);
+	signal(SIGTERM, stop);
+	signal(SIGPIPE, SIG_IGN);
+
+	vector<pthread_t> pool(threads);
+	for (int i = 0; i != threads; i ++)
+		pthread_create(&pool[i], 0, Server<ContainerT, RespondT>::run, &server);
+	for (int tick = 1; !stopping; tick ++)
+	{
+		usleep(100000);
+		if (tick % 10 == 0) container.reload();
+	}
+	for (int i = 0; i != threads; i ++)
+		pthread_join(pool[i], 0);
+
+	close(server.epoll);
+	close(server.listener);
+	unlink(path.c_str());
+
+	cerr << latencies.json() << endl;
+
+	return 0;
+}
+
+// scan documents for the keys of a Trie (--scan): all matches at every
+// offset, or the longest match leftmost first without overlaps, for
+// segmentation; chunks of a document are scanned by a pool of threads, each
+// owning the matches beginning in it, which may end past it, and their
+// records are written in order
+
+// a stream buffer that appends to a string
+
+class StringBuf : public streambuf
+{
+public:
+	StringBuf(string &text) : m_text(text) {}
+
+protected:
+	int overflow(int c)
+	{
+		if (c != traits_type::eof()) m_text.push_back((char)c);
+		return c;
+	}
+
+	streamsize xsputn(const char *s, streamsize n)
+	{
+		m_text.append(s, n);
+		return n;
+	}
+
+private:
+	string &m_text;
+};
+
+struct ScanMatch
+{
+	size_t begin;  // offset of the match in the document
+	size_t end;
+	size_t record; // offset of its record in the text of its chunk
+};
+
+template <class ContainerT, class CharT, class PutterT>
+class Scanner
+{
+public:
+	typedef typename ContainerT::value_type value_type;
+
+	enum { CHUNK = 4 << 20 }; // bytes of a chunk
+
+	Scanner(const ContainerT &container, bool longest, int threads)
+			: m_container(container), m_longest(longest), m_threads(threads),
+			  m_bytes(0), m_matches(0) {}
+
+	// write the records of matches in [begin, end) to out, each the name of
+	// the document if not empty, the offset in characters, then the key and
+	// the value as the Trie is printed
+	void scan(const char *begin, const char *end, const string &name, ostream &out)
+	{
+		m_begin = (const CharT *)begin;
+		m_end   = m_begin + (end - begin) / sizeof(CharT);
+		m_name  = name;
+
+		size_t chunk = CHUNK / sizeof(CharT);
+		size_t next = 0; // where the parse of longest matches enters the next chunk
+
+		for (const CharT *p = m_begin; p != m_end; )
+		{
+			// a round of chunks, several for each thread to balance them
+			m_chunks.clear();
+			for (int i = 0; i != m_threads * 4 && p != m_end; i ++)
+			{
+				m_chunks.push_back(Chunk());
+				m_chunks.back().begin = p;
+				p += min(chunk, (size_t)(m_end - p));
+				m_chunks.back().end = p;
+			}
+
+			m_next = 0;
+			if (m_threads > 1 && m_chunks.size() > 1)
+			{
+				vector<pthread_t> pool(min((size_t)m_threads, m_chunks.size()));
+				for (size_t i = 0; i != pool.size(); i ++)
+					pthread_create(&pool[i], 0, run, this);
+				for (size_t i = 0; i != pool.size(); i ++)
+					pthread_join(pool[i], 0);
+			}
+			else run(this);
+
+			for (size_t i = 0; i != m_chunks.size(); i ++)
+			{
+				Chunk &c = m_chunks[i];
+				size_t first = 0;
+
+				if (m_longest) next = resume(c, next, out, first);
+
+				size_t record = first == c.matches.size() ? c.text.size() : c.matches[first].record;
+				out.write(c.text.data() + record, c.text.size() - record);
+				m_matches += c.matches.size() - first;
+			}
+		}
+
+		m_bytes += end - begin;
+	}
+
+	// bytes scanned and matches written so far, and the throughput
+	void json(ostream &out, double seconds) const
+	{
+		out << "{\\"bytes\\": " << m_bytes << ", \\"matches\\": " << m_matches
+				<< ", \\"seconds\\": " << seconds << ", \\"mb_per_second\\": "
+				<< (seconds > 0 ? m_bytes / 1048576.0 / seconds : 0) << "}" << endl;
+	}
+
+private:
+	struct Chunk
+	{
+		const CharT *begin;
+		const CharT *end;
+		vector<ScanMatch> matches;
+		string text;
+		size_t next; // where the parse of longest matches of the chunk leaves it
+	};
+
+	// matches of the keys beginning at an offset, grown as needed
+	struct Matches
+	{
+		Matches() : size(0), ranges(0), values(0) {}
+		~Matches() { delete [] ranges; delete [] values; }
+
+		uint32_t find(const ContainerT &container, const CharT *key, const CharT *keyEnd)
+		{
+			for (;;)
+			{
+				uint32_t numMatches = container.matchBeginning(key, keyEnd, size, ranges, values);
+				if (numMatches < size) return numMatches;
+
+				delete [] ranges;
+				delete [] values;
+				size = max(size * 2, (uint32_t)64);
+				ranges = new Range<CharT>[size];
+				values = new value_type[size];
+			}
+		}
+
+		// the longest match, or -1 if none but the empty key
+		int longest(uint32_t numMatches) const
+		{
+			return numMatches && ranges[numMatches - 1].begin != ranges[numMatches - 1].end
+					? numMatches - 1 : -1;
+		}
+
+		uint32_t size;
+		Range<CharT> *ranges;
+		value_type *values;
+	};
+
+	static void *run(void *arg)
+	{
+		Scanner &scanner = *(Scanner *)arg;
+
+		for (size_t i; (i = __sync_fetch_and_add(&scanner.m_next, 1)) < scanner.m_chunks.size(); )
+			scanner.scanChunk(scanner.m_chunks[i]);
+
+		return 0;
+	}
+
+	void scanChunk(Chunk &c)
+	{
+		Matches matches;
+		StringBuf buf(c.text);
+		ostream out(&buf);
+
+		const CharT *p = c.begin;
+		while (p < c.end)
+		{
+			uint32_t numMatches = matches.find(m_container, p, m_end);
+
+			if (!m_longest)
+			{
+				for (uint32_t j = 0; j != numMatches; j ++)
+					if (matches.ranges[j].begin != matches.ranges[j].end)
+						put(c, out, matches.ranges[j], &matches.values[j]);
+				p ++;
+			}
+			else if (matches.longest(numMatches) >= 0)
+			{
+				int j = matches.longest(numMatches);
+				put(c, out, matches.ranges[j], &matches.values[j]);
+				p = matches.ranges[j].end;
+			}
+			else p ++;
+		}
+
+		c.next = p - m_begin;
+	}
+
+	void put(Chunk &c, ostream &out, const Range<CharT> &range, const value_type *value)
+	{
+		ScanMatch match = { (size_t)(range.begin - m_begin), (size_t)(range.end - m_begin),
+				c.text.size() };
+		c.matches.push_back(match);
+
+		if (!m_name.empty())
+		{
+			out.rdbuf()->sputn(m_name.data(), m_name.size());
+			out.rdbuf()->sputc('\\t');
+		}
+		putInteger(out, (uint64_t)match.begin);
+		out.rdbuf()->sputc('\\t');
+
+		PutterT putter(out);
+		putter(range.begin, range.end, value);
+	}
+
+	// the parse of longest matches of a chunk began at its beginning, so it
+	// agrees with the parse entering it at next from the first offset after
+	// next where it stood, outside its matches: redo the parse up to there,
+	// and return where it leaves the chunk, with the first match kept
+	size_t resume(Chunk &c, size_t next, ostream &out, size_t &first)
+	{
+		Chunk redo;
+		StringBuf buf(redo.text);
+		ostream text(&buf);
+		Matches matches;
+
+		size_t end = c.end - m_begin;
+
+		for (;;)
+		{
+			while (first != c.matches.size() && c.matches[first].end <= next) first ++;
+
+			if (first == c.matches.size() || c.matches[first].begin >= next)
+			{
+				if (next < end) next = c.next;
+				else first = c.matches.size();
+				break;
+			}
+			if (next >= end)
+			{
+				first = c.matches.size();
+				break;
+			}
+
+			uint32_t numMatches = matches.find(m_container, m_begin + next, m_end);
+			int j = matches.longest(numMatches);
+			if (j >= 0)
+			{
+				put(redo, text, matches.ranges[j], &matches.values[j]);
+				next = matches.ranges[j].end - m_begin;
+			}
+			else next ++;
+		}
+
+		out.write(redo.text.data(), redo.text.size());
+		m_matches += redo.matches.size();
+
+		return next;
+	}
+
+	ContainerT m_container;
+	bool m_longest;
+	int m_threads;
+
+	const CharT *m_begin;
+	const CharT *m_end;
+	string m_name;
+
+	vector<Chunk> m_chunks;
+	size_t m_next; // the next chunk for a thread to scan
+
+	uint64_t m_bytes;
+	uint64_t m_matches;
+};
+
+// a stream buffer that counts bytes written through it to another one
+
+class CountingBuf : public streambuf
+{
+public:
+	CountingBuf(streambuf *to) : m_to(to), m_count(0) { setp(m_buffer, m_buffer + sizeof(m_buffer)); }
+	~CountingBuf() { sync(); }
+
+	size_t count() const { return m_count + (pptr() - pbase()); }
+
+protected:
+	int overflow(int c)
+	{
+		if (drain() < 0) return traits_type::eof();
+		if (c == traits_type::eof()) return traits_type::not_eof(c);
+		*pptr() = c; pbump(1);
+		return c;
+	}
+
+	int sync() { return drain() < 0 ? -1 : m_to->pubsync(); }
+
+	// pass the buffer on, leaving m_to to buffer it too
+	int drain()
+	{
+		streamsize n = pptr() - pbase();
+		if (n && m_to->sputn(pbase(), n) != n) return -1;
+		m_count += n;
+		setp(m_buffer, m_buffer + sizeof(m_buffer));
+		return 0;
+	}
+
+private:
+	streambuf *m_to;
+	size_t m_count;
+	char m_buffer[65536];
+};
+
+// output of building to a file (-o): written in large blocks by pwrite to a
+// temporary file beside it, which is synced and renamed over the file only
+// when the build succeeds, and removed otherwise
+
+class OutputFile : public streambuf
+{
+public:
+	OutputFile() : m_stream(0), m_original(0), m_fd(-1), m_offset(0), m_failed(false),
+			m_buffer(1 << 22) { setp(&m_buffer[0], &m_buffer[0] + m_buffer.size()); }
+	~OutputFile() { abandon(); }
+
+	// create the temporary file, and redirect stream to it
+	bool open(const string &path, ostream &stream)
+	{
+		m_path = path;
+		m_temp = path + ".XXXXXX";
+		m_fd = mkstemp(&m_temp[0]);
+		if (m_fd < 0) return false;
+
+		// as created by a shell redirection, not 0600 of mkstemp
+		mode_t mask = umask(0);
+		umask(mask);
+		fchmod(m_fd, 0666 & ~mask);
+
+		m_stream = &stream;
+		m_original = stream.rdbuf(this);
+		return true;
+	}
+
+	// write the rest, sync the file and rename it over path
+	bool commit()
+	{
+		m_stream->flush();
+		m_stream->rdbuf(m_original);
+		m_stream = 0;
+
+		if (sync() < 0 || m_failed || fsync(m_fd))
+		{
+			abandon();
+			return false;
+		}
+
+		close(m_fd);
+		m_fd = -1;
+
+		if (rename(m_temp.c_str(), m_path.c_str()))
+		{
+			unlink(m_temp.c_str());
+			return false;
+		}
+
+		// sync the directory too, for the rename to last
+		size_t slash = m_path.rfind('/');
+		string directory = slash == string::npos ? "." : m_path.substr(0, max(slash, (size_t)1));
+		int fd = ::open(directory.c_str(), O_RDONLY);
+		if (fd >= 0)
+		{
+			fsync(fd);
+			close(fd);
+		}
+
+		return true;
+	}
+
+protected:
+	int overflow(int c)
+	{
+		if (sync() < 0) return traits_type::eof();
+		if (c == traits_type::eof()) return traits_type::not_eof(c);
+		*pptr() = c; pbump(1);
+		return c;
+	}
+
+	int sync()
+	{
+		bool written = write(pbase(), pptr() - pbase());
+		setp(&m_buffer[0], &m_buffer[0] + m_buffer.size());
+		return written ? 0 : -1;
+	}
+
+	// blocks as large as the buffer, e.g. arrays of values, go to the file
+	// as they are, without a copy
+	streamsize xsputn(const char *s, streamsize n)
+	{
+		if (n > epptr() - pptr())
+		{
+			if (sync() < 0) return 0;
+			if (n >= (streamsize)m_buffer.size()) return write(s, n) ? n : 0;
+		}
+
+		memcpy(pptr(), s, n);
+		pbump(n);
+		return n;
+	}
+
+private:
+	bool write(const char *s, size_t n)
+	{
+		while (n && !m_failed)
+		{
+			ssize_t size = pwrite(m_fd, s, n, m_offset);
+			if (size < 0 && errno == EINTR) continue;
+			if (size <= 0) m_failed = true;
+			else
+			{
+				s += size;
+				n -= size;
+				m_offset += size;
+			}
+		}
+
+		return !m_failed;
+	}
+
+	void abandon()
+	{
+		if (m_stream) m_stream->rdbuf(m_original);
+		m_stream = 0;
+
+		if (m_fd < 0) return;
+		close(m_fd);
+		unlink(m_temp.c_str());
+		m_fd = -1;
+	}
+
+	ostream     *m_stream;
+	streambuf   *m_original;
+	string       m_path;
+	string       m_temp;
+	int          m_fd;
+	off_t        m_offset;
+	bool         m_failed;
+	vector<char> m_buffer;
+};
+
+// stdout in large blocks by write, unless building to a file (-o), instead
+// of through stdio synced with cout a few bytes at a time
+
+class BlockBuf : public streambuf
+{
+public:
+	BlockBuf() : m_stream(0), m_original(0), m_fd(-1), m_buffer(1 << 20)
+			{ setp(&m_buffer[0], &m_buffer[0] + m_buffer.size()); }
+	~BlockBuf()
+	{
+		if (!m_stream) return;
+		m_stream->flush();
+		sync();
+		m_stream->rdbuf(m_original);
+	}
+
+	// write to fd, and redirect stream to it
+	void open(int fd, ostream &stream)
+	{
+		m_fd = fd;
+		m_stream = &stream;
+		m_original = stream.rdbuf(this);
+	}
+
+protected:
+	int overflow(int c)
+	{
+		if (sync() < 0) return traits_type::eof();
+		if (c == traits_type::eof()) return traits_type::not_eof(c);
+		*pptr() = c; pbump(1);
+		return c;
+	}
+
+	int sync()
+	{
+		bool written = write(pbase(), pptr() - pbase());
+		setp(&m_buffer[0], &m_buffer[0] + m_buffer.size());
+		return written ? 0 : -1;
+	}
+
+	streamsize xsputn(const char *s, streamsize n)
+	{
+		if (n > epptr() - pptr())
+		{
+			if (sync() < 0) return 0;
+			if (n >= (streamsize)m_buffer.size()) return write(s, n) ? n : 0;
+		}
+
+		memcpy(pptr(), s, n);
+		pbump(n);
+		return n;
+	}
+
+private:
+	bool write(const char *s, size_t n)
+	{
+		while (n)
+		{
+			ssize_t size = ::write(m_fd, s, n);
+			if (size < 0 && errno == EINTR) continue;
+			if (size <= 0) return false;
+			s += size;
+			n -= size;
+		}
+
+		return true;
+	}
+
+	ostream     *m_stream;
+	streambuf   *m_original;
+	int          m_fd;
+	vector<char> m_buffer;
+};
+
+// input of building (stdin) mapped in memory when it is a regular file, or
+// read in large blocks otherwise, or under a memory limit, as the pages of a
+// mapping stay resident once read, so that getline scans the buffer for the
+// separator by memchr, instead of a character at a time from stdio
+
+class InputFile : public streambuf
+{
+public:
+	InputFile() : m_stream(0), m_original(0), m_fd(-1), m_map(0), m_size(0) {}
+	~InputFile()
+	{
+		if (m_stream) m_stream->rdbuf(m_original);
+		if (m_map) munmap(m_map, m_size);
+	}
+
+	// read fd from its offset, mapped if mapping, and redirect stream to it
+	void open(int fd, istream &stream, bool mapping = true)
+	{
+		m_fd = fd;
+
+		struct stat st;
+		off_t offset = lseek(fd, 0, SEEK_CUR);
+		if (mapping && fstat(fd, &st) == 0 && S_ISREG(st.st_mode) && offset >= 0 && offset < st.st_size)
+		{
+			void *map = mmap(0, st.st_size, PROT_READ, MAP_PRIVATE, fd, 0);
+			if (map != MAP_FAILED)
+			{
+				m_map = map;
+				m_size = st.st_size;
+				madvise(m_map, m_size, MADV_SEQUENTIAL);
+				setg((char *)m_map, (char *)m_map + offset, (char *)m_map + m_size);
+			}
+		}
+
+		if (!m_map)
+		{
+			m_buffer.resize(1 << 20);
+			setg(&m_buffer[0], &m_buffer[1], &m_buffer[1]);
+		}
+
+		m_stream = &stream;
+		m_original = stream.rdbuf(this);
+	}
+
+	// the rest of input at once, [begin, end) of the mapping itself, or of
+	// copy read in
+	void rest(string &copy, const char *&begin, const char *&end)
+	{
+		if (!m_map)
+		{
+			copy.assign(istreambuf_iterator<char>(this), istreambuf_iterator<char>());
+			begin = copy.data();
+			end = begin + copy.size();
+			return;
+		}
+
+		begin = gptr();
+		end = egptr();
+		setg(egptr(), egptr(), egptr());
+	}
+
+protected:
+	// keep the last character before the next block, for unget()
+	int underflow()
+	{
+		if (gptr() < egptr()) return traits_type::to_int_type(*gptr());
+		if (m_map) return traits_type::eof();
+
+		m_buffer[0] = egptr()[-1];
+
+		ssize_t size;
+		do size = read(m_fd, &m_buffer[1], m_buffer.size() - 1);
+		while (size < 0 && errno == EINTR);
+		if (size <= 0) return traits_type::eof();
+
+		setg(&m_buffer[0], &m_buffer[1], &m_buffer[1] + size);
+		return traits_type::to_int_type(*gptr());
+	}
+
+private:
+	istream     *m_stream;
+	streambuf   *m_original;
+	int          m_fd;
+	void        *m_map;
+	size_t       m_size;
+	vector<char> m_buffer;
+};
+
+// statistics of building for --stats: phases of each build_N and of each
+// container built, timed by the innermost one running, so that no time is
+// counted twice, and structure of each container
+
+class Stats : public BuildObserver
+{
+public:
+	Stats() : m_counter(0), m_original(0), m_start(0), m_last(0) {}
+
+	// time from now on, and count bytes written to cout
+	void start()
+	{
+		m_counter = new CountingBuf(cout.rdbuf());
+		m_original = cout.rdbuf(m_counter);
+		m_start = m_last = now();
+		buildObserver() = this;
+	}
+
+	void beginBuild(int n) { if (m_counter) enter("build", n); }
+	void endBuild() { if (m_counter) leave(); }
+
+	virtual void begin(const char *kind)
+	{
+		enter(kind, m_frames.empty() ? -1 : m_records[m_frames.back()].build);
+	}
+
+	virtual void phase(const char *name)
+	{
+		if (m_frames.empty()) return;
+
+		charge();
+		Record &r = m_records[m_frames.back()];
+		closePhase(r);
+		r.phase = name;
+		r.phaseBytes = m_counter->count();
+		if (r.seconds.find(r.phase) == r.seconds.end()) r.phases.push_back(r.phase);
+		r.seconds[r.phase] += 0;
+	}
+
+	virtual void count(const char *name, double value)
+	{
+		if (!m_frames.empty())
+			m_records[m_frames.back()].counts.push_back(make_pair(string(name), value));
+	}
+
+	virtual void end() { leave(); }
+
+	// stop, and write the statistics in JSON to a file
+	int write(const string &filename)
+	{
+		double seconds = now() - m_start;
+
+		cout.flush();
+		cout.rdbuf(m_original);
+		size_t bytes = m_counter->count();
+		delete m_counter; m_counter = 0;
+		buildObserver() = 0;
+
+		ofstream out(filename.c_str());
+		out.precision(15);
+
+		out << "{\\"seconds\\": " << seconds << ", \\"peak_rss_kb\\": " << peakRss()
+				<< ", \\"output_bytes\\": " << bytes << ",\\n \\"builds\\": [";
+
+		for (size_t i = 0, k = 0; i != m_records.size(); i ++)
+		{
+			const Record &b = m_records[i];
+			if (b.kind != "build") continue;
+
+			// phases of the build itself and of its containers
+			vector<string> phases(b.phases);
+			map<string, double> total(b.seconds);
+			for (size_t j = 0; j != m_records.size(); j ++)
+			{
+				const Record &r = m_records[j];
+				if (r.kind == "build" || r.build != b.build) continue;
+				for (size_t p = 0; p != r.phases.size(); p ++)
+				{
+					if (total.find(r.phases[p]) == total.end()) phases.push_back(r.phases[p]);
+					total[r.phases[p]] += r.seconds.find(r.phases[p])->second;
+				}
+			}
+
+			out << (k ++ ? ",\\n  " : "\\n  ") << "{\\"build\\": " << b.build;
+			for (size_t p = 0; p != phases.size(); p ++)
+				out << ", \\"" << phases[p] << "_seconds\\": " << total[phases[p]];
+			out << ", \\"peak_rss_kb\\": " << b.peakRss << "}";
+		}
+
+		out << "],\\n \\"containers\\": [";
+
+		for (size_t i = 0, k = 0; i != m_records.size(); i ++)
+		{
+			const Record &r = m_records[i];
+			if (r.kind == "build") continue;
+
+			out << (k ++ ? ",\\n  " : "\\n  ") << "{\\"kind\\": \\"" << r.kind
+					<< "\\", \\"build\\": " << r.build << ", \\"depth\\": " << r.depth;
+			for (size_t c = 0; c != r.counts.size(); c ++)
+				out << ", \\"" << r.counts[c].first << "\\": " << r.counts[c].second;
+			for (size_t p = 0; p != r.phases.size(); p ++)
+				out << ", \\"" << r.phases[p] << "_seconds\\": "
+						<< r.seconds.find(r.phases[p])->second
+						<< ", \\"" << r.phases[p] << "_bytes\\": "
+						<< r.bytes.find(r.phases[p])->second;
+			out << ", \\"bytes\\": " << r.totalBytes << "}";
+		}
+
+		out << "]}" << endl;
+
+		return out.fail();
+	}
+
+private:
+	struct Record
+	{
+		string kind;
+		int build;
+		size_t depth;
+
+		string phase;      // current phase
+		size_t phaseBytes; // bytes written when the current phase began
+		size_t startBytes; // bytes written when the record began
+		size_t totalBytes;
+		long peakRss;
+
+		vector<string> phases; // in order of entering
+		map<string, double> seconds;
+		map<string, double> bytes;
+		vector<pair<string, double> > counts;
+	};
+
+	void enter(const char *kind, int build)
+	{
+		charge();
+
+		Record r;
+		r.kind = kind;
+		r.build = build;
+		r.depth = 0;
+		for (size_t i = 0; i != m_frames.size(); i ++)
+			r.depth += m_records[m_frames[i]].kind != "build";
+		r.phaseBytes = r.startBytes = m_counter->count();
+		r.totalBytes = 0;
+		r.peakRss = 0;
+
+		m_frames.push_back(m_records.size());
+		m_records.push_back(r);
+	}
+
+	void leave()
+	{
+		if (m_frames.empty()) return;
+
+		charge();
+		Record &r = m_records[m_frames.back()];
+		closePhase(r);
+		r.phase.clear();
+		r.totalBytes = m_counter->count() - r.startBytes;
+		r.peakRss = peakRss();
+
+		m_frames.pop_back();
+	}
+
+	// time since the last event goes to the current phase of the innermost
+	void charge()
+	{
+		double t = now();
+		if (!m_frames.empty())
+		{
+			Record &r = m_records[m_frames.back()];
+			if (!r.phase.empty()) r.seconds[r.phase] += t - m_last;
+		}
+		m_last = t;
+	}
+
+	// bytes of a phase include those of containers nested in it
+	void closePhase(Record &r)
+	{
+		if (!r.phase.empty()) r.bytes[r.phase] += m_counter->count() - r.phaseBytes;
+	}
+
+	static long peakRss()
+	{
+		rusage usage;
+		getrusage(RUSAGE_SELF, &usage);
+		return usage.ru_maxrss;
+	}
+
+	CountingBuf *m_counter;
+	streambuf *m_original;
+	double m_start;
+	double m_last;
+
+	vector<Record> m_records;
+	vector<size_t> m_frames; // records being built, innermost last
+};
+
+Stats stats;
+
+// a build_N in the statistics, from parsing its input until returning
+
+struct StatsBuild
+{
+	StatsBuild(int n) { stats.beginBuild(n); stats.phase("parse"); }
+	~StatsBuild() { stats.endBuild(); }
+};
+
+// temporary directory
+
+string tmpdir;
+
+// input keys are sorted and uniqued
+
+bool sorted = false;
+
+// number of parallel jobs for building
+
+int jobs = 1;
+
+// memory limit of building in bytes (-M), 0 for none
+
+size_t memoryLimit = 0;
+
+// external sort for building with a memory limit: records are sorted by key
+// in runs of about memoryLimit bytes on disk, then runs are merged in key
+// order, at most maxRuns at a time, keeping the last record of equal keys as
+// std::map does, into the files of consecutive key ranges built one by one
+
+const size_t maxRuns = 64;
+
+template <class CharT>
+struct RunRecord
+{
+	vector<CharT> key;
+	string        record;
+
+	bool operator <(const RunRecord &x) const { return key < x.key; }
+};
+
+// a run on disk, each record a uint32_t length of its key in characters, a
+// uint32_t length of its text, the key and the text
+
+template <class CharT>
+struct RunWriter
+{
+	RunWriter(const string &name) : out(name.c_str(), ios::out | ios::trunc | ios::binary) {}
+
+	void operator ()(const vector<CharT> &key, const string &record)
+	{
+		uint32_t sizes[2] = { (uint32_t)key.size(), (uint32_t)record.size() };
+
+		out.write((const char *)sizes, sizeof(sizes));
+		if (!key.empty()) out.write((const char *)&key[0], key.size() * sizeof(CharT));
+		out.write(record.data(), record.size());
+	}
+
+	ofstream out;
+};
+
+template <class CharT>
+struct RunReader
+{
+	RunReader(const string &name, size_t index)
+			: in(name.c_str(), ios::in | ios::binary), index(index) {}
+
+	// read the next record, return false at the end
+	bool next()
+	{
+		uint32_t sizes[2];
+		if (!in.read((char *)sizes, sizeof(sizes))) return false;
+
+		record.key.resize(sizes[0]);
+		record.record.resize(sizes[1]);
+		if (sizes[0]) in.read((char *)&record.key[0], sizes[0] * sizeof(CharT));
+		if (sizes[1]) in.read(&record.record[0], sizes[1]);
+
+		return true;
+	}
+
+	// for a priority_queue of the least key first, then of the first run
+	struct After
+	{
+		bool operator ()(const RunReader *x, const RunReader *y) const
+		{
+			return y->record < x->record || (!(x->record < y->record) && y->index < x->index);
+		}
+	};
+
+	ifstream      in;
+	size_t        index;
+	RunRecord<CharT> record;
+};
+
+string runName(const string &prefix)
+{
+	static size_t count = 0;
+
+	ostringstream os;
+	os << prefix << "-run-" << count ++;
+	return os.str();
+}
+
+// sort records of memory into a new run, and clear them
+
+template <class CharT>
+string sortRun(vector<RunRecord<CharT> > &records, const string &prefix)
+{
+	string name = runName(prefix);
+
+	stable_sort(records.begin(), records.end());
+
+	RunWriter<CharT> run(name);
+	for (size_t i = 0; i != records.size(); i ++)
+		run(records[i].key, records[i].record);
+
+	records.clear();
+
+	return name;
+}
+
+// merge runs at once into put, and remove them
+
+template <class CharT, class PutT>
+void mergeRunsOnce(const vector<string> &names, PutT &put)
+{
+	vector<RunReader<CharT> *> runs;
+	priority_queue<RunReader<CharT> *, vector<RunReader<CharT> *>,
+			typename RunReader<CharT>::After> heap;
+
+	for (size_t i = 0; i != names.size(); i ++)
+	{
+		runs.push_back(new RunReader<CharT>(names[i], i));
+		if (runs.back()->next()) heap.push(runs.back());
+	}
+
+	RunRecord<CharT> last;
+	bool pending = false;
+
+	while (!heap.empty())
+	{
+		RunReader<CharT> *run = heap.top();
+		heap.pop();
+
+		if (pending && last.key != run->record.key) put(last.key, last.record);
+
+		last.key.swap(run->record.key);
+		last.record.swap(run->record.record);
+		pending = true;
+
+		if (run->next()) heap.push(run);
+	}
+
+	if (pending) put(last.key, last.record);
+
+	for (size_t i = 0; i != runs.size(); i ++)
+	{
+		delete runs[i];
+		unlink(names[i].c_str());
+	}
+}
+
+// merge runs into put, consecutive ones first while too many to open at once
+
+template <class CharT, class PutT>
+void mergeRuns(vector<string> names, const string &prefix, PutT &put)
+{
+	while (names.size() > maxRuns)
+	{
+		vector<string> merged;
+
+		for (size_t i = 0; i < names.size(); i += maxRuns)
+		{
+			merged.push_back(runName(prefix));
+
+			RunWriter<CharT> run(merged.back());
+			mergeRunsOnce<CharT>(vector<string>(names.begin() + i,
+					names.begin() + min(i + maxRuns, names.size())), run);
+		}
+
+		names.swap(merged);
 	}
-	result.push_back(source.substr(prev_pos));
 
-	return result;
+	mergeRunsOnce<CharT>(names, put);
 }
 
-istream &getUtf16(istream &in, uint16_t &utf16)
+// write merged records into shards of about limit bytes of records, split
+// between any keys, as stitching joins tries below prefixes they share, and
+// build each by worker in turn
+
+template <class CharT>
+struct ShardWriter
 {
-	const uint16_t replacementChar = 0xFFFD;
+	ShardWriter(const string &prefix, const string &sep, size_t limit,
+			int (*worker)(istream &in, const string &name))
+			: prefix(prefix), sep(sep), limit(limit), worker(worker), out(0), bytes(0) {}
 
-	uint16_t result = (uint8_t)in.get(); if (!in) return in;
+	~ShardWriter() { delete out; }
 
-	if      (result < 0x80) ;
-	else if (result < 0xC2) // unexpected continuation byte or overlong
-		result = replacementChar;
-	else if (result < 0xE0) // 2 bytes
+	void operator ()(const vector<CharT> &, const string &record)
 	{
-		result = (result & 0x1F) << 6;
+		if (out && bytes >= limit) close();
+		if (!out) open();
 
-		uint16_t next = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
-		result |= (next & 0x3F);
+		*out << record << sep;
+		bytes += record.size() + sep.size();
 	}
-	else if (result < 0xF0) // 3 bytes
+
+	void open()
 	{
-		result = (result & 0xF) << 12;
+		ostringstream os;
+		os << prefix << "-shard-" << names.size();
+		names.push_back(os.str());
 
-		uint16_t next = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
-		result |= (next & 0x3F) << 6;
+		out = new ofstream(names.back().c_str(), ios::out | ios::trunc);
+		bytes = 0;
+	}
 
-		next          = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
-		result |= (next & 0x3F);
+	// build the shard in a child process, for its memory to be freed after
+	void close()
+	{
+		delete out;
+		out = 0;
 
-		if (result < 0x800) result = replacementChar; // overlong
+		cout.flush();
+
+		int status = 0;
+		pid_t pid = fork();
+		if (pid == 0)
+		{
+			ifstream shard(names.back().c_str());
+			_exit(worker(shard, names.back()));
+		}
+
+		if (pid < 0 || waitpid(pid, &status, 0) < 0
+				|| !WIFEXITED(status) || WEXITSTATUS(status))
+		{
+			cerr << "failed to build shards with a memory limit" << endl;
+			exit(pid > 0 && WIFEXITED(status) && WEXITSTATUS(status) == 3 ? 3 : 1);
+		}
+
+		unlink(names.back().c_str());
 	}
-	else if (result < 0xF8) // 4 bytes
+
+	// build the last shard, an empty one for no records, and return all
+	vector<string> finish()
 	{
-		uint16_t next = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
-		next          = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
-		next          = (uint8_t)in.get(); if (!in) return in;
-		if (next < 0x80 || next >= 0xC0) { utf16 = replacementChar; return in; }
+		if (!out) open();
+		close();
 
-		result = replacementChar; // not in UCS-2
+		return names;
 	}
-	else
-		result = replacementChar; // not in UTF-8 standard
 
-	utf16 = result; return in;
-}
+	string prefix;
+	string sep;
+	size_t limit;
+	int (*worker)(istream &in, const string &name);
 
-ostream &putUtf16(ostream &out, uint16_t utf16)
-{
-	if      (utf16 < 0x80 )
-		out << (char)(utf16);
-	else if (utf16 < 0x800)
-		out << (char)(utf16 >>  6 | 0xC0) << (char)(utf16 & 0x3F | 0x80);
-	else
-		out << (char)(utf16 >> 12        | 0xE0)
-				<< (char)(utf16 >>  6 & 0x3F | 0x80)
-				<< (char)(utf16       & 0x3F | 0x80);
+	ofstream *out;
+	size_t bytes;
+	vector<string> names;
+};
 
-	return out;
-}
+// generated structs and functions
 
-istream &getline(istream &in, string &line, const string &delimiter)
+""" + container.code + """\
+""" + ("key" in container.m.groupdict() and """\
+""" + (container.type[0] == 'T' and """\
+// write keys and values walked to a result in records
+
+struct Framer
 {
-	if (delimiter.empty()) return getline(in, line);
+	string &out;
 
-	getline(in, line, delimiter[delimiter.size() - 1]);
-	while (delimiter.size() > line.size() && line.size()
-			|| delimiter.size() > 1 && strcmp(delimiter.c_str(),
-			line.c_str() + line.size() - delimiter.size() + 1))
+	Framer(string &out) : out(out) {}
+
+	template <class CharT, class IteratorT>
+	void operator ()(const CharT *keyBegin, const CharT *keyEnd, IteratorT it) const
 	{
-		line += delimiter[delimiter.size() - 1];
-		getline(in, line, delimiter[delimiter.size() - 1]);
+		ostringstream os;
+		Putter_0::putKey(os, keyBegin, keyEnd);
+		putRecord(out, os.str());
+""" + ("sub" in container.m.groupdict() and """\
+
+		os.str("");
+		Putter_0::putValue(os, it);
+		putRecord(out, os.str());
+""" or "") + """\
 	}
-	if (delimiter.size() > 1)
-		line.resize(line.size() - delimiter.size() + 1);
+};
 
-	return in;
-}
+""" or "") + """\
+// answer requests to out (-P and -U), looking up the keys to find at once
 
-inline void skip(istream &in, const char *separator)
+void respond(const Container<""" + container.type + """>::value_type &container,
+		const vector<Request> &requests, vector<char> &out)
 {
-	for (const char *p = separator; *p; p ++)
-		if (in.get() != *p) { in.unget(); break; }
+	typedef Container<""" + container.type + """>::value_type::const_iterator const_iterator;
+	typedef Container<""" + container.key.type + """>::std_value_type key_type;
+""" + (container.type[0] == 'T' and """\
+	typedef Container<""" + container.type + """>::value_type::value_type value_type;
+	typedef Container<""" + container.type + """>::std_value_type::key_type::value_type char_type;
+""" or "") + """\
+
+	vector<key_type> keys(requests.size()), finds;
+	vector<char> valid(requests.size());
+	vector<const_iterator> results;
+	string result;
+
+	for (size_t i = 0; i != requests.size(); i ++)
+	{
+		const string &key = requests[i].key;
+		valid[i] = get_1(key.data(), key.data() + key.size(), keys[i]) == 0;
+		if (valid[i] && requests[i].operation == FRAME_FIND) finds.push_back(keys[i]);
+	}
+
+	results.resize(finds.size());
+	if (!finds.empty()) container.findMany(&finds[0], finds.size(), &results[0]);
+
+	for (size_t i = 0, j = 0; i != requests.size(); i ++)
+	{
+		const Request &request = requests[i];
+		result.clear();
+
+		if (request.operation == FRAME_FIND)
+		{
+			if (!valid[i] || results[j ++] == container.end())
+				putResponse(out, request.id, FRAME_MISS);
+			else
+			{
+""" + ("sub" in container.m.groupdict() and """\
+				ostringstream os;
+				put_2(os, """ + (container.type[0] == 'T' and "*results[j - 1]"
+						or "results[j - 1]->second") + """);
+				result = os.str();
+""" or "") + """\
+				putResponse(out, request.id, result);
+			}
+		}
+""" + (container.type[0] == 'T' and """\
+		else if (request.operation == FRAME_PREFIX && valid[i])
+		{
+			container.walk((const char_type *)range(keys[i]).begin,
+					(const char_type *)range(keys[i]).end, Framer(result));
+			putResponse(out, request.id, result);
+		}
+		else if (request.operation == FRAME_MATCH_ALL && valid[i])
+		{
+			// from each beginning, at most one match of each length
+			const char_type *begin = (const char_type *)range(keys[i]).begin;
+			const char_type *end   = (const char_type *)range(keys[i]).end;
+			vector<Range<char_type> > ranges(end - begin + 1);
+""" + ("sub" in container.m.groupdict() and """\
+			vector<value_type> values(end - begin + 1);
+""" or """\
+			value_type *values = 0; // not written for a set
+""") + """\
+			Framer framer(result);
+
+			for (const char_type *key = begin; ; key ++)
+			{
+				uint32_t numMatches = container.matchBeginning(
+						key, end, end - key + 1, &ranges[0], &values[0]);
+				for (uint32_t j = 0; j != numMatches; j ++)
+					framer(ranges[j].begin, ranges[j].end, &values[j]);
+				if (key == end) break;
+			}
+			putResponse(out, request.id, result);
+		}
+""" or "") + """\
+		else if (request.operation == FRAME_STATS)
+			putResponse(out, request.id, latencies.json());
+		else
+			putResponse(out, request.id, FRAME_ERROR);
+
+		latencies.add(request.operation, now() - request.start);
+	}
 }
 
-// temporary directory
+// answer requests from fd in to fd out until the end of input (-P), with
+// the container loaded again if its file is replaced, checked every second
 
-string tmpdir;
+int serve(Reloadable<Container<""" + container.type + """> > &container, int in, int out)
+{
+	vector<char> input(65536), output;
+	size_t end = 0;
+	vector<Request> requests;
+	double checked = now();
 
-// generated structs and functions
+	while (readRequests(in, input, end, requests))
+	{
+		if (now() - checked >= 1)
+		{
+			container.reload();
+			checked = now();
+		}
+
+		Reloadable<Container<""" + container.type + """> >::Reading reading(container);
+		respond((*reading)[0], requests, output);
+		requests.clear();
+		if (!writeAll(out, output)) return 1;
+		output.clear();
+	}
+
+	if (end)
+	{
+		cerr << "incomplete request at the end of input" << endl;
+		return 1;
+	}
+
+	return 0;
+}
 
-""" + container.code + """
+""" or "") + """\
+// residency policies of their names, separated by commas
+
+int residencyOf(const string &names)
+{
+	static const char *policies[] = {
+			"random", "sequential", "willneed", "hugepage", "mlock", "warmup" };
+	static const int advice[] = {
+			FT_RANDOM, FT_SEQUENTIAL, FT_WILLNEED, FT_HUGEPAGE, FT_MLOCK, FT_WARMUP };
+
+	int residency = 0;
+	for (size_t i = 0; i != sizeof(policies) / sizeof(policies[0]); i ++)
+		if (("," + names + ",").find("," + string(policies[i]) + ",") != string::npos)
+			residency |= advice[i];
+	return residency;
+}
 
 int main(int argc, char **argv)
 {
 	bool printing = false;
+	bool prefixing = false;
+	size_t limit  = (size_t)(-1);
+	bool benching = false;
+	bool piping   = false;
+	int residency = 0;
+	string socketPath;
+	string scanning;
+	string batching;
+	string statsFile;
+	string outputFile;
+	bool binary   = false;
 	bool last     = false;
 
 	vector<char *> args(argv + 1, argv + argc);
@@ -1313,56 +4349,334 @@ int main(int argc, char **argv)
 			args.erase(args.begin());
 		}
 		else if (args[0] == string("-p")) printing = true;
+		else if (args[0] == string("-r")) prefixing = true;
+		else if (args[0] == string("-l") && args.size() > 1)
+		{
+			limit = strtoull(args[1], 0, 10);
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-b")) benching = true;
+		else if (args[0] == string("-P")) piping   = true;
+		else if (args[0] == string("-U") && args.size() > 1)
+		{
+			socketPath = args[1];
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-m") && args.size() > 1)
+		{
+			scanning = args[1];
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-B") && args.size() > 1)
+		{
+			batching = args[1];
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-R") && args.size() > 1)
+		{
+			residency = residencyOf(args[1]);
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-s")) sorted   = true;
+		else if (args[0] == string("-C")) compatibleText = true;
+		else if (args[0] == string("-i") && args.size() > 1)
+		{
+			binary = args[1] == string("binary");
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-o") && args.size() > 1)
+		{
+			outputFile = args[1];
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-S") && args.size() > 1)
+		{
+			statsFile = args[1];
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-j") && args.size() > 1)
+		{
+			jobs = max(atoi(args[1]), 1);
+			args.erase(args.begin());
+		}
+		else if (args[0] == string("-M") && args.size() > 1)
+		{
+			memoryLimit = strtoull(args[1], 0, 10);
+			args.erase(args.begin());
+		}
 		else if (args[0] == string("--")) last     = true;
 
 		args.erase(args.begin());
 	}
 
-	if (args.empty())
+	// keys of -p and --prefix are read in blocks too, so that in_avail()
+	// tells keys already read in from those not yet typed, and cout is
+	// flushed by their loops rather than by every read of cin
+	InputFile input;
+	if (args.empty()) input.open(0, cin, !memoryLimit);
+	else if (printing || prefixing)
+	{
+		input.open(0, cin);
+		cin.tie(0);
+	}
+
+	BlockBuf block;
+	if (outputFile.empty()) block.open(1, cout);
+
+	OutputFile output;
+	if (args.empty() && !outputFile.empty() && !output.open(outputFile, cout))
+	{
+		cerr << "failed to create " << outputFile << endl;
+		return 1;
+	}
+
+	if (args.empty() && !statsFile.empty()) stats.start();
+
+	if (args.empty()) try
 	{
-		if (!tmpdir.empty())
+		if (binary)
+		{
+			StatsBuild statsBuild(0);
+			string copy;
+			const char *p, *end;
+
+			input.rest(copy, p, end);
+""" + (container.type[0] == 'T' and """\
+			if (sorted)
+			{
+				Container<""" + container.type + """>::sorted_value_type sorted_container;
+
+				if (read_0(p, end, sorted_container, false) || p != end)
+				{
+					cerr << "binary input is cut short or does not match the format" << endl;
+					return 1;
+				}
+
+				stats.phase("serialization");
+				Container<""" + container.type + """>::build(
+						ostreambuf_iterator<char>(cout), &sorted_container, &sorted_container + 1);
+			}
+			else
+""" or "") + """\
+			{
+				Container<""" + container.type + """>::std_value_type std_container;
+
+				if (read_0(p, end, std_container, false) || p != end)
+				{
+					cerr << "binary input is cut short or does not match the format" << endl;
+					return 1;
+				}
+
+				stats.phase("serialization");
+				Container<""" + container.type + """>::build(
+						ostreambuf_iterator<char>(cout), &std_container, &std_container + 1);
+			}
+		}
+		else if (!tmpdir.empty())
 		{
 			build_0(cin);
 		}
+""" + (container.type[0] == 'T' and """\
+		else if (sorted)
+		{
+			StatsBuild statsBuild(0);
+			Container<""" + container.type + """>::sorted_value_type sorted_container;
+
+			get_0(cin, sorted_container);
+
+			stats.phase("serialization");
+			Container<""" + container.type + """>::build(
+					ostreambuf_iterator<char>(cout), &sorted_container, &sorted_container + 1);
+		}
+""" or "") + """\
 		else
 		{
+			StatsBuild statsBuild(0);
 			Container<""" + container.type + """>::std_value_type std_container;
 
 			get_0(cin, std_container);
 
+			stats.phase("serialization");
 			Container<""" + container.type + """>::build(
 					ostreambuf_iterator<char>(cout), &std_container, &std_container + 1);
 		}
+
+		if (!statsFile.empty() && stats.write(statsFile))
+		{
+			cerr << "failed to write statistics to " << statsFile << endl;
+			return 1;
+		}
+
+		if (!outputFile.empty() && !output.commit())
+		{
+			cerr << "failed to write " << outputFile << endl;
+			return 1;
+		}
+	}
+	catch (int error)
+	{
+		return buildFailed(error);
 	}
 """ + ("key" in container.m.groupdict() and """\
-	else if (printing && !args.empty())
+	else if (piping && !args.empty())
+	{
+		Reloadable<Container<""" + container.type + """> > container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		return serve(container, 0, 1);
+	}
+	else if (!socketPath.empty() && !args.empty())
+	{
+		Reloadable<Container<""" + container.type + """> > container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		return serveSocket(container, respond, socketPath,
+				jobs > 1 ? jobs : max((int)sysconf(_SC_NPROCESSORS_ONLN), 1));
+	}
+""" + (container.type[0] == 'T' and container.m.group("key").lower() == "c*" and """\
+	else if (!scanning.empty() && !args.empty())
+	{
+		Container<""" + container.type + """> container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		typedef Container<""" + container.type + """>::std_value_type::key_type::value_type char_type;
+
+		Scanner<Container<""" + container.type + """>::value_type, char_type, Putter_0>
+				scanner(container[0], scanning == "longest",
+						jobs > 1 ? jobs : max((int)sysconf(_SC_NPROCESSORS_ONLN), 1));
+
+		// documents named when more than one, as grep does
+		double start = now();
+		for (size_t i = 1; i == 1 || i < args.size(); i ++)
+		{
+			int fd = i < args.size() ? open(args[i], O_RDONLY) : 0;
+			if (fd < 0)
+			{
+				cerr << "failed to open " << args[i] << endl;
+				return 1;
+			}
+
+			istream stream(0);
+			InputFile document;
+			string copy;
+			const char *begin, *end;
+
+			document.open(fd, stream);
+			document.rest(copy, begin, end);
+			scanner.scan(begin, end, args.size() > 2 ? args[i] : "", cout);
+			if (fd) close(fd);
+		}
+		cout.flush();
+
+		scanner.json(cerr, now() - start);
+	}
+""" or "") + """\
+	else if (!batching.empty() && !args.empty())
+	{
+		Container<""" + container.type + """> container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		return batch(container[0],
+				Container<""" + container.key.type + """>::std_value_type(), batching == "values");
+	}
+	else if (benching && !args.empty())
+	{
+		static const string sep = """ + '\"' + container.m.group("sep"
+				in container.m.groupdict() and "sep" or "keysep") + '\"' + """;
+
+		vector<Container<""" + container.key.type + """>::std_value_type> keys;
+		Container<""" + container.key.type + """>::std_value_type k;
+
+		string line;
+		while (getline(cin, line, sep))
+		{
+			if (get_1(line.data(), line.data() + line.size(), k) == 0) keys.push_back(k);
+		}
+
+		// loaded once the keys are read, to time loading and the first lookups
+		double start = now();
+		Container<""" + container.type + """> container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+		double loading = now() - start;
+
+		bench(container[0], keys, loading);
+	}
+""" + (container.type[0] == 'T' and """\
+	else if (prefixing && !args.empty())
 	{
 		static const string sep = """ + '\"' + container.m.group("sep"
 				in container.m.groupdict() and "sep" or "keysep") + '\"' + """;
 
-		Container<""" + container.type + """> container(args[0]);
+		Container<""" + container.type + """> container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		typedef Container<""" + container.type + """>::std_value_type::key_type::value_type char_type;
 
 		Container<""" + container.key.type + """>::std_value_type k;
 
+		// the keys under each prefix in order, located and walked by the Trie,
+		// then an empty record, flushed when no more prefixes are read in
 		string line;
 		while (getline(cin, line, sep))
 		{
-			istringstream isk(line);
-			if (get_1(isk, k) == 0)
+			if (get_1(line.data(), line.data() + line.size(), k) == 0)
+				container[0].walk((const char_type *)range(k).begin,
+						(const char_type *)range(k).end, Putter_0(cout), limit);
+			cout << sep;
+			if (cin.rdbuf()->in_avail() <= 0) cout.flush();
+		}
+	}
+""" or "") + """\
+	else if (printing && !args.empty())
+	{
+		static const string sep = """ + '\"' + container.m.group("sep"
+				in container.m.groupdict() and "sep" or "keysep") + '\"' + """;
+
+		Container<""" + container.type + """> container(
+				args[0], PROT_READ, MAP_SHARED, residency);
+
+		typedef Container<""" + container.type + """>::value_type::const_iterator const_iterator;
+
+		vector<Container<""" + container.key.type + """>::std_value_type> keys;
+		vector<const_iterator> results;
+		Container<""" + container.key.type + """>::std_value_type k;
+
+		// keys already read in are looked up at once, typed keys one by one
+		string line;
+		for (bool more = true; more; )
+		{
+			if (!getline(cin, line, sep)) more = false;
+			else
+			{
+				if (get_1(line.data(), line.data() + line.size(), k) == 0) keys.push_back(k);
+				if (cin.rdbuf()->in_avail() > 0 && keys.size() < 4096) continue;
+			}
+			if (keys.empty()) continue;
+
+			results.resize(keys.size());
+			container[0].findMany(&keys[0], keys.size(), &results[0]);
+
+			for (size_t i = 0; i != keys.size(); i ++)
 			{
 """ + ("sub" not in container.m.groupdict() and """\
-				cout << container[0](k);
+				cout << (results[i] != container[0].end());
 """ or """\
-				put_2(cout, container[0](k));
+				put_2(cout, results[i] == container[0].end()
+						? Container<""" + container.sub.type + """>::value_type()
+						: """ + (container.type[0] == 'T' and "*results[i]"
+								or "results[i]->second") + """);
 """) + """\
 				cout << sep;
 			}
+			cout.flush();
+			keys.clear();
 		}
 	}
 """ or " ") + """\
 	else for (int i = 0; i != args.size(); i ++)
 	{
-		Container<""" + container.type + """> container(args[i]);
+		Container<""" + container.type + """> container(
+				args[i], PROT_READ, MAP_SHARED, residency);
 
 		put_0(cout, container[0]);
 	}
@@ -1373,16 +4687,75 @@ int main(int argc, char **argv)
 
 tmpdir = tempfile.mkdtemp()
 
+# locate the compile cache
+
+includes = filter(None, [options.include, os.path.dirname(sys.argv[0])])
+flags = ["-O3", "-pthread", "-lrt"] + reduce(lambda x, y: x + ["-I", y], includes, [])
+
 if not options.compile and os.getenv("FASTTRIE_COMPILE"):
 	options.compile = os.getenv("FASTTRIE_COMPILE")
+if not options.compile and not options.no_cache:
+	options.compile = os.path.expanduser("~/.cache/fasttrie")
 if options.compile:
-	exe = options.compile + "/" + md5.new(options.format).hexdigest()
 	try:
 		if not os.path.exists(options.compile):
 			os.makedirs(options.compile)
-		if not os.path.exists(exe + ".cpp") or not os.stat(exe + ".cpp").st_size:
-			file(exe + ".cpp", "w").write(cpp)
 	except: pass
+	if not os.access(options.compile, os.W_OK): options.compile = None
+
+def command_output(command):
+	try:
+		if sys.version_info >= (2, 4):
+			return subprocess.Popen(command,
+					stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()[0]
+		else:
+			(out, input, err) = popen2.popen3(" ".join(map(lambda x: "'" + x + "'", command)))
+			input.close()
+			return out.read()
+	except: return ""
+
+def read_header(name):
+	for dir in [""] + includes:
+		if os.path.isfile(os.path.join(dir, name)):
+			return file(os.path.join(dir, name)).read()
+	return ""
+
+# the binary is keyed on everything that goes into it: the generated source,
+# headers it includes, compiler flags and compiler version
+
+def cache_key():
+	digest = md5.new(cpp)
+	for x in [" ".join(flags), command_output(["g++", "--version"])] \
+			+ map(read_header, ["FastTrie.h", "MMap.h"] + options.extend):
+		digest.update("\0" + x)
+	return digest.hexdigest()
+
+# evict least recently used binaries until the cache fits in options.cache_size
+
+def evict_cache(dir, keep):
+	entries = {}
+	for name in os.listdir(dir):
+		if not re.match(r'[0-9a-f]{32}(\.cpp|\.lock)?$', name): continue
+		try: st = os.stat(os.path.join(dir, name))
+		except OSError: continue
+		(size, mtime) = entries.get(name[:32], (0, 0))
+		entries[name[:32]] = (size + st.st_size, max(mtime, st.st_mtime))
+
+	total = 0
+	for (size, mtime) in entries.values(): total += size
+
+	lru = map(lambda x: (x[1][1], x[0]), entries.items())
+	lru.sort()
+	for (mtime, key) in lru:
+		if total <= options.cache_size * 1048576: break
+		if key == keep: continue
+		for suffix in ["", ".cpp", ".lock"]:
+			try: os.remove(os.path.join(dir, key + suffix))
+			except OSError: pass
+		total -= entries[key][0]
+
+if options.compile:
+	exe = options.compile + "/" + cache_key()
 else:
 	exe = tmpdir + "/fasttrie"
 
@@ -1391,44 +4764,134 @@ def kill_handler(signum, frame):
 
 signal.signal(signal.SIGTERM, kill_handler)
 
+# with --sizes auto, a build by 32 bits that exits by 3 for sizes exceeding
+# them runs again by 64, when the format leaves every size type to widen (not
+# knowing which container overflowed), its input can be read again from the
+# beginning and its output written again, not appended to
+
+def rebuild(status):
+	if status != 3 or options.sizes != "auto" or args or Container.sized: return False
+	try:
+		os.lseek(sys.stdin.fileno(), 0, 0)
+		if not options.output:
+			if fcntl.fcntl(sys.stdout.fileno(), fcntl.F_GETFL) & os.O_APPEND: return False
+			os.lseek(sys.stdout.fileno(), 0, 0)
+			os.ftruncate(sys.stdout.fileno(), 0)
+	except (OSError, IOError):
+		return False
+	sys.stderr.write(os.path.basename(sys.argv[0]) + ": building again with --sizes 64\n")
+	return True
+
 # compile and run
 
+def usable(exe):
+	return os.access(exe, os.X_OK) and os.stat(exe).st_size
+
 try:
-	if sys.version_info >= (2, 4):
-		if not os.access(exe, os.X_OK) or not os.stat(exe).st_size:
-			p = subprocess.Popen(["g++", "-x", "c++", "-o", exe, "-O3", "-"]
-					+ (options.include and ["-I", options.include] or [])
-					+ (os.path.dirname(sys.argv[0])
-								and ["-I", os.path.dirname(sys.argv[0])] or []),
-					stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-			(out, err) = p.communicate(input=cpp)
-			if out or err or \
-					not os.access(exe, os.X_OK) or not os.stat(exe).st_size: raise
+	if usable(exe):
+		try: os.utime(exe, None) # mark as recently used
+		except OSError: pass
+	else:
+		# concurrent builders wait for the one holding the lock, which compiles
+		# into a private file and publishes it by an atomic rename
+		lock = file(exe + ".lock", "w")
+		fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+		if not usable(exe):
+			if options.compile:
+				(fd, tmp) = tempfile.mkstemp(dir = options.compile)
+				os.write(fd, cpp)
+				os.close(fd)
+				os.chmod(tmp, 0644)
+				os.rename(tmp, exe + ".cpp")
+
+			(fd, tmp) = tempfile.mkstemp(dir = os.path.dirname(exe))
+			os.close(fd)
+			try:
+				if sys.version_info >= (2, 4):
+					p = subprocess.Popen(["g++", "-x", "c++", "-o", tmp, "-"] + flags,
+							stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+					(out, err) = p.communicate(input=cpp)
+				else:
+					(out, input, err) = popen2.popen3("g++ -x c++ -o '" + tmp + "' -"
+							+ "".join(map(lambda x: " '" + x + "'", flags)))
+					input.write(cpp)
+					input.close()
+					out = out.read()
+					err = err.read()
+				if out or err or not usable(tmp): raise
+				os.chmod(tmp, 0755)
+				os.rename(tmp, exe)
+			except:
+				os.remove(tmp)
+				raise
+		lock.close()
+
+	if options.compile:
+		evict_cache(options.compile, os.path.basename(exe))
 
+	if sys.version_info >= (2, 4):
 		p = subprocess.Popen([exe]
 				+ (options.disk     and ["-d", tmpdir] or [])
-				+ (options.printing and ["-p"        ] or []) + ["--"] + args)
-		p.wait()
+				+ (options.printing and ["-p"        ] or [])
+				+ (options.prefixing and ["-r"       ] or [])
+				+ (options.limit    and ["-l", str(options.limit)] or [])
+				+ (options.benching and ["-b"        ] or [])
+				+ (options.piping   and ["-P"        ] or [])
+				+ (options.serve    and ["-U", os.path.abspath(options.serve)] or [])
+				+ (options.batch    and ["-B", options.batch] or [])
+				+ (options.scan     and ["-m", options.scan] or [])
+				+ (options.residency and ["-R", options.residency] or [])
+				+ (options.sorted   and ["-s"        ] or [])
+				+ (options.compat_text and ["-C"     ] or [])
+				+ (options.input_format == "binary" and ["-i", "binary"] or [])
+				+ (options.stats    and ["-S", os.path.abspath(options.stats)] or [])
+				+ (options.output   and ["-o", os.path.abspath(options.output)] or [])
+				+ (options.jobs > 1 and ["-j", str(options.jobs)] or [])
+				+ (options.memory_limit and ["-M", str(options.memory_limit << 20)] or [])
+				+ ["--"] + args)
+		status = p.wait()
+		if rebuild(status):
+			shutil.rmtree(tmpdir)
+			os.execv(sys.executable, [sys.executable] + sys.argv + ["--sizes", "64"])
+		if status: raise
 	else:
-		if not os.access(exe, os.X_OK) or not os.stat(exe).st_size:
-			(out, input, err) = popen2.popen3("g++ -x c++ -o '" + exe + "' -O3 -"
-					+ (options.include and " -I '" + options.include + "'" or "")
-					+ (os.path.dirname(sys.argv[0])
-								and " -I '" + os.path.dirname(sys.argv[0]) + "'" or ""))
-			input.write(cpp)
-			input.close()
-			out = out.read()
-			err = err.read()
-			if out or err or \
-					not os.access(exe, os.X_OK) or not os.stat(exe).st_size: raise
-
 		(out, input, err) = popen2.popen3("'" + exe + "' "
 				+ (options.disk     and "-d '" + tmpdir + "' " or "")
 				+ (options.printing and "-p "                  or "")
+				+ (options.prefixing and "-r "                 or "")
+				+ (options.limit    and "-l " + str(options.limit) + " " or "")
+				+ (options.benching and "-b "                  or "")
+				+ (options.piping   and "-P "                  or "")
+				+ (options.serve    and "-U '" + os.path.abspath(options.serve) + "' " or "")
+				+ (options.batch    and "-B " + options.batch + " " or "")
+				+ (options.scan     and "-m " + options.scan + " " or "")
+				+ (options.residency and "-R " + options.residency + " " or "")
+				+ (options.sorted   and "-s "                  or "")
+				+ (options.compat_text and "-C "               or "")
+				+ (options.input_format == "binary" and "-i binary " or "")
+				+ (options.stats    and "-S '" + os.path.abspath(options.stats) + "' " or "")
+				+ (options.output   and "-o '" + os.path.abspath(options.output) + "' " or "")
+				+ (options.jobs > 1 and "-j " + str(options.jobs) + " " or "")
+				+ (options.memory_limit and "-M " + str(options.memory_limit << 20) + " " or "")
 				+ "-- " + " ".join(map(lambda x: "'" + x + "'", args)))
-		if not args:
+		if not args or options.benching or options.batch or options.prefixing \
+				or options.scan:
 			for line in sys.stdin:
 				input.write(line)
+		elif args and options.piping:
+			# relay one framed request and its response at a time: (id,
+			# operation, length) and the key, then (id, length) and the result,
+			# with no result for a miss or a request not served
+			while True:
+				header = sys.stdin.read(12)
+				if len(header) < 12: break
+				input.write(header + sys.stdin.read(struct.unpack("=3I", header)[2]))
+				input.flush()
+				header = out.read(8)
+				if len(header) < 8: break
+				length = struct.unpack("=2I", header)[1]
+				sys.stdout.write(header + (length < 0xFFFFFFFE and out.read(length) or ""))
+				sys.stdout.flush()
 		elif args and options.printing:
 			while True:
 				line = sys.stdin.readline()
@@ -1443,7 +4906,11 @@ try:
 			sys.stdout.write(data)
 			data = out.read(1048576)
 
-except KeyboardInterrupt: pass
+except KeyboardInterrupt:
+	# let a server clean up its socket, and a build its temporary files
+	if "p" in locals() and p.poll() is None:
+		os.kill(p.pid, signal.SIGTERM)
+		p.wait()
 except:
 	shutil.rmtree(tmpdir)
 	if not "err" in locals(): err = ""
@@ -0,0 +1,233 @@
+#!/bin/env python
+
+# FastTrie client: look up a .ft file through a long-lived co-process or server
+#
+# The Client starts fasttrie.py -P on a .ft file once, or connects to the
+# socket of fasttrie.py --serve, and talks to it in framed requests and
+# responses, so that a lookup costs no process nor line round-trip, and many
+# lookups, of many threads too, are in flight at once, e.g.:
+#
+#   import ftclient
+#   client = ftclient.Client("words.ft", r'T(c*)\t(l)\n')
+#   client.get("word")                  # b"123", or None if not found
+#   client.get_many(["word", "other"])  # sent at once, [b"123", None]
+#   future = client.submit("word")      # future.result() later
+#   client.prefix("wo")                 # [(b"word", b"123"), ...]
+#   client.match_all("a word or two")   # [(b"a", b"1"), (b"word", b"123"), ...]
+#   client.close()
+#
+#   client = ftclient.Client(None, r'T(c*)\t(l)\n', socket = "/tmp/words.sock")
+#
+# Keys are in text as in input.txt (str is encoded in UTF-8), and values in
+# text as printed by fasttrie.py -p, in bytes, or True for a set.
+#
+# The framed protocol is in native byte order: a request is a uint32_t id, a
+# uint32_t operation, a uint32_t length and the key, a response the id, the
+# length and the result, or 0xFFFFFFFF in place of the length for a key not
+# found, or 0xFFFFFFFE for a request not served. Results of prefix and
+# match_all are records of keys and values, each a uint32_t length and text.
+
+import sys, os, struct, subprocess, threading, socket as sockets, json
+
+import ftreader
+
+__all__ = ["Client", "Future"]
+
+REQUEST = struct.Struct("=3I")
+RESPONSE = struct.Struct("=2I")
+LENGTH = struct.Struct("=I")
+MISS = 0xFFFFFFFF
+ERROR = 0xFFFFFFFE
+
+FIND, PREFIX, MATCH_ALL, STATS = range(4)
+
+class Future(object):
+	"""result of a lookup, set by the reader thread of its client"""
+	def __init__(self, operation = FIND):
+		self.operation = operation
+		self.event = threading.Event()
+		self.value = None
+		self.error = None
+
+	def set(self, value, error = None):
+		self.value = value
+		self.error = error
+		self.event.set()
+
+	def done(self): return self.event.is_set()
+
+	def result(self, timeout = None):
+		"""value of the key, or None if not found, waiting for at most timeout
+		seconds (default: forever)"""
+		self.event.wait(timeout)
+		if not self.event.is_set(): raise RuntimeError("lookup timed out")
+		if self.error: raise self.error
+		return self.value
+
+class Client(object):
+	"""a co-process of fasttrie.py -P looking up keys in a .ft file, or a
+	connection to fasttrie.py --serve at socket, safe to share among threads,
+	whose requests are told apart by ids"""
+	def __init__(self, filename, format, tree = None, python = None, args = [],
+			socket = None):
+		type = ftreader.parseFormat(format)
+		if not isinstance(type, (ftreader.TrieOf, ftreader.HashMapOf)):
+			raise ValueError("a client works on a Trie or HashMap format only")
+		self.set = isinstance(type.sub, ftreader.Bool)
+
+		if socket:
+			self.process = None
+			self.socket = sockets.socket(sockets.AF_UNIX, sockets.SOCK_STREAM)
+			self.socket.connect(socket)
+			self.input = self.socket.makefile("wb")
+			self.output = self.socket.makefile("rb")
+		else:
+			tree = tree or os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+			python = python or os.getenv("PYTHON", sys.executable)
+			self.process = subprocess.Popen([python,
+					os.path.join(tree, "fasttrie-gen", "fasttrie.py"), "-I", tree,
+					"-f", format, "-P"] + args + ["--", filename],
+					stdin = subprocess.PIPE, stdout = subprocess.PIPE, bufsize = -1)
+			self.input = self.process.stdin
+			self.output = self.process.stdout
+
+		self.writing = threading.Lock() # for requests to be written whole
+		self.waiting = threading.Lock() # for pending and the next id
+		self.pending = {}
+		self.next = 0
+		self.closed = False
+
+		self.reader = threading.Thread(target = self.read)
+		self.reader.daemon = True
+		self.reader.start()
+
+	def submit_many(self, keys, operation = FIND):
+		"""send requests of keys at once, and return their futures"""
+		data = []
+		futures = []
+		self.waiting.acquire()
+		try:
+			if self.closed: raise ValueError("the client is closed")
+			for key in keys:
+				if not isinstance(key, bytes): key = key.encode("utf-8")
+				future = Future(operation)
+				while self.next in self.pending: self.next = (self.next + 1) & 0xFFFFFFFF
+				self.pending[self.next] = future
+				data.append(REQUEST.pack(self.next, operation, len(key)))
+				data.append(key)
+				futures.append(future)
+				self.next = (self.next + 1) & 0xFFFFFFFF
+		finally:
+			self.waiting.release()
+
+		self.writing.acquire()
+		try:
+			try:
+				self.input.write(b"".join(data))
+				self.input.flush()
+			except (IOError, OSError, ValueError):
+				pass # failed by the reader thread at the end of responses
+		finally:
+			self.writing.release()
+
+		return futures
+
+	def submit(self, key, operation = FIND):
+		"""send the request of a key, and return its future"""
+		return self.submit_many([key], operation)[0]
+
+	def get(self, key, default = None):
+		"""value of a key, or default if not found"""
+		value = self.submit(key).result()
+		if value is None: return default
+		return value
+
+	def get_many(self, keys, default = None):
+		"""values of keys, default for each not found"""
+		values = [f.result() for f in self.submit_many(keys)]
+		for (i, value) in enumerate(values):
+			if value is None: values[i] = default
+		return values
+
+	def __contains__(self, key): return self.submit(key).result() is not None
+
+	def prefix(self, key):
+		"""(key, value) of keys beginning with key in order, or keys of a set,
+		of a Trie only"""
+		return self.records(self.submit(key, PREFIX).result())
+
+	def match_all(self, text):
+		"""(key, value) of keys found anywhere in text, by their beginnings then
+		ends, or keys of a set, of a Trie only"""
+		return self.records(self.submit(text, MATCH_ALL).result())
+
+	def stats(self):
+		"""latencies of requests served so far, by operation"""
+		return json.loads(self.submit("", STATS).result().decode())
+
+	def records(self, data):
+		texts = []
+		p = 0
+		while p < len(data):
+			length = LENGTH.unpack_from(data, p)[0]
+			texts.append(data[p + LENGTH.size:p + LENGTH.size + length])
+			p += LENGTH.size + length
+		if self.set: return texts
+		return list(zip(texts[0::2], texts[1::2]))
+
+	def read(self):
+		# responses to futures by ids, until the co-process exits
+		while True:
+			header = readFully(self.output, RESPONSE.size)
+			if header is None: break
+			(id, length) = RESPONSE.unpack(header)
+			(value, error) = (None, None)
+			if length == ERROR:
+				error = ValueError("request not served, e.g. a prefix of a HashMap")
+			elif length != MISS:
+				value = readFully(self.output, length)
+				if value is None: break
+
+			self.waiting.acquire()
+			future = self.pending.pop(id, None)
+			self.waiting.release()
+			if not future: continue
+			if value is not None and self.set and future.operation == FIND: value = True
+			future.set(value, error)
+
+		self.waiting.acquire()
+		self.closed = True
+		pending = self.pending
+		self.pending = {}
+		self.waiting.release()
+		for future in pending.values():
+			future.set(None, IOError("fasttrie.py -P or the server exited"))
+
+	def close(self):
+		"""finish the requests sent, then stop the co-process"""
+		self.writing.acquire()
+		try:
+			try:
+				self.input.close()
+				if not self.process: self.socket.shutdown(sockets.SHUT_WR)
+			except (IOError, OSError): pass
+		finally:
+			self.writing.release()
+		self.reader.join()
+		self.output.close()
+		if not self.process:
+			self.socket.close()
+			return 0
+		return self.process.wait()
+
+	def __enter__(self): return self
+	def __exit__(self, *exc): self.close()
+
+def readFully(f, size):
+	# size bytes from f, or None at the end
+	data = b""
+	while len(data) < size:
+		more = f.read(size - len(data))
+		if not more: return None
+		data += more
+	return data
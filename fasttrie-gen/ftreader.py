@@ -0,0 +1,689 @@
+#!/bin/env python
+
+# FastTrie reader: look up .ft files in Python, without the compiled binary
+#
+# The file is mmap'ed and decoded in place by struct and memoryview, in the
+# layouts that FastTrie.h writes, as described by the same format string as
+# fasttrie.py takes, e.g.:
+#
+#   import ftreader
+#   trie = ftreader.open("words.ft", r'T(c*)\t(l)\n')
+#   trie.get(b"word"), b"word" in trie, trie[b"word"]
+#   for key, value in trie.items(b"wo"): ...
+#   counts = trie.get_many(keys)   # array.array, numpy.frombuffer(counts)
+#
+# Keys and values map to Python as follows:
+#   c* (a string of chars)        bytes, str accepted as UTF-8 in keys
+#   u* (a string of UTF-16 units) unicode
+#   a single type, e.g. l         int or float
+#   a struct, e.g. l:f            tuple
+#   a struct sequence, e.g. l:f * list of ints, floats or tuples
+#   T, H (nested)                 a view with get, in, items, etc.
+#   V (nested)                    a sequence view
+#   P                             tuple of two values
+#   T(...)\n or H(...)\n (sets)   True on get, use in
+
+import sys, re, mmap, struct, array, io
+
+__all__ = ["open", "Trie", "HashMap", "Vector"]
+
+PY3 = sys.version_info[0] >= 3
+
+# format string grammar, the same as Container in fasttrie.py
+
+pttnType      = r'(?:[cCbBsSlLqQfdu])'             # type (e.g. char, uint32_t)
+pttnSeparator = r'(?:[^*()\\]|\\x..|\\.)'          # type separator (e.g. '\na123:\n')
+pttnWeakerSep = r'(?:[^0-9A-Za-z*()\\]|\\x..|\\.)' # weaker type separator (e.g. '\t')
+pttnTarg      = r'(?:(?:,[^,()]+)+)'               # template arguments (e.g. FT_TAIL)
+
+pttnTypeSeq   = r'(?P<pre>' + pttnWeakerSep + r'*)' \
+		+ r'(?P<seq>(?:' + pttnType + pttnWeakerSep + r'*)+)\*?'
+pttnVector    = r'V(?P<arg>(?:' + pttnTarg + r')?)' \
+		+ r'\((?P<sub>.+)\)(?P<sep>' + pttnSeparator + r'+)'
+pttnTrieSet   = r'T(?P<arg>(?:' + pttnTarg + r')?)' \
+		+ r'\((?P<key>' + pttnTypeSeq + r')\)(?P<keysep>' + pttnSeparator + r'+)'
+pttnTrie      = r'T(?P<arg>(?:' + pttnTarg + r')?)' \
+		+ r'\((?P<key>' + pttnTypeSeq + r')\)(?P<keysep>' + pttnSeparator + r'+)' \
+		+ r'\((?P<sub>.+)\)(?P<sep>' + pttnSeparator + r'+)'
+pttnHashSet   = r'H(?P<arg>(?:' + pttnTarg + r')?)' \
+		+ r'\((?P<key>' + pttnTypeSeq + r')\)(?P<keysep>' + pttnSeparator + r'+)'
+pttnHashMap   = r'H(?P<arg>(?:' + pttnTarg + r')?)' \
+		+ r'\((?P<key>' + pttnTypeSeq + r')\)(?P<keysep>' + pttnSeparator + r'+)' \
+		+ r'\((?P<sub>.+)\)(?P<sep>' + pttnSeparator + r'+)'
+
+# native struct codes of the types in format strings and template arguments
+
+type2codes = {
+		"c": "b", "C": "B", "b": "b", "B": "B", "s": "h", "S": "H",
+		"l": "i", "L": "I", "q": "q", "Q": "Q", "f": "f", "d": "d", "u": "H",
+}
+ctype2codes = {
+		"char": "b", "signed char": "b", "unsigned char": "B",
+		"int8_t": "b", "uint8_t": "B", "int16_t": "h", "uint16_t": "H",
+		"int32_t": "i", "uint32_t": "I", "int64_t": "q", "uint64_t": "Q",
+		"size_t": "Q", "bool": "?",
+}
+options = {"FT_TAIL": 1, "FT_PATH": 2, "FT_QUICKBUILD": 4, "FT_ALPHABET": 8}
+
+ALIGN = 16            # blocks of Container<T> are aligned to 16 bytes
+HEADER = struct.Struct("=Q") # each begins with its size_t number of values
+MASK64 = (1 << 64) - 1
+UTF16 = sys.byteorder == "little" and "utf-16-le" or "utf-16-be"
+
+def targs(arg, names, sizes = "32"):
+	# template arguments after the value type, by name, e.g. ",FT_TAIL,uint16_t",
+	# where a last 32 or 64 is the size type, the last name, e.g. ",FT_PATH,64";
+	# with sizes 64 the size type is uint64_t unless given
+	values = [x.strip() for x in arg.split(",")[1:]]
+	if len(values) > len(names): raise ValueError("too many template arguments '" + arg + "'")
+	if values and values[-1] in ["32", "64"]:
+		args = dict(zip(names[:-1], values[:-1]))
+		args[names[-1]] = "uint" + values[-1] + "_t"
+		return args
+	args = dict(zip(names, values))
+	if sizes == "64": args.setdefault(names[-1], "uint64_t")
+	return args
+
+def code(ctype):
+	if ctype not in ctype2codes: raise ValueError("unsupported type '" + ctype + "'")
+	return ctype2codes[ctype]
+
+def option(expression):
+	value = 0
+	for x in expression.split("|"):
+		x = x.strip()
+		value |= x in options and options[x] or int(x, 0)
+	return value
+
+# zero-copy array of count values of a struct code at offset of buf
+
+if PY3:
+	def raw(buf, begin, end):
+		return buf[begin:end].tobytes()
+
+	def values(buf, offset, count, code):
+		return buf[offset:offset + count * struct.calcsize(code)].cast(code)
+else:
+	def raw(buf, begin, end):
+		return buf[begin:end] # a copy from mmap, but only of the value
+
+	class values(object):
+		def __init__(self, buf, offset, count, code):
+			self.buf = buf
+			self.offset = offset
+			self.count = count
+			self.struct = struct.Struct(code)
+
+		def __len__(self): return self.count
+
+		def __getitem__(self, i):
+			if isinstance(i, slice):
+				return [self[j] for j in range(*i.indices(self.count))]
+			if i < 0: i += self.count
+			if not 0 <= i < self.count: raise IndexError(i)
+			return self.struct.unpack_from(self.buf, self.offset + i * self.struct.size)[0]
+
+def block(buf, offset, itemsize):
+	# (number of values, offset of values, offset of next block) of Container<T>
+	if offset + ALIGN > len(buf): raise ValueError("truncated container")
+	count = HEADER.unpack_from(buf, offset)[0]
+	end = offset + ALIGN + (count * itemsize + ALIGN - 1) // ALIGN * ALIGN
+	if end > len(buf): raise ValueError("truncated container")
+	return (count, offset + ALIGN, end)
+
+# types of containers, parsed from a format string like Container in
+# fasttrie.py, each reads its Container<T> at an offset of a buffer
+
+def parse(format, sizes = "32"):
+	m = re.match(pttnTypeSeq + '$', format)
+	if m:
+		type = Struct(m.group("seq"))
+		if m.group("pre") + m.group("seq") == format: return type
+		return VectorOf(type, "", sizes)
+
+	m = re.match(pttnVector + '$', format)
+	if m: return VectorOf(parse(m.group("sub"), sizes), m.group("arg"), sizes)
+
+	for (pttn, kind) in [(pttnTrieSet, TrieOf), (pttnTrie, TrieOf),
+			(pttnHashSet, HashMapOf), (pttnHashMap, HashMapOf)]:
+		m = re.match(pttn + '$', format)
+		if m: return kind(parse(m.group("key"), sizes),
+				"sub" in m.groupdict() and parse(m.group("sub"), sizes) or Bool(),
+				m.group("arg"), sizes)
+
+	for m in re.finditer(r'(?P<sep>' + pttnSeparator + r'+)', format):
+		if m.start() < 4 or m.end() > len(format) - 3 or format[0] != 'P': continue
+		try:
+			return PairOf(parse(format[2:m.start() - 1], sizes),
+					parse(format[m.end() + 1:- 1], sizes))
+		except ValueError:
+			continue
+
+	raise ValueError("incorrect format string '" + format + "'")
+
+class Struct(object):
+	# a single type or a struct of types, in C layout
+	def __init__(self, seq):
+		types = [m.group(1) for m in re.finditer(
+				'(' + pttnType + ')(' + pttnWeakerSep + '*)', seq)]
+		codes = "".join([type2codes[t] for t in types])
+		align = max([struct.calcsize(c) for c in codes])
+		self.single = len(types) == 1
+		self.code = self.single and codes or None
+		self.chars = types == ["c"] or types == ["C"]
+		self.utf16 = types == ["u"]
+		self.struct = struct.Struct("@" + codes + "0" + [c for c in codes
+				if struct.calcsize(c) == align][0])
+		self.size = self.struct.size
+
+	def read(self, buf, offset):
+		(count, begin, end) = block(buf, offset, self.size)
+		return (Fixed(buf, begin, count, self), end)
+
+	def unpack(self, buf, offset):
+		value = self.struct.unpack_from(buf, offset)
+		if self.single: return value[0]
+		return value
+
+	def pack(self, value):
+		return self.single and self.struct.pack(value) or self.struct.pack(*value)
+
+class Bool(Struct):
+	# values of a Trie<bool> or HashMap<bool>, i.e. a set
+	def __init__(self):
+		self.single = True
+		self.code = "?"
+		self.chars = self.utf16 = False
+		self.struct = struct.Struct("?")
+		self.size = 1
+
+class Fixed(object):
+	# Container<T> of a fixed-size T
+	def __init__(self, buf, begin, count, type):
+		self.buf = buf
+		self.begin = begin
+		self.count = count
+		self.type = type
+		self.values = None
+		if type.code: self.values = values(buf, begin, count, type.code)
+
+	def __len__(self): return self.count
+
+	def __getitem__(self, i):
+		if self.values is not None: return self.values[i]
+		return self.type.unpack(self.buf, self.begin + i * self.type.size)
+
+	def slice(self, begin, end):
+		# values begin to end, a string for chars or UTF-16, otherwise a list
+		if self.type.chars:
+			return raw(self.buf, self.begin + begin, self.begin + end)
+		if self.type.utf16:
+			return raw(self.buf, self.begin + begin * 2, self.begin + end * 2).decode(UTF16)
+		return [self[i] for i in range(begin, end)]
+
+class VectorOf(object):
+	# Vector<ValueT, SizeT>
+	def __init__(self, sub, arg, sizes = "32"):
+		self.sub = sub
+		self.sizeCode = code(targs(arg, ["SizeT"], sizes).get("SizeT", "uint32_t"))
+
+	def read(self, buf, offset):
+		(count, begin, offset) = block(buf, offset, struct.calcsize(self.sizeCode))
+		entries = values(buf, begin, count, self.sizeCode)
+		(items, offset) = self.sub.read(buf, offset)
+		return (Vectors(entries, items, self.sub), offset)
+
+	def pack(self, key):
+		# raw units of a key, e.g. for a Trie or a hash
+		if self.sub.chars:
+			return not isinstance(key, bytes) and key.encode("utf-8") or key
+		if self.sub.utf16:
+			return key.encode(UTF16)
+		return b"".join([self.sub.pack(x) for x in key])
+
+	def unpack(self, data):
+		if self.sub.chars: return data
+		if self.sub.utf16: return data.decode(UTF16)
+		size = self.sub.size
+		return [self.sub.unpack(data, i) for i in range(0, len(data), size)]
+
+class Vectors(object):
+	# Container<Vector<ValueT, SizeT> >, each a string, a list or a Vector
+	def __init__(self, entries, items, sub):
+		self.entries = entries
+		self.items = items
+		self.sub = sub
+
+	def __len__(self): return len(self.entries) - 1
+
+	def __getitem__(self, i):
+		begin = self.entries[i]
+		end = self.entries[i + 1]
+		if isinstance(self.items, Fixed): return self.items.slice(begin, end)
+		return Vector(self.items, begin, end)
+
+class Vector(object):
+	"""a Vector of containers, as a read-only sequence"""
+	def __init__(self, items, begin, end):
+		self.items = items
+		self.begin = begin
+		self.end = end
+
+	def __len__(self): return self.end - self.begin
+
+	def __getitem__(self, i):
+		if isinstance(i, slice): return [self[j] for j in range(*i.indices(len(self)))]
+		if i < 0: i += len(self)
+		if not 0 <= i < len(self): raise IndexError(i)
+		return self.items[self.begin + i]
+
+	def __iter__(self):
+		for i in range(self.begin, self.end): yield self.items[i]
+
+	def __repr__(self): return "Vector(" + repr(list(self)) + ")"
+
+class PairOf(object):
+	# Pair<ValueT1, ValueT2>
+	def __init__(self, sub1, sub2):
+		self.sub1 = sub1
+		self.sub2 = sub2
+
+	def read(self, buf, offset):
+		(items1, offset) = self.sub1.read(buf, offset)
+		(items2, offset) = self.sub2.read(buf, offset)
+		if len(items1) != len(items2): raise ValueError("sizes of a pair differ")
+		return (Pairs(items1, items2), offset)
+
+class Pairs(object):
+	def __init__(self, items1, items2):
+		self.items1 = items1
+		self.items2 = items2
+
+	def __len__(self): return len(self.items1)
+	def __getitem__(self, i): return (self.items1[i], self.items2[i])
+
+def keyType(key):
+	# keys are a struct or a struct sequence
+	if not isinstance(key, (Struct, VectorOf)) or isinstance(key, VectorOf) \
+			and not isinstance(key.sub, Struct):
+		raise ValueError("keys must be a struct or a struct sequence")
+	return key
+
+class Mapping(object):
+	# lookups common to Trie and HashMap, by find(key) returning a value index
+
+	def __contains__(self, key): return self.find(key) is not None
+
+	def __getitem__(self, key):
+		i = self.find(key)
+		if i is None: raise KeyError(key)
+		return self.container.items[i]
+
+	def get(self, key, default = None):
+		"""value of a key, or default if not found"""
+		i = self.find(key)
+		if i is None: return default
+		return self.container.items[i]
+
+	def get_many(self, keys, default = 0):
+		"""values of many keys, default for each not found, in an array.array
+		for a single numeric value type, e.g. for numpy.frombuffer, otherwise
+		in a list"""
+		items = self.container.items
+		find = self.find
+		sub = self.container.type.sub
+		result = [default] * len(keys)
+		for (j, key) in enumerate(keys):
+			i = find(key)
+			if i is not None: result[j] = items[i]
+		if isinstance(sub, Struct) and sub.single and sub.code in "bBhHiIqQfd":
+			return array.array(sub.code, result)
+		return result
+
+	def __iter__(self):
+		for (key, value) in self.items(): yield key
+
+	def keys(self, prefix = None): return [k for (k, v) in self.items(prefix)]
+	def values(self, prefix = None): return [v for (k, v) in self.items(prefix)]
+
+class TrieOf(object):
+	# Trie<ValueT, option, CharT, SizeT>
+	def __init__(self, key, sub, arg, sizes = "32"):
+		args = targs(arg, ["option", "CharT", "SizeT"], sizes)
+		self.key = keyType(key)
+		self.sub = sub
+		self.option = option(args.get("option", "FT_TAIL"))
+		self.charCode = code(args.get("CharT", "uint8_t"))
+		self.sizeCode = code(args.get("SizeT", "uint32_t"))
+		self.charSize = struct.calcsize(self.charCode)
+		self.mask = 1 << (struct.calcsize(self.sizeCode) * 8 - 1)
+
+	def read(self, buf, offset):
+		sizeSize = struct.calcsize(self.sizeCode)
+		(count, begin, offset) = block(buf, offset, sizeSize * 2)
+		nodes = values(buf, begin, count * 2, self.sizeCode)
+		(count, begin, offset) = block(buf, offset, sizeSize) # paths, not used
+		(count, begin, offset) = block(buf, offset, sizeSize)
+		entries = values(buf, begin, count, self.sizeCode)
+		(count, begin, offset) = block(buf, offset, self.charSize)
+		tails = (entries, values(buf, begin, count, self.charCode))
+		alphabet = None
+		if self.option & 8:
+			# codes of characters, characters of codes, codes in order of characters
+			alphabet = []
+			for i in range(3):
+				(count, begin, offset) = block(buf, offset, self.charSize)
+				alphabet.append(values(buf, begin, count, self.charCode))
+			if len(alphabet[0]) != 1 << self.charSize * 8:
+				raise ValueError("alphabet does not match the character type")
+		(items, offset) = self.sub.read(buf, offset)
+		return (Tries(self, nodes, tails, alphabet, items), offset)
+
+	def units(self, key):
+		# a key in CharT units
+		data = self.key.pack(key)
+		if self.charSize == 1: return bytearray(data)
+		return struct.unpack("@" + str(len(data) // self.charSize) + self.charCode, data)
+
+	def key_of(self, units):
+		if self.charSize == 1: data = bytes(bytearray(units))
+		else: data = struct.pack("@" + str(len(units)) + self.charCode, *units)
+		if isinstance(self.key, Struct): return self.key.unpack(data, 0)
+		return self.key.unpack(data)
+
+class Tries(object):
+	def __init__(self, type, nodes, tails, alphabet, items):
+		self.type = type
+		self.nodes = nodes
+		self.tails = tails
+		self.alphabet = alphabet
+		self.items = items
+
+	def __len__(self): return self.nodes[1]
+	def __getitem__(self, i): return Trie(self, i)
+
+	def tail(self, i):
+		(entries, units) = self.tails
+		return list(units[entries[i]:entries[i + 1]])
+
+class Trie(Mapping):
+	"""a Trie in a .ft file, as a read-only mapping with prefix iteration"""
+	def __init__(self, container, i):
+		self.container = container
+		self.i = i
+
+	def __len__(self):
+		nodes = self.container.nodes
+		mask = self.container.type.mask
+		return (nodes[2 * (self.i + 2)] & ~mask) - (nodes[2 * (self.i + 1)] & ~mask)
+
+	def find(self, key):
+		"""value index of a key, or None, as Trie::match in FastTrie.h"""
+		type = self.container.type
+		nodes = self.container.nodes
+		tail = type.option & 1
+		mask = type.mask
+		numNodes = len(nodes) // 2
+
+		units = type.units(key)
+		codes = self.container.alphabet and self.container.alphabet[0]
+		node = 1 + self.i
+		children = nodes[2 * node + 1]
+
+		for (k, c) in enumerate(units):
+			if tail and children & mask:
+				children &= ~mask
+				if self.container.tail(children) != list(units[k:]): return None
+				return children
+			child = children + (codes[c] if codes else c)
+			if not 0 <= child < numNodes or nodes[2 * child] != node: return None
+			node = child
+			children = nodes[2 * node + 1]
+
+		if tail and children & mask:
+			children &= ~mask
+			if self.container.tail(children): return None
+			return children
+
+		term = children - 1
+		if not 0 <= term < numNodes or nodes[2 * term] != node: return None
+		return nodes[2 * term + 1]
+
+	def items(self, prefix = None):
+		"""(key, value) of keys beginning with prefix, in increasing order"""
+		type = self.container.type
+		nodes = self.container.nodes
+		items = self.container.items
+		tail = type.option & 1
+		mask = type.mask
+		numNodes = len(nodes) // 2
+		numChars = 1 << type.charSize * 8
+
+		units = list(prefix is not None and type.units(prefix) or [])
+		alphabet = self.container.alphabet
+		node = 1 + self.i
+		children = nodes[2 * node + 1]
+
+		# down to the node of the prefix
+		for (k, c) in enumerate(units):
+			if tail and children & mask:
+				children &= ~mask
+				rest = self.container.tail(children)
+				if rest[:len(units) - k] == units[k:]:
+					yield (type.key_of(units[:k] + rest), items[children])
+				return
+			child = children + (alphabet[0][c] if alphabet else c)
+			if not 0 <= child < numNodes or nodes[2 * child] != node: return
+			node = child
+			children = nodes[2 * node + 1]
+
+		# then depth first, a terminator before the children in order of CharT
+		stack = [(node, children, units)]
+		while stack:
+			(node, children, units) = stack.pop()
+			if tail and children & mask:
+				children &= ~mask
+				yield (type.key_of(units + self.container.tail(children)), items[children])
+				continue
+
+			term = children - 1
+			if 0 <= term < numNodes and nodes[2 * term] == node:
+				yield (type.key_of(units), items[nodes[2 * term + 1]])
+
+			found = []
+			if alphabet:
+				# codes in order of their characters
+				for code in alphabet[2]:
+					child = children + code
+					if child < numNodes and nodes[2 * child] == node:
+						found.append((child, nodes[2 * child + 1], units + [alphabet[1][code]]))
+			else:
+				parents = nodes[2 * children:2 * min(children + numChars, numNodes):2]
+				for (c, parent) in enumerate(parents):
+					if parent == node:
+						child = children + c
+						found.append((child, nodes[2 * child + 1], units + [c]))
+			found.reverse()
+			stack.extend(found)
+
+	def __repr__(self): return "Trie(" + repr(dict(self.items())) + ")"
+
+class HashMapOf(object):
+	# HashMap<KeyT, ValueT, HashT, SizeT>
+	def __init__(self, key, sub, arg, sizes = "32"):
+		args = targs(arg, ["HashT", "SizeT"], sizes)
+		self.key = keyType(key)
+		self.sub = sub
+		self.hash = args.get("HashT", "MulAddHash")
+		if self.hash not in ["MulAddHash", "PerfectHash"]:
+			raise ValueError("unsupported hash function '" + self.hash + "'")
+		self.sizeCode = code(args.get("SizeT", "uint32_t"))
+		self.direct = 1 << (struct.calcsize(self.sizeCode) * 8 - 1)
+		self.unit = isinstance(key, VectorOf) and key.sub.size or key.size
+
+	def read(self, buf, offset):
+		sizeSize = struct.calcsize(self.sizeCode)
+		seeds = None
+		if self.hash == "PerfectHash":
+			(count, begin, offset) = block(buf, offset, sizeSize)
+			entries = values(buf, begin, count, self.sizeCode)
+			(count, begin, offset) = block(buf, offset, sizeSize)
+			seeds = (entries, values(buf, begin, count, self.sizeCode))
+		(count, begin, offset) = block(buf, offset, sizeSize)
+		maps = values(buf, begin, count, self.sizeCode)
+		(count, begin, offset) = block(buf, offset, sizeSize)
+		buckets = values(buf, begin, count, self.sizeCode)
+		(items, offset) = PairOf(self.key, self.sub).read(buf, offset)
+		return (HashMaps(self, seeds, maps, buckets, items), offset)
+
+	def hashOf(self, key):
+		data = self.key.pack(key)
+		if self.hash == "PerfectHash": return murmur64(data)
+		return mulAdd(data, self.unit)
+
+class HashMaps(object):
+	def __init__(self, type, seeds, maps, buckets, items):
+		self.type = type
+		self.seeds = seeds
+		self.maps = maps
+		self.buckets = buckets
+		self.pairs = items
+		self.keys = items.items1
+		self.items = items.items2
+
+	def __len__(self): return len(self.maps) - 1
+	def __getitem__(self, i): return HashMap(self, i)
+
+class HashMap(Mapping):
+	"""a HashMap in a .ft file, as a read-only mapping"""
+	def __init__(self, container, i):
+		self.container = container
+		self.i = i
+
+	def __len__(self):
+		c = self.container
+		return c.buckets[c.maps[self.i + 1]] - c.buckets[c.maps[self.i]]
+
+	def find(self, key):
+		"""value index of a key, or None, as HashMap::find in FastTrie.h"""
+		c = self.container
+		type = c.type
+		firstBucket = c.maps[self.i]
+		size = c.maps[self.i + 1] - firstBucket
+		if size == 0: return None
+
+		if isinstance(type.key, VectorOf) and type.key.sub.chars \
+				and not isinstance(key, bytes): key = key.encode("utf-8")
+		hash = type.hashOf(key)
+
+		if c.seeds is not None:
+			(entries, seeds) = c.seeds
+			first = entries[self.i]
+			seed = seeds[first + (hash * (entries[self.i + 1] - first) >> 64)]
+			if seed & type.direct: slot = seed & ~type.direct
+			else: slot = mix64((hash + seed * 0x9E3779B97F4A7C15) & MASK64) * size >> 64
+			candidates = [c.buckets[firstBucket] + slot]
+		else:
+			bucket = firstBucket + hash % size
+			candidates = range(c.buckets[bucket], c.buckets[bucket + 1])
+
+		for j in candidates:
+			if c.keys[j] == key: return j
+		return None
+
+	def items(self, prefix = None):
+		"""(key, value) of keys beginning with prefix, in the order of the hash"""
+		c = self.container
+		if prefix is not None and isinstance(c.type.key, VectorOf) \
+				and c.type.key.sub.chars and not isinstance(prefix, bytes):
+			prefix = prefix.encode("utf-8")
+		for j in range(c.buckets[c.maps[self.i]], c.buckets[c.maps[self.i + 1]]):
+			key = c.keys[j]
+			if prefix is None or key[:len(prefix)] == prefix: yield (key, c.items[j])
+
+	def __repr__(self): return "HashMap(" + repr(dict(self.items())) + ")"
+
+# hash functions of FastTrie.h
+
+primes = [
+	0x01EE5DB9, 0x491408C3, 0x0465FB69, 0x421F0141,
+	0x2E7D036B, 0x2D41C7B9, 0x58C0EF0D, 0x7B15A53B,
+	0x7C9D3761, 0x5ABB9B0B, 0x24109367, 0x5A5B741F,
+	0x6B9F12E9, 0x71BA7809, 0x081F69CD, 0x4D9B740B,
+]
+
+def mulAdd(data, size):
+	# MulAddHash of a key of units of size bytes
+	if   size % 4 == 0: units = struct.unpack("@" + str(len(data) // 4) + "I", data)
+	elif size % 4 == 2: units = struct.unpack("@" + str(len(data) // 2) + "H", data)
+	else:               units = bytearray(data)
+	sum = 0
+	for (i, unit) in enumerate(units):
+		sum += primes[i & 15] * unit
+	return sum & 0xFFFFFFFF
+
+def mix64(h):
+	h ^= h >> 33; h = h * 0xFF51AFD7ED558CCD & MASK64
+	h ^= h >> 33; h = h * 0xC4CEB9FE1A85EC53 & MASK64
+	return h ^ h >> 33
+
+def murmur64(data):
+	# PerfectHash of a key, MurmurHash64A of its bytes, then mixed
+	m = 0xC6A4A7935BD1E995
+	data = bytearray(data)
+	length = len(data)
+	h = length * m & MASK64
+	end = length & ~7
+	for p in range(0, end, 8):
+		k = struct.unpack_from("@Q", data, p)[0]
+		k = k * m & MASK64; k ^= k >> 47; k = k * m & MASK64
+		h ^= k; h = h * m & MASK64
+	if length & 7:
+		for i in range(length - 1, end - 1, -1):
+			h ^= data[i] << 8 * (i - end)
+		h = h * m & MASK64
+	return mix64(h)
+
+# a .ft file
+
+def parseFormat(format, sizes = "32"):
+	"""type of the containers of a format string, escaped as on the command
+	line of fasttrie.py, with size types of sizes bits unless given"""
+	return parse(format.encode("utf-8").decode("unicode_escape") if PY3
+			else format.decode("string_escape"), sizes)
+
+def layout(buf, format, sizes = "auto"):
+	# (sizes, type, container) of buf read by format with size types of sizes
+	# bits, or with auto of 32 bits and else 64, the first reading all of buf
+	for bits in sizes == "auto" and ["32", "64"] or [sizes]:
+		type = parseFormat(format, bits)
+		try:
+			(container, end) = type.read(buf, 0)
+		except (ValueError, TypeError, struct.error):
+			continue
+		if end == len(buf): return (bits, type, container)
+	return None
+
+def mapped(filename):
+	f = io.open(filename, "rb")
+	try:
+		m = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+	finally:
+		f.close()
+	return PY3 and memoryview(m) or m
+
+def sizesOf(filename, format):
+	"""size types of a .ft file built with format, "32" or "64" bits, or None
+	if it matches neither"""
+	found = layout(mapped(filename), format)
+	return found and found[0]
+
+def open(filename, format, sizes = "auto"):
+	"""mmap a .ft file built with format, and return its top level container:
+	a Trie, a HashMap, a Vector, or a list of structs; size types not given in
+	format are of sizes bits, 32 or 64, or with auto whichever the file has"""
+	found = layout(mapped(filename), format, sizes)
+	if not found: raise ValueError("size of " + filename + " does not match the format")
+	(bits, type, container) = found
+	if isinstance(type, Struct): return [container[i] for i in range(len(container))]
+	return container[0]
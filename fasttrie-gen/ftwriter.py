@@ -0,0 +1,78 @@
+#!/bin/env python
+
+# FastTrie writer: write binary input of fasttrie.py -i binary from Python
+#
+# Records are written as the builder holds them in memory, so that it copies
+# them in place of parsing text, as described by the same format string as
+# fasttrie.py takes, e.g.:
+#
+#   import ftwriter
+#   f = open("words.bin", "wb")
+#   ftwriter.write(f, r'T(c*)\t(l:f *)\n', [("word", [(1, 0.5)]), ...])
+#   f.close()
+#
+#   fasttrie.py -i binary -f 'T(c*)\t(l:f *)\n' < words.bin > words.ft
+#
+# Records of the outermost container are (key, value) of a Trie or HashMap,
+# keys of a set, items of a Vector or a struct sequence (or text of chars),
+# or the single value of a struct or Pair. Values map from Python as
+# ftreader returns them, and a nested Trie or HashMap is a dict or (key,
+# value) pairs; str is accepted as UTF-8 for c*.
+#
+# The binary input is in native byte order: a struct in C layout, a struct
+# sequence, Vector, Trie or HashMap a uint32_t count and its items (keys and
+# values of a map in turn), a Pair its first then its second, and the
+# outermost container its items up to the end of input without the count.
+
+import struct
+
+import ftreader
+
+__all__ = ["Writer", "write", "encode"]
+
+COUNT = struct.Struct("=I")
+
+def encode(type, value):
+	"""binary input of a value of type, a container of ftreader.parseFormat,
+	as nested in another container"""
+	if isinstance(type, ftreader.Struct): return type.pack(value)
+	if isinstance(type, ftreader.PairOf):
+		return encode(type.sub1, value[0]) + encode(type.sub2, value[1])
+	if isinstance(type, ftreader.VectorOf) and isinstance(type.sub, ftreader.Struct):
+		data = type.pack(value)
+		return COUNT.pack(len(data) // type.sub.size) + data
+
+	if isinstance(value, dict): value = list(value.items())
+	else: value = list(value)
+	return COUNT.pack(len(value)) + b"".join([item(type, x) for x in value])
+
+def item(type, value):
+	# an item of a Vector, or a record of a Trie or HashMap
+	if isinstance(type, ftreader.VectorOf): return encode(type.sub, value)
+	if isinstance(type.sub, ftreader.Bool): return encode(type.key, value)
+	return encode(type.key, value[0]) + encode(type.sub, value[1])
+
+class Writer(object):
+	"""records of the outermost container of a format, written to the binary
+	file f one by one"""
+	def __init__(self, f, format):
+		self.f = f
+		self.type = ftreader.parseFormat(format)
+
+	def write(self, record):
+		type = self.type
+		if isinstance(type, (ftreader.Struct, ftreader.PairOf)):
+			data = encode(type, record)
+		elif isinstance(type, ftreader.VectorOf) and isinstance(type.sub, ftreader.Struct):
+			if type.sub.chars or type.sub.utf16: data = type.pack(record)
+			else: data = type.sub.pack(record)
+		else:
+			data = item(type, record)
+		self.f.write(data)
+
+	def write_many(self, records):
+		for record in records: self.write(record)
+
+def write(f, format, records):
+	"""write records of the outermost container of format to the binary file f"""
+	Writer(f, format).write_many(records)
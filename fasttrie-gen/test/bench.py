@@ -0,0 +1,221 @@
+#!/bin/env python
+
+# FastTrie benchmark: build, dump and look up synthetic data in several
+# container formats, and write the results in JSON to compare versions with
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, time, json
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 100000,
+		help = "number of keys in each container (default: %default)")
+parser.add_option("-l", "--lookups", metavar = "N", type = "int", default = 100000,
+		help = "number of hits and of misses to look up (default: %default)")
+parser.add_option("-r", "--repeat", metavar = "N", type = "int", default = 3,
+		help = "run each step N times and keep the best (default: %default)")
+parser.add_option("-k", "--case", metavar = "NAME", action = "append", default = [],
+		help = "run only the case NAME, may be repeated (default: all cases)")
+parser.add_option("--residency", metavar = "POLICY,...",
+		help = "load the files looked up in by fasttrie.py --residency POLICY,..., "
+				"to compare the first_*_ns latencies of the first lookups after loading")
+parser.add_option("--sizes", metavar = "BITS", choices = ["32", "64"],
+		help = "build and look up by fasttrie.py --sizes BITS, to compare the output "
+				"bytes and lookups of 64-bit size types with 32-bit ones (default: auto)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to benchmark (default: this one)")
+parser.add_option("-o", "--output", metavar = "FILE",
+		help = "write the results to FILE (default: stdout)")
+parser.add_option("-c", "--compare", metavar = "FILE",
+		help = "compare with the results in FILE, and fail on any regression")
+parser.add_option("--tolerance", metavar = "PERCENT", type = "float", default = 20,
+		help = "allowed regression in comparing (default: %default%)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+# synthetic data, the same for the same seed and sizes
+
+alphabet = "etaoinshrdlucmfwypvbgkjqxz0123456789"
+
+def word(rand):
+	# skewed letters and lengths, so that the trie has both dense and sparse nodes
+	return "".join([alphabet[int(rand.paretovariate(1.2)) % len(alphabet)]
+			for i in range(rand.randint(2, 12))])
+
+def words(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(word(rand))
+	return sorted(keys)
+
+def numbers(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(rand.randint(0, 0xFFFFFFFF))
+	return sorted(keys)
+
+def value(rand):
+	return str(rand.randint(-1000000, 1000000))
+
+def features(rand):
+	return "".join(["%d:%.4g " % (rand.randint(0, 999), rand.random())
+			for i in range(rand.randint(1, 4))])
+
+def nested(rand):
+	return "".join(["%s:%s," % (k, value(rand)) for k in words(rand, rand.randint(1, 4))])
+
+# name, format, key generator, record generator
+
+cases = [
+	("trie", r'T(c*)\t(l)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, value(rand))),
+	("trie-uint32", r'T(L)\t(l:f *)\n', numbers,
+			lambda rand, k: "%d\t%s\n" % (k, features(rand))),
+	("trie-features", r'T(c*)\t(l:f *)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, features(rand))),
+	("trie-tail-path", r'T,FT_TAIL|FT_PATH(c*)\t(l)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, value(rand))),
+	("trie-set", r'T(c*)\n', words,
+			lambda rand, k: "%s\n" % k),
+	("hash", r'H(c*)\t(l)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, value(rand))),
+	("hash-uint32", r'H(L)\t(c*)\n', numbers,
+			lambda rand, k: "%d\t%s\n" % (k, word(rand))),
+	("hash-perfect", r'H,PerfectHash(c*)\t(l)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, value(rand))),
+	("hash-perfect-uint32", r'H,PerfectHash(L)\t(c*)\n', numbers,
+			lambda rand, k: "%d\t%s\n" % (k, word(rand))),
+	("vector", r'V(c*)\n', words,
+			lambda rand, k: "%s\n" % k),
+	("trie-pair", r'T(c*)\t(P(l)|(c*))\n', words,
+			lambda rand, k: "%s\t%s|%s\n" % (k, value(rand), word(rand))),
+	("trie-trie", r'T(c*)\t(T(c*):(l),)\n', words,
+			lambda rand, k: "%s\t%s\n" % (k, nested(rand))),
+]
+
+# run fasttrie.py, return the wall time, peak RSS in KB and exit status
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+sizes = options.sizes and ["--sizes", options.sizes] or []
+
+def run(args, input, output):
+	start = time.time()
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree] + sizes + args,
+			stdin = open(input), stdout = open(output, "w"))
+	(pid, status, usage) = os.wait4(p.pid, 0)
+	seconds = time.time() - start
+	if status: raise RuntimeError("fasttrie.py " + " ".join(args) + " failed")
+	return (seconds, usage.ru_maxrss)
+
+def lookup(format, ft, input):
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-b", "-f", format] + sizes
+			+ (options.residency and ["--residency", options.residency] or []) + [ft],
+			stdin = open(input), stdout = subprocess.PIPE)
+	out = p.communicate()[0]
+	if p.returncode: raise RuntimeError("fasttrie.py -b " + ft + " failed")
+	return json.loads(out.decode())
+
+def best(runs, key, reverse = False):
+	return sorted(runs, key = key, reverse = reverse)[0]
+
+def bench(name, format, keys, record, tmpdir):
+	rand = random.Random(options.seed)
+	keys = keys(rand, options.keys + options.lookups)
+
+	# keys not built are looked up as misses
+	rand.shuffle(keys)
+	misses = keys[options.keys:]
+	keys = keys[:options.keys]
+
+	txt = os.path.join(tmpdir, name + ".txt")
+	ft = os.path.join(tmpdir, name + ".ft")
+	out = os.path.join(tmpdir, name + ".out")
+
+	f = open(txt, "w")
+	for k in keys: f.write(record(rand, k))
+	f.close()
+
+	# compile first, so that only building is timed
+	run(["-f", format], os.devnull, os.devnull)
+
+	builds = [run(["-f", format], txt, ft) for i in range(options.repeat)]
+	dumps = [run(["-f", format, ft], os.devnull, out) for i in range(options.repeat)]
+
+	result = {
+		"format": format,
+		"keys": len(keys),
+		"build_seconds": best(builds, lambda x: x[0])[0],
+		"build_peak_rss_kb": best(builds, lambda x: x[1])[1],
+		"output_bytes": os.path.getsize(ft),
+		"dump_seconds": best(dumps, lambda x: x[0])[0],
+	}
+
+	if format[0] in "TH":
+		for (kind, sample) in [("hits", keys), ("misses", misses)]:
+			sample = [sample[i % len(sample)] for i in range(options.lookups)]
+			f = open(os.path.join(tmpdir, name + "." + kind), "w")
+			for k in sample: f.write("%s\n" % k)
+			f.close()
+			result[kind] = best([lookup(format, ft, f.name) for i in range(options.repeat)],
+					lambda x: x["lookups_per_second"], True)
+
+	return result
+
+# compare with earlier results, lower is better unless noted
+
+metrics = [
+	("build_seconds", 1), ("build_peak_rss_kb", 1), ("output_bytes", 1), ("dump_seconds", 1),
+	("hits.lookups_per_second", -1), ("hits.many_lookups_per_second", -1),
+	("hits.p50_ns", 1), ("hits.p99_ns", 1),
+	("misses.lookups_per_second", -1), ("misses.many_lookups_per_second", -1),
+	("misses.p50_ns", 1), ("misses.p99_ns", 1),
+]
+
+def metric(result, name):
+	for part in name.split("."):
+		if part not in result: return None
+		result = result[part]
+	return result
+
+def compare(old, new):
+	regressions = 0
+	for name in sorted(new["cases"]):
+		if name not in old["cases"]: continue
+		for (m, sign) in metrics:
+			a = metric(old["cases"][name], m)
+			b = metric(new["cases"][name], m)
+			if not a or b is None: continue
+			change = (float(b) / a - 1) * 100
+			regressed = change * sign > options.tolerance
+			regressions += regressed
+			sys.stderr.write("%-16s %-28s %14.6g %14.6g %+7.1f%%%s\n"
+					% (name, m, a, b, change, regressed and "  !!!" or ""))
+	return regressions
+
+tmpdir = tempfile.mkdtemp()
+try:
+	results = {
+		"tree": os.path.abspath(options.tree),
+		"date": time.strftime("%Y-%m-%d %H:%M:%S"),
+		"seed": options.seed,
+		"residency": options.residency,
+		"sizes": options.sizes,
+		"cases": {},
+	}
+	for (name, format, keys, record) in cases:
+		if options.case and name not in options.case: continue
+		sys.stderr.write("benchmarking " + name + " " + format + "\n")
+		results["cases"][name] = bench(name, format, keys, record, tmpdir)
+finally:
+	shutil.rmtree(tmpdir)
+
+out = options.output and open(options.output, "w") or sys.stdout
+json.dump(results, out, indent = 1, sort_keys = True)
+out.write("\n")
+out.close()
+
+if options.compare and compare(json.load(open(options.compare)), results):
+	sys.stderr.write("!!!regressions over %g%%!!!\n" % options.tolerance)
+	sys.exit(1)
@@ -0,0 +1,47 @@
+if [ $# -lt 1 ]; then
+  echo "!!!Incomplete input!!!"
+  echo "Usage: ./build_bench.sh <old tree> [<keys> [<format>]]"
+  echo "  old tree: another checkout of FastTrie to compare with, e.g. made by"
+  echo "            git archive --prefix=old/ HEAD~1 | tar x -C /tmp"
+  echo "  keys:     number of random keys to build (default: 10000000)"
+  echo "  format:   container format (default: 'T(c*)\t(l)\n')"
+  exit 1
+fi
+old=$1
+keys=${2:-10000000}
+format=${3:-'T(c*)\t(l)\n'}
+new=$(cd $(dirname $0)/../..; pwd)
+python=${PYTHON:-python}
+tmp=$(mktemp -d)
+trap "rm -rf $tmp" EXIT
+
+echo "generating $keys keys"
+# random bytes from '!' to 0xFF, which make a dense 256-branches trie
+LC_ALL=C awk -v n=$keys 'BEGIN {
+  srand(1)
+  for (i = 0; i < n; i ++) {
+    k = ""; l = 3 + int(rand() * 6)
+    for (j = 0; j < l; j ++) k = k sprintf("%c", 33 + int(rand() * 223))
+    print k "\t" i
+  }
+}' > $tmp/input
+
+# compile first, so that only building is timed
+for tree in $old $new; do
+  $python $tree/fasttrie-gen/fasttrie.py -I $tree -f "$format" < /dev/null > /dev/null
+done
+
+for name in old new; do
+  eval tree=\$$name
+  start=$(date +%s.%N)
+  $python $tree/fasttrie-gen/fasttrie.py -I $tree -f "$format" < $tmp/input > $tmp/$name.ft
+  end=$(date +%s.%N)
+  echo "$name ($tree): $(awk "BEGIN { print $end - $start }") s"
+done
+
+if cmp -s $tmp/old.ft $tmp/new.ft; then
+  echo "outputs are identical"
+else
+  echo "!!!outputs differ!!!"
+  exit 1
+fi
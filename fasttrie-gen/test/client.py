@@ -0,0 +1,203 @@
+#!/bin/env python
+
+# FastTrie client test: build synthetic data in several container formats,
+# and check lookups of ftclient against fasttrie.py -p, one by one, at once
+# and from many threads, and prefixes against fasttrie.py --prefix, with
+# -p alike whatever the --residency, and built by --sizes 64, and keys read
+# in at once looked up and written in batches
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, threading, time, socket
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 2000,
+		help = "number of keys in each container (default: %default)")
+parser.add_option("-k", "--case", metavar = "NAME", action = "append", default = [],
+		help = "run only the case NAME, may be repeated (default: all cases)")
+parser.add_option("-T", "--threads", metavar = "N", type = "int", default = 8,
+		help = "number of threads looking up at once (default: %default)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to test (default: this one)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+sys.path.insert(0, os.path.join(options.tree, "fasttrie-gen"))
+import ftclient
+
+alphabet = "etaoinshrdlucmfwypvbgkjqxz0123456789"
+
+def word(rand):
+	return "".join([alphabet[int(rand.paretovariate(1.2)) % len(alphabet)]
+			for i in range(rand.randint(1, 12))])
+
+def words(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(word(rand))
+	return sorted(keys)
+
+def numbers(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add("%d" % rand.randint(0, 0xFFFFFFFF))
+	return sorted(keys)
+
+def number(rand): return "%d" % rand.randint(-1000000, 1000000)
+def nested(rand): return "".join(["%s:%d," % (k, rand.randint(-9, 9))
+		for k in words(rand, rand.randint(1, 4))])
+
+# name, format, key generator, value generator (None for sets)
+
+cases = [
+	("trie", r'T(c*)\t(l)\n', words, number),
+	("trie-trie", r'T(c*)\t(T(c*):(l),)\n', words, nested),
+	("trie-set", r'T(c*)\n', words, None),
+	("hash", r'H(c*)\t(l)\n', words, number),
+	("hash-perfect-uint32", r'H,PerfectHash(L)\t(c*)\n', numbers, lambda rand: word(rand)),
+]
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+def check(name, condition):
+	if not condition: raise AssertionError(name)
+
+# the writes of fasttrie.py args to stdout, one message of a socket each,
+# for lines of stdin in a file, or in a pipe filled before it starts
+def writes(args, lines, piped = False):
+	data = "".join([k + "\n" for k in lines]).encode()
+	if piped:
+		(stdin, w) = os.pipe()
+		os.write(w, data)
+		os.close(w)
+	else:
+		stdin = tempfile.TemporaryFile()
+		stdin.write(data)
+		stdin.seek(0)
+
+	(ours, theirs) = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree] + args,
+			stdin = stdin, stdout = theirs)
+	theirs.close()
+	if piped: os.close(stdin)
+	else: stdin.close()
+
+	messages = []
+	while True:
+		message = ours.recv(1 << 20)
+		if not message: break
+		messages.append(message)
+	ours.close()
+	if p.wait(): raise RuntimeError("fasttrie.py " + " ".join(args) + " failed")
+
+	return messages
+
+def test(name, format, keys, value, tmpdir):
+	rand = random.Random(options.seed)
+	keys = keys(rand, options.keys * 2)
+	rand.shuffle(keys)
+	(keys, misses) = (keys[:options.keys], keys[options.keys:])
+
+	txt = os.path.join(tmpdir, name + ".txt")
+	ft = os.path.join(tmpdir, name + ".ft")
+
+	f = open(txt, "w")
+	for k in sorted(keys):
+		f.write(value and "%s\t%s\n" % (k, value(rand)) or "%s\n" % k)
+	f.close()
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format],
+			stdin = open(txt), stdout = open(ft, "w"))
+	if p.wait(): raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+	# values printed by -p, in text, are what the client returns
+	sample = keys + misses
+	rand.shuffle(sample)
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format, "-p", ft],
+			stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+	out = p.communicate("".join([k + "\n" for k in sample]).encode())[0]
+	# and the same whatever the residency of the file
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format, "-p",
+			"--residency", "random,mlock,warmup", ft], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+	check("-p --residency", p.communicate("".join([k + "\n" for k in sample]).encode())[0] == out)
+	# and built by 64-bit sizes, read by those it was built with
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+			"--sizes", "64"], stdin = open(txt), stdout = open(ft + "64", "w"))
+	if p.wait(): raise RuntimeError("fasttrie.py -f " + format + " --sizes 64 failed")
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format, "-p",
+			ft + "64"], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+	check("-p --sizes 64", p.communicate("".join([k + "\n" for k in sample]).encode())[0] == out)
+	# keys read in are looked up by findMany 4096 at a time, each batch
+	# written at once, from a file or a pipe, here misses of short lines
+	many = (misses * (10000 // len(misses) + 1))[:10000]
+	check("-p batches", len(writes(["-f", format, "-p", ft], many)) == 3)
+	check("-p piped batches", len(writes(["-f", format, "-p", ft], many[:4000], True)) == 1)
+	expected = {}
+	for (k, v) in zip(sample, out.split(b"\n")):
+		if value: expected[k] = k in keys and v or None
+		else: expected[k] = k in keys or None
+
+	client = ftclient.Client(ft, format, tree = options.tree, python = options.python)
+	try:
+		for k in sample[:200]:
+			check("get", client.get(k) == expected[k])
+			check("in", (k in client) == (expected[k] is not None))
+		check("get_many", client.get_many(sample) == [expected[k] for k in sample])
+		check("get_many default", client.get_many(misses[:10], 0) == [0] * 10)
+
+		errors = []
+		def lookup(i):
+			try:
+				part = sample[i::options.threads]
+				futures = [client.submit(k) for k in part[:100]]
+				check("threads submit", [f.result() for f in futures]
+						== [expected[k] for k in part[:100]])
+				check("threads get_many", client.get_many(part) == [expected[k] for k in part])
+			except AssertionError:
+				errors.append(sys.exc_info()[1])
+		threads = [threading.Thread(target = lookup, args = (i,)) for i in range(options.threads)]
+		for t in threads: t.start()
+		for t in threads: t.join()
+		if errors: raise errors[0]
+
+		if format[0] == "T":
+			# --prefix prints the records of prefix in text, at most --limit of them
+			prefixes = ["e", "et", "0"] + sample[:20]
+			for limit in [[], ["--limit", "3"]]:
+				p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+						"--prefix"] + limit + [ft], stdin = subprocess.PIPE, stdout = subprocess.PIPE)
+				out = p.communicate("".join([k + "\n" for k in prefixes]).encode())[0]
+				expected = b""
+				for k in prefixes:
+					records = client.prefix(k)[:limit and 3 or None]
+					check("prefix keys", [value and r[0] or r for r in records]
+							== [x.encode() for x in sorted(keys) if x.startswith(k)][:limit and 3 or None])
+					for r in records:
+						expected += value and r[0] + b"\t" + r[1] + b"\n" or r + b"\n"
+					expected += b"\n"
+				check("--prefix " + " ".join(limit), out == expected)
+			check("--prefix batches", len(writes(["-f", format, "--prefix", ft], prefixes)) == 1)
+
+		start = time.time()
+		client.get_many(sample)
+		seconds = time.time() - start
+	finally:
+		check("close", client.close() == 0)
+
+	return len(sample) / seconds
+
+tmpdir = tempfile.mkdtemp()
+failures = 0
+try:
+	for (name, format, keys, value) in cases:
+		if options.case and name not in options.case: continue
+		try:
+			rate = test(name, format, keys, value, tmpdir)
+			sys.stderr.write("%-20s %-28s ok, %.0f keys/s at once\n" % (name, format, rate))
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-20s %-28s !!!failed: %s!!!\n" % (name, format, sys.exc_info()[1]))
+finally:
+	shutil.rmtree(tmpdir)
+
+sys.exit(failures and 1 or 0)
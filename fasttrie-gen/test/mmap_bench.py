@@ -0,0 +1,194 @@
+#!/bin/env python
+
+# FastTrie MMap benchmark: open, copy and look up through handles of one
+# mapped .ft file from 1 thread to many at once, as a query server does per
+# request, and write the throughput of each thread count in JSON, so that
+# locking in MMap shows as throughput not scaling with threads; with -c,
+# the same for another checkout to compare with
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, json
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--ops", metavar = "N", type = "int", default = 200000,
+		help = "number of operations of each thread in each step (default: %default)")
+parser.add_option("-j", "--threads", metavar = "N,...", default = "1,2,4,8,16,32,64",
+		help = "thread counts to run with (default: %default)")
+parser.add_option("-r", "--repeat", metavar = "N", type = "int", default = 3,
+		help = "run each step N times and keep the best (default: %default)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to benchmark (default: this one)")
+parser.add_option("-c", "--compare", metavar = "DIR",
+		help = "another checkout to benchmark alike, e.g. made by "
+		"git archive --prefix=old/ HEAD~1 | tar x -C /tmp")
+parser.add_option("-o", "--output", metavar = "FILE",
+		help = "write the results to FILE (default: stdout)")
+parser.add_option("--cxx", metavar = "PATH", default = os.getenv("CXX", "g++"),
+		help = "C++ compiler (default: $CXX or g++)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+format = r'T(c*)\t(l)\n'
+
+# the threads wait for all to be created, run one step, and wait for all to
+# end, and the step takes from their release to the last end
+source = r'''
+#include "FastTrie.h"
+
+#include <pthread.h>
+#include <sys/time.h>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <vector>
+
+using namespace ft2;
+
+typedef Container<Trie<int> > ContainerT;
+
+static const char *filename;
+static const ContainerT *shared;
+static long ops;
+static pthread_barrier_t barrier;
+static volatile long sink;
+
+static double now()
+{
+	struct timeval tv;
+	gettimeofday(&tv, 0);
+	return tv.tv_sec + tv.tv_usec * 1e-6;
+}
+
+// a handle of the file by its name, as a request opening it
+static long opens(long n)
+{
+	long x = 0;
+	for (long i = 0; i < n; i ++)
+	{
+		ContainerT container(filename);
+		x += container.mmap().second;
+	}
+	return x;
+}
+
+// a copy of a handle, as a request given the container
+static long copies(long n)
+{
+	long x = 0;
+	for (long i = 0; i < n; i ++)
+	{
+		ContainerT container(*shared);
+		x += container.mmap().second;
+	}
+	return x;
+}
+
+// a copy of a handle and a lookup through it
+static long lookups(long n)
+{
+	static const char *keys[] = { "e", "et", "eta", "etao", "x" };
+	long x = 0;
+	for (long i = 0; i < n; i ++)
+	{
+		ContainerT container(*shared);
+		x += container[0](keys[i % 5]);
+	}
+	return x;
+}
+
+static long (*step)(long);
+
+static void *run(void *)
+{
+	pthread_barrier_wait(&barrier);
+	sink += step(ops);
+	pthread_barrier_wait(&barrier);
+	return 0;
+}
+
+int main(int argc, char **argv)
+{
+	if (argc < 5) return 1;
+	filename = argv[1];
+	size_t threads = atoi(argv[2]);
+	ops = atol(argv[3]);
+	const char *name = argv[4];
+
+	ContainerT container(filename);
+	shared = &container;
+	step = strcmp(name, "open") == 0 ? opens : strcmp(name, "copy") == 0 ? copies : lookups;
+
+	std::vector<pthread_t> ids(threads);
+	pthread_barrier_init(&barrier, 0, threads + 1);
+	for (size_t i = 0; i < threads; i ++) pthread_create(&ids[i], 0, run, 0);
+	double start = now();
+	pthread_barrier_wait(&barrier);
+	pthread_barrier_wait(&barrier);
+	double seconds = now() - start;
+	for (size_t i = 0; i < threads; i ++) pthread_join(ids[i], 0);
+
+	printf("%.6f\n", seconds);
+	return 0;
+}
+'''
+
+steps = ["open", "copy", "lookup"]
+
+def compile(tree, tmpdir, name):
+	cpp = os.path.join(tmpdir, name + ".cpp")
+	binary = os.path.join(tmpdir, name)
+	f = open(cpp, "w")
+	f.write(source)
+	f.close()
+	p = subprocess.Popen([options.cxx, "-O3", "-pthread", "-I", tree,
+			"-I", os.path.join(tree, "fasttrie-gen"), "-o", binary, cpp, "-lrt"])
+	if p.wait(): raise RuntimeError("compiling against " + tree + " failed")
+	return binary
+
+def bench(binary, ft, threads, step):
+	best = None
+	for i in range(options.repeat):
+		p = subprocess.Popen([binary, ft, str(threads), str(options.ops), step],
+				stdout = subprocess.PIPE)
+		out = p.communicate()[0]
+		if p.returncode: raise RuntimeError(binary + " " + step + " failed")
+		seconds = float(out)
+		if best is None or seconds < best: best = seconds
+	return best
+
+def results(tree, name, ft, tmpdir):
+	binary = compile(tree, tmpdir, name)
+	out = {"tree": os.path.abspath(tree), "steps": {}}
+	for step in steps:
+		rows = out["steps"][step] = []
+		for threads in [int(x) for x in options.threads.split(",")]:
+			seconds = bench(binary, ft, threads, step)
+			rows.append({"threads": threads, "seconds": round(seconds, 6),
+					"mops_per_second": round(threads * options.ops / max(seconds, 1e-9) / 1e6, 3)})
+			sys.stderr.write("%-4s %-8s %3d threads: %8.3f Mops/s\n"
+					% (name, step, threads, rows[-1]["mops_per_second"]))
+	return out
+
+tmpdir = tempfile.mkdtemp()
+try:
+	rand = random.Random(1)
+	keys = set()
+	while len(keys) < 10000:
+		keys.add("".join([rand.choice("etaox") for i in range(rand.randint(1, 8))]))
+	ft = os.path.join(tmpdir, "bench.ft")
+	p = subprocess.Popen([options.python, os.path.join(options.tree, "fasttrie-gen", "fasttrie.py"),
+			"-I", options.tree, "-f", format], stdin = subprocess.PIPE, stdout = open(ft, "w"))
+	p.communicate("".join(["%s\t%d\n" % (k, i) for (i, k) in enumerate(sorted(keys))]).encode())
+	if p.returncode: raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+	report = {"cpus": os.sysconf("SC_NPROCESSORS_ONLN"), "ops": options.ops,
+			"new": results(options.tree, "new", ft, tmpdir)}
+	if options.compare: report["old"] = results(options.compare, "old", ft, tmpdir)
+finally:
+	shutil.rmtree(tmpdir)
+
+output = options.output and open(options.output, "w") or sys.stdout
+json.dump(report, output, indent = 2, sort_keys = True)
+output.write("\n")
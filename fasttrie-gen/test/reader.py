@@ -0,0 +1,191 @@
+#!/bin/env python
+
+# FastTrie reader test: build synthetic data in several container formats,
+# and check lookups, misses and iteration of ftreader against the data
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, struct
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 2000,
+		help = "number of keys in each container (default: %default)")
+parser.add_option("-k", "--case", metavar = "NAME", action = "append", default = [],
+		help = "run only the case NAME, may be repeated (default: all cases)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to test (default: this one)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+sys.path.insert(0, os.path.join(options.tree, "fasttrie-gen"))
+import ftreader
+
+# synthetic data, as text records and as the values the reader returns
+
+alphabet = "etaoinshrdlucmfwypvbgkjqxz0123456789"
+
+def word(rand):
+	return "".join([alphabet[int(rand.paretovariate(1.2)) % len(alphabet)]
+			for i in range(rand.randint(1, 12))])
+
+def words(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(word(rand))
+	return sorted(keys)
+
+def numbers(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(rand.randint(0, 0xFFFFFFFF))
+	return sorted(keys)
+
+def f32(x):
+	return struct.unpack("f", struct.pack("f", x))[0]
+
+def text(k):
+	return isinstance(k, str) and k or "%d" % k
+
+def key(k):
+	return isinstance(k, str) and k.encode() or k
+
+def number(rand):
+	v = rand.randint(-1000000, 1000000)
+	return ("%d" % v, v)
+
+def features(rand):
+	v = [(rand.randint(0, 999), f32(rand.randint(0, 9999) / 1024.0))
+			for i in range(rand.randint(1, 4))]
+	return ("".join(["%d:%r " % x for x in v]), v)
+
+def nested(rand):
+	v = dict([(k.encode(), rand.randint(-1000, 1000)) for k in words(rand, rand.randint(1, 4))])
+	return ("".join(["%s:%d," % (k.decode(), v[k]) for k in sorted(v)]), v)
+
+def pair(rand):
+	(a, b) = (rand.randint(-1000, 1000), word(rand))
+	return ("%d|%s" % (a, b), (a, b.encode()))
+
+def string(rand):
+	v = word(rand)
+	return (v, v.encode())
+
+# name, format, key generator, value generator (None for sets and vectors)
+
+cases = [
+	("trie", r'T(c*)\t(l)\n', words, number),
+	("trie-tail-path", r'T,FT_TAIL|FT_PATH(c*)\t(l)\n', words, number),
+	("trie-no-tail", r'T,0(c*)\t(l)\n', words, number),
+	("trie-alphabet", r'T,FT_TAIL|FT_ALPHABET(c*)\t(l)\n', words, number),
+	("trie-alphabet-path", r'T,FT_PATH|FT_ALPHABET(c*)\t(T,FT_ALPHABET(c*):(l),)\n', words, nested),
+	("trie-uint16-size", r'T,FT_TAIL,uint8_t,uint16_t(c*)\t(l)\n', words, number),
+	("trie-64", r'T,64(c*)\t(l:f *)\n', words, features),
+	("trie-uint32", r'T(L)\t(c*)\n', numbers, string),
+	("trie-struct-seq", r'T(c*)\t(l:f *)\n', words, features),
+	("trie-trie", r'T(c*)\t(T(c*):(l),)\n', words, nested),
+	("trie-pair", r'T(c*)\t(P(l)|(c*))\n', words, pair),
+	("trie-set", r'T(c*)\n', words, None),
+	("hash", r'H(c*)\t(l)\n', words, number),
+	("hash-perfect", r'H,PerfectHash(c*)\t(l)\n', words, number),
+	("hash-uint32", r'H(L)\t(c*)\n', numbers, string),
+	("hash-perfect-uint32", r'H,PerfectHash(L)\t(c*)\n', numbers, string),
+	("hash-perfect-64", r'H,PerfectHash,64(c*)\t(l)\n', words, number),
+	("hash-set", r'H(c*)\n', words, None),
+	("vector", r'V(c*)\n', words, None),
+	("vector-64", r'V,64(c*)\n', words, None),
+]
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+def build(format, input, output):
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format],
+			stdin = open(input), stdout = open(output, "w"))
+	if p.wait(): raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+def check(name, condition):
+	if not condition: raise AssertionError(name)
+
+def test(name, format, keys, value, tmpdir):
+	rand = random.Random(options.seed)
+	keys = keys(rand, options.keys * 2)
+	rand.shuffle(keys)
+	(keys, misses) = (keys[:options.keys], keys[options.keys:])
+
+	txt = os.path.join(tmpdir, name + ".txt")
+	ft = os.path.join(tmpdir, name + ".ft")
+
+	data = {}
+	f = open(txt, "w")
+	for k in keys:
+		if value:
+			(t, v) = value(rand)
+			f.write("%s\t%s\n" % (text(k), t))
+		else:
+			(t, v) = ("", True)
+			f.write("%s\n" % text(k))
+		data[key(k)] = v
+	f.close()
+	build(format, txt, ft)
+
+	container = ftreader.open(ft, format)
+
+	if format[0] == "V":
+		check("vector", list(container) == [key(k) for k in keys])
+		return
+
+	def value_of(v):
+		if isinstance(v, ftreader.Vector): return [value_of(x) for x in v]
+		if isinstance(v, ftreader.Trie): return dict(v.items())
+		return v
+
+	check("len", len(container) == len(data))
+	for k in data:
+		check("in", k in container)
+		check("get", value_of(container.get(k)) == data[k])
+		check("getitem", value_of(container[k]) == data[k])
+	for k in misses:
+		k = key(k)
+		check("not in", k not in container)
+		check("get default", container.get(k, -1) == -1)
+		try:
+			container[k]
+			check("getitem KeyError", False)
+		except KeyError:
+			pass
+
+	sample = list(data) + [key(k) for k in misses]
+	many = container.get_many(sample, 0)
+	check("get_many", [value_of(v) for v in many]
+			== [data.get(k, 0) for k in sample])
+
+	items = [(k, value_of(v)) for (k, v) in container.items()]
+	check("items", sorted(items) == sorted(data.items()))
+
+	if format[0] == "T" and isinstance(keys[0], str):
+		check("items order", [k for (k, v) in items] == sorted(data))
+		for prefix in ["", "e", "et", "zz", keys[0][:3], keys[0], keys[0] + "x"]:
+			prefix = prefix.encode()
+			check("items prefix '" + prefix.decode() + "'",
+					container.keys(prefix) == [k for k in sorted(data) if k.startswith(prefix)])
+	elif format[0] == "H" and isinstance(keys[0], str):
+		for prefix in ["e", keys[0][:2]]:
+			prefix = prefix.encode()
+			check("items prefix '" + prefix.decode() + "'",
+					sorted(container.keys(prefix)) == [k for k in sorted(data) if k.startswith(prefix)])
+
+tmpdir = tempfile.mkdtemp()
+failures = 0
+try:
+	for (name, format, keys, value) in cases:
+		if options.case and name not in options.case: continue
+		try:
+			test(name, format, keys, value, tmpdir)
+			sys.stderr.write("%-20s %-32s ok\n" % (name, format))
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-20s %-32s !!!failed: %s!!!\n" % (name, format, sys.exc_info()[1]))
+finally:
+	shutil.rmtree(tmpdir)
+
+sys.exit(failures and 1 or 0)
@@ -18,8 +18,8 @@ echo "==========================================================================
 echo "=================================================================================="
 echo "Dump FT--Starts"
 echo "=================================================================================="
-#python ../fasttrie.py -f 'T,FT_TAIL|FT_PATH(c*)\t(l:f *)\n' $input.ft 
-python ../fasttrie.py -f 'T,FT_TAIL|FT_PATH(L)\t(l:f *)\n' $input.ft 
+#python ../fasttrie.py -f 'T(c*)\t(l:f *)\n' $input.ft
+python ../fasttrie.py -f 'T(L)\t(l:f *)\n' $input.ft
 echo "=================================================================================="
 echo "Dump FT--Ends"
 echo "=================================================================================="
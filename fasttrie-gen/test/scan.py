@@ -0,0 +1,108 @@
+#!/bin/env python
+
+# FastTrie scan test: scan synthetic documents for the keys of a Trie with
+# fasttrie.py --scan, and check every match and the longest leftmost ones
+# against scanning in Python, with documents of several chunks, in one
+# thread and many, where periodic text moves the parse of longest matches
+# off the beginnings of chunks
+
+import sys, os, optparse, random, subprocess, tempfile, shutil
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 5000,
+		help = "number of keys in the Trie (default: %default)")
+parser.add_option("-m", "--megabytes", metavar = "MB", type = "int", default = 9,
+		help = "size of the larger documents, in chunks of 4 MB (default: %default)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to test (default: this one)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+format = r'T(c*)\t(l)\n'
+alphabet = "etaoinshr"
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+def check(name, condition):
+	if not condition: raise AssertionError(name)
+
+def write(filename, data):
+	f = open(filename, "wb")
+	f.write(data.encode())
+	f.close()
+
+def expected(data, text, longest, name = ""):
+	# matches beginning at each offset, shortest first, or the longest one
+	# leftmost first
+	size = max([len(k) for k in data])
+	out = []
+	i = 0
+	while i < len(text):
+		ends = [j for j in range(i + 1, min(len(text), i + size) + 1) if text[i:j] in data]
+		if longest: ends = ends[-1:]
+		for j in ends:
+			out.append("%s%d\t%s\t%s\n" % (name and name + "\t", i, text[i:j], data[text[i:j]]))
+		if longest and ends: i = ends[0]
+		else: i += 1
+	return "".join(out)
+
+def scan(mode, jobs, ft, documents):
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+			"--scan", mode, "-j", str(jobs), ft] + documents,
+			stdout = subprocess.PIPE, stderr = subprocess.PIPE)
+	(out, err) = p.communicate()
+	if p.returncode: raise RuntimeError("fasttrie.py --scan " + mode + " failed")
+	check("throughput", b'"mb_per_second": ' in err)
+	return out.decode()
+
+tmpdir = tempfile.mkdtemp()
+failures = 0
+try:
+	rand = random.Random(options.seed)
+	keys = set(["e" * 10])
+	while len(keys) < options.keys:
+		keys.add("".join([rand.choice(alphabet) for i in range(rand.randint(1, 7))]))
+	data = dict([(k, "%d" % rand.randint(-1000, 1000)) for k in keys])
+
+	txt = os.path.join(tmpdir, "keys.txt")
+	ft = os.path.join(tmpdir, "keys.ft")
+	write(txt, "".join(["%s\t%s\n" % (k, data[k]) for k in sorted(data)]))
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format],
+			stdin = open(txt), stdout = open(ft, "w"))
+	if p.wait(): raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+	size = options.megabytes << 20
+	texts = [
+		("small", "".join([rand.choice(alphabet + " ") for i in range(100000)])),
+		("random", "".join([rand.choice(alphabet + " ") for i in range(size // 2)])),
+		("periodic", "e" * size),
+	]
+	for (name, text) in texts: write(os.path.join(tmpdir, name), text)
+
+	for (name, mode, documents) in [
+			("all", "all", ["small", "random"]),
+			("longest", "longest", ["random"]),
+			("longest-periodic", "longest", ["periodic"]),
+			("longest-documents", "longest", ["small", "periodic", "small"])]:
+		try:
+			text = dict(texts)
+			if len(documents) == 1: want = expected(data, text[documents[0]], mode == "longest")
+			else:
+				want = "".join([expected(data, text[d], mode == "longest", os.path.join(tmpdir, d))
+						for d in documents])
+			for jobs in [1, 4]:
+				check("-j %d" % jobs, scan(mode, jobs, ft,
+						[os.path.join(tmpdir, d) for d in documents]) == want)
+			sys.stderr.write("%-20s ok\n" % name)
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-20s !!!failed: %s!!!\n" % (name, sys.exc_info()[1]))
+finally:
+	shutil.rmtree(tmpdir)
+
+sys.exit(failures and 1 or 0)
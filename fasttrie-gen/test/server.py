@@ -0,0 +1,218 @@
+#!/bin/env python
+
+# FastTrie server test: serve synthetic data on a UNIX socket with
+# fasttrie.py --serve, and check lookups, prefixes and matchAll of many
+# clients at once, latency counters, a new file renamed over the one served
+# taking over with the old one unmapped, and the socket cleaned up on SIGTERM
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, threading, time, signal, socket
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 5000,
+		help = "number of keys in each container (default: %default)")
+parser.add_option("-C", "--clients", metavar = "N", type = "int", default = 8,
+		help = "number of clients looking up at once (default: %default)")
+parser.add_option("-j", "--jobs", metavar = "N", type = "int", default = 4,
+		help = "number of threads of the server (default: %default)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to test (default: this one)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+sys.path.insert(0, os.path.join(options.tree, "fasttrie-gen"))
+import ftclient
+
+alphabet = "etaoinshrdlucmfwypvbgkjqxz"
+
+def word(rand):
+	return "".join([alphabet[int(rand.paretovariate(1.2)) % len(alphabet)]
+			for i in range(rand.randint(1, 8))])
+
+def words(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(word(rand))
+	return sorted(keys)
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+def check(name, condition):
+	if not condition: raise AssertionError(name)
+
+def build(format, data, ft):
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format],
+			stdin = subprocess.PIPE, stdout = open(ft, "w"))
+	p.communicate("".join(["%s\t%s\n" % (k, data[k]) for k in sorted(data)]).encode())
+	if p.returncode: raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+def serve(format, ft, sock):
+	# start a server, and wait for it to accept connections
+	server = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+			"-j", str(options.jobs), "--serve", sock, ft], stderr = subprocess.PIPE)
+	for i in range(600):
+		probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		try:
+			probe.connect(sock)
+			return server
+		except socket.error:
+			if server.poll() is not None: raise RuntimeError("fasttrie.py --serve failed")
+			time.sleep(0.1)
+		finally:
+			probe.close()
+	raise RuntimeError("fasttrie.py --serve timed out")
+
+def stop(server, sock):
+	server.send_signal(signal.SIGTERM)
+	err = server.communicate()[1]
+	check("server exit", server.returncode == 0)
+	check("socket removed", not os.path.exists(sock))
+	return err
+
+def b(text): return text.encode()
+
+def mappings(pid, filename):
+	# names of the mappings of filename, or of files deleted of it, by a
+	# process and its children
+	pids = [pid]
+	for name in os.listdir("/proc"):
+		try:
+			if name.isdigit() and int(open("/proc/%s/stat" % name).read().split(")")[-1].split()[1]) == pid:
+				pids.append(int(name))
+		except (IOError, OSError):
+			pass
+	names = set()
+	for p in pids:
+		try: maps = open("/proc/%d/maps" % p).read()
+		except (IOError, OSError): continue
+		for line in maps.split("\n"):
+			name = line.split(None, 5)[5:]
+			if name and name[0] in [filename, filename + " (deleted)"]: names.add(name[0])
+	return names
+
+def test_trie(tmpdir):
+	format = r'T(c*)\t(l)\n'
+	rand = random.Random(options.seed)
+	keys = words(rand, options.keys * 2)
+	rand.shuffle(keys)
+	misses = keys[options.keys:]
+	data = dict([(k, "%d" % rand.randint(-1000000, 1000000)) for k in keys[:options.keys]])
+
+	ft = os.path.join(tmpdir, "trie.ft")
+	sock = os.path.join(tmpdir, "trie.sock")
+	build(format, data, ft)
+	server = serve(format, ft, sock)
+
+	def prefix(p):
+		return [(b(k), b(data[k])) for k in sorted(data) if k.startswith(p)]
+
+	def match_all(text):
+		return [(b(text[i:j]), b(data[text[i:j]])) for i in range(len(text) + 1)
+				for j in range(i, len(text) + 1) if text[i:j] in data]
+
+	errors = []
+	def lookup(i):
+		try:
+			client = ftclient.Client(None, format, socket = sock)
+			try:
+				part = (list(data) + misses)[i::options.clients]
+				check("get_many", client.get_many(part)
+						== [k in data and b(data[k]) or None for k in part])
+				for k in part[:50]:
+					check("get", client.get(k) == (k in data and b(data[k]) or None))
+					check("prefix " + k, client.prefix(k[:2]) == prefix(k[:2]))
+					text = " ".join([word(rand) for j in range(3)])
+					check("match_all " + text, client.match_all(text) == match_all(text))
+				futures = [client.submit(k, ftclient.PREFIX) for k in alphabet]
+				check("prefixes at once", [client.records(f.result()) for f in futures]
+						== [prefix(k) for k in alphabet])
+			finally:
+				client.close()
+		except AssertionError:
+			errors.append(sys.exc_info()[1])
+
+	try:
+		threads = [threading.Thread(target = lookup, args = (i,)) for i in range(options.clients)]
+		for t in threads: t.start()
+		for t in threads: t.join()
+		if errors: raise errors[0]
+
+		client = ftclient.Client(None, format, socket = sock)
+		stats = client.stats()
+		client.close()
+		check("stats", stats["find"]["requests"] >= len(data) + len(misses)
+				and stats["prefix"]["requests"] > 0 and stats["match_all"]["requests"] > 0
+				and stats["find"]["p50_ns"] <= stats["find"]["p99_ns"] <= stats["find"]["max_ns"])
+
+		# a new file renamed over the one served takes over within seconds,
+		# while a client keeps looking up, and the old one is unmapped
+		old = dict(data)
+		for k in list(data)[::2]: data[k] = "%d" % (int(data[k]) + 1)
+		build(format, data, ft + ".new")
+		client = ftclient.Client(None, format, socket = sock)
+		try:
+			part = list(data)[:100]
+			os.rename(ft + ".new", ft)
+			for i in range(100):
+				values = client.get_many(part)
+				check("old or new values", values == [b(old[k]) for k in part]
+						or values == [b(data[k]) for k in part])
+				if values == [b(data[k]) for k in part]: break
+				time.sleep(0.1)
+			check("reloaded", client.get_many(list(data)) == [b(data[k]) for k in data])
+			for i in range(50):
+				if mappings(server.pid, ft) == set([ft]): break
+				time.sleep(0.1)
+			check("old file unmapped", mappings(server.pid, ft) == set([ft]))
+		finally:
+			client.close()
+
+		# a second server does not take over the socket
+		second = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+				"--serve", sock, ft], stderr = subprocess.PIPE)
+		check("second server fails", second.communicate()[1] and second.returncode != 0)
+	finally:
+		err = stop(server, sock)
+	check("latencies at exit", b'"find": {"requests": ' in err)
+
+def test_hash(tmpdir):
+	format = r'H,PerfectHash(c*)\t(l)\n'
+	rand = random.Random(options.seed)
+	data = dict([(k, "%d" % rand.randint(-9, 9)) for k in words(rand, options.keys)])
+
+	ft = os.path.join(tmpdir, "hash.ft")
+	sock = os.path.join(tmpdir, "hash.sock")
+	build(format, data, ft)
+	server = serve(format, ft, sock)
+	try:
+		client = ftclient.Client(None, format, socket = sock)
+		try:
+			check("get_many", client.get_many(list(data)) == [b(data[k]) for k in data])
+			try:
+				client.prefix("e")
+				check("prefix of a HashMap fails", False)
+			except ValueError:
+				pass
+		finally:
+			client.close()
+	finally:
+		stop(server, sock)
+
+tmpdir = tempfile.mkdtemp()
+failures = 0
+try:
+	for (name, test) in [("trie", test_trie), ("hash", test_hash)]:
+		try:
+			start = time.time()
+			test(tmpdir)
+			sys.stderr.write("%-8s ok, %.1f s\n" % (name, time.time() - start))
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-8s !!!failed: %s!!!\n" % (name, sys.exc_info()[1]))
+finally:
+	shutil.rmtree(tmpdir)
+
+sys.exit(failures and 1 or 0)
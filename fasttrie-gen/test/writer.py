@@ -0,0 +1,222 @@
+#!/bin/env python
+
+# FastTrie writer test: write synthetic data in several container formats
+# both as text and by ftwriter, and check that fasttrie.py -i binary builds
+# the same .ft file from the binary input as from the text
+
+import sys, os, optparse, random, subprocess, tempfile, shutil, struct
+
+parser = optparse.OptionParser(usage = "\n  %prog [options]")
+parser.add_option("-n", "--keys", metavar = "N", type = "int", default = 2000,
+		help = "number of keys in each container (default: %default)")
+parser.add_option("-k", "--case", metavar = "NAME", action = "append", default = [],
+		help = "run only the case NAME, may be repeated (default: all cases)")
+parser.add_option("-t", "--tree", metavar = "DIR",
+		default = os.path.join(os.path.dirname(os.path.abspath(sys.argv[0])), "..", ".."),
+		help = "FastTrie checkout to test (default: this one)")
+parser.add_option("--seed", type = "int", default = 1,
+		help = "seed of the synthetic data (default: %default)")
+parser.add_option("--python", metavar = "PATH", default = os.getenv("PYTHON", sys.executable),
+		help = "python to run fasttrie.py with (default: $PYTHON or this one)")
+
+(options, args) = parser.parse_args()
+
+sys.path.insert(0, os.path.join(options.tree, "fasttrie-gen"))
+import ftwriter
+
+# synthetic data, as text records and as the values ftwriter writes
+
+alphabet = "etaoinshrdlucmfwypvbgkjqxz0123456789"
+
+def word(rand):
+	return "".join([alphabet[int(rand.paretovariate(1.2)) % len(alphabet)]
+			for i in range(rand.randint(1, 12))])
+
+def words(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(word(rand))
+	return sorted(keys)
+
+def numbers(rand, n):
+	keys = set()
+	while len(keys) < n: keys.add(rand.randint(0, 0xFFFFFFFF))
+	return sorted(keys)
+
+def f32(x):
+	return struct.unpack("f", struct.pack("f", x))[0]
+
+def text(k):
+	return isinstance(k, str) and k or "%d" % k
+
+def number(rand):
+	v = rand.randint(-1000000, 1000000)
+	return ("%d" % v, v)
+
+def features(rand):
+	v = [(rand.randint(0, 999), f32(rand.randint(0, 9999) / 1024.0))
+			for i in range(rand.randint(1, 4))]
+	return ("".join(["%d:%r " % x for x in v]), v)
+
+def nested(rand):
+	v = dict([(k, rand.randint(-1000, 1000)) for k in words(rand, rand.randint(1, 4))])
+	return ("".join(["%s:%d," % (k, v[k]) for k in sorted(v)]), v)
+
+def pair(rand):
+	(a, b) = (rand.randint(-1000, 1000), word(rand))
+	return ("%d|%s" % (a, b), (a, b))
+
+def string(rand):
+	v = word(rand)
+	return (v, v)
+
+# name, format, key generator, value generator (None for sets and vectors)
+
+cases = [
+	("trie", r'T(c*)\t(l)\n', words, number),
+	("trie-uint32", r'T(L)\t(c*)\n', numbers, string),
+	("trie-struct-seq", r'T(c*)\t(l:f *)\n', words, features),
+	("trie-trie", r'T(c*)\t(T(c*):(l),)\n', words, nested),
+	("trie-pair", r'T(c*)\t(P(l)|(c*))\n', words, pair),
+	("trie-set", r'T(c*)\n', words, None),
+	("hash", r'H(c*)\t(l)\n', words, number),
+	("hash-uint32", r'H(L)\t(c*)\n', numbers, string),
+	("hash-set", r'H(c*)\n', words, None),
+	("vector", r'V(c*)\n', words, None),
+]
+
+fasttrie = os.path.join(options.tree, "fasttrie-gen", "fasttrie.py")
+
+def build(format, input, output, args = []):
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format] + args,
+			stdin = open(input, "rb"), stdout = open(output, "wb"))
+	if p.wait(): raise RuntimeError("fasttrie.py -f " + format + " failed")
+
+def check(name, condition):
+	if not condition: raise AssertionError(name)
+
+def read(filename):
+	f = open(filename, "rb")
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+def test(name, format, keys, value, tmpdir):
+	rand = random.Random(options.seed)
+	keys = keys(rand, options.keys)
+	rand.shuffle(keys)
+
+	txt = os.path.join(tmpdir, name + ".txt")
+	bin = os.path.join(tmpdir, name + ".bin")
+	ft = os.path.join(tmpdir, name + ".ft")
+
+	records = []
+	f = open(txt, "w")
+	for k in keys:
+		if value:
+			(t, v) = value(rand)
+			f.write("%s\t%s\n" % (text(k), t))
+			records.append((k, v))
+		else:
+			f.write("%s\n" % text(k))
+			records.append(k)
+	f.close()
+
+	f = open(bin, "wb")
+	ftwriter.write(f, format, records)
+	f.close()
+
+	data = read(bin)
+
+	build(format, txt, ft)
+	expected = read(ft)
+	build(format, bin, ft, ["-i", "binary"])
+	check("same as text", read(ft) == expected)
+
+	if format[0] == "T" and isinstance(keys[0], str):
+		# in order, as a Trie needs them with --sorted
+		f = open(bin, "wb")
+		ftwriter.write(f, format, sorted(records))
+		f.close()
+		build(format, bin, ft, ["-i", "binary", "-s"])
+		check("sorted same as text", read(ft) == expected)
+
+	# input cut short fails
+	f = open(bin, "wb")
+	f.write(data[:-1])
+	f.close()
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format,
+			"-i", "binary"], stdin = open(bin, "rb"), stdout = open(ft, "wb"),
+			stderr = subprocess.PIPE)
+	p.communicate()
+	check("cut short fails", p.returncode != 0)
+
+# keys of 16 and 8 bytes of the same MurmurHash64A of PerfectHash: the 8
+# bytes b after a make the state of a || b that of c, as multiplying by m
+# and the mix of a block are invertible
+
+def collision(rand):
+	m = 0xC6A4A7935BD1E995
+	mask = (1 << 64) - 1
+	inverse = m
+	for i in range(6): inverse = inverse * (2 - m * inverse) & mask
+
+	def block(x):
+		x = x * m & mask
+		return (x ^ x >> 47) * m & mask
+
+	def unblock(y):
+		y = y * inverse & mask
+		return (y ^ y >> 47) * inverse & mask
+
+	while True:
+		(a, c) = ("".join([rand.choice(alphabet) for i in range(8)]) for i in range(2))
+		(x, z) = (struct.unpack("<Q", k.encode())[0] for k in (a, c))
+		y = unblock(((16 * m & mask ^ block(x)) * m & mask) ^ (8 * m & mask) ^ block(z))
+		b = struct.pack("<Q", y)
+		if not set(b) & set(b"\0\t\r\n"): return (a.encode() + b, c.encode())
+
+def collide(tmpdir):
+	format = r'H,PerfectHash(c*)\t(l)\n'
+	txt = os.path.join(tmpdir, "collision.txt")
+	ft = os.path.join(tmpdir, "collision.ft")
+
+	f = open(txt, "wb")
+	for (i, k) in enumerate(collision(random.Random(options.seed)) + (b"other",)):
+		f.write(k + b"\t" + str(i).encode() + b"\n")
+	f.close()
+
+	p = subprocess.Popen([options.python, fasttrie, "-I", options.tree, "-f", format],
+			stdin = open(txt, "rb"), stdout = open(ft, "wb"), stderr = subprocess.PIPE)
+	error = p.communicate()[1]
+	check("same hash fails", p.returncode != 0)
+	check("same hash reported", b"same hash" in error and b"increasing order" not in error)
+
+	# and the default hash takes them
+	build(r'H(c*)\t(l)\n', txt, ft)
+
+tmpdir = tempfile.mkdtemp()
+failures = 0
+try:
+	for (name, format, keys, value) in cases:
+		if options.case and name not in options.case: continue
+		try:
+			test(name, format, keys, value, tmpdir)
+			sys.stderr.write("%-20s %-32s ok\n" % (name, format))
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-20s %-32s !!!failed: %s!!!\n" % (name, format, sys.exc_info()[1]))
+
+	if not options.case or "hash-collision" in options.case:
+		format = r'H,PerfectHash(c*)\t(l)\n'
+		try:
+			collide(tmpdir)
+			sys.stderr.write("%-20s %-32s ok\n" % ("hash-collision", format))
+		except AssertionError:
+			failures += 1
+			sys.stderr.write("%-20s %-32s !!!failed: %s!!!\n"
+					% ("hash-collision", format, sys.exc_info()[1]))
+finally:
+	shutil.rmtree(tmpdir)
+
+sys.exit(failures and 1 or 0)